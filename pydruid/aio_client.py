@@ -0,0 +1,379 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+import codecs
+import json
+import ssl
+
+from pydruid.client import BaseDruidClient, CHUNK_SIZE, HTML_ERROR
+from pydruid.utils import sharding, transport
+from pydruid.utils.query_utils import RowSplitter
+
+try:
+    import aiohttp
+except ImportError:
+    print("Warning: unable to import aiohttp. The asyncio client will not work.")
+
+
+class AioPyDruid(BaseDruidClient):
+    """
+    Asynchronous PyDruid client for asyncio, using aiohttp.
+
+    Query methods return awaitables resolving to Query objects, like the
+    methods of PyDruid return them. The client keeps a session with a pool of
+    keep-alive connections to the broker, and sends up to `max_concurrency`
+    queries at the same time; more queries wait for their turn.
+
+    The session is bound to the event loop using it first; call `close`, or
+    use the client as an async context manager, to release the connections.
+    A closed client can be used again, in the same or in another event loop.
+
+    :param str url: URL of Broker node in the Druid cluster
+    :param str endpoint: Endpoint that Broker listens for queries on
+    :param str cafile: Optional cafile that point to a single file
+        containing a bundle of CA certificates
+    :param int max_concurrency: Maximum number of queries sent at once, which
+        is also the maximum number of connections to the broker
+    :param float connect_timeout: Timeout in seconds to connect to the broker
+    :param float read_timeout: Timeout in seconds waiting for the broker to
+        send data
+    :param str result_parsing: How results are parsed, `eager`, `lazy` or
+        `passthrough`, like for PyDruid
+
+    Example
+
+    .. code-block:: python
+        :linenos:
+
+            >>> from pydruid.aio_client import *
+
+            >>> async with AioPyDruid('http://localhost:8083', 'druid/v2/') as client:
+            ...     top = await client.topn(
+                        datasource='twitterstream',
+                        granularity='all',
+                        intervals='2013-10-04/pt1h',
+                        aggregations={"count": doublesum("count")},
+                        dimension='user_name',
+                        filter=Dimension('user_lang') == 'en',
+                        metric='count',
+                        threshold=2
+                    )
+
+            >>> print top.result
+            >>> [{'timestamp': '2013-10-04T00:00:00.000Z',
+                'result': [{'count': 7.0, 'user_name': 'user_1'},
+                {'count': 6.0, 'user_name': 'user_2'}]}]
+    """
+
+    def __init__(
+        self,
+        url,
+        endpoint,
+        cafile=None,
+        http_headers=None,
+        max_concurrency=10,
+        connect_timeout=None,
+        read_timeout=None,
+        json_codec=None,
+        response_format="json",
+        compress_requests_over=None,
+        coalesce=False,
+        result_parsing="eager",
+    ):
+        super(AioPyDruid, self).__init__(
+            url,
+            endpoint,
+            http_headers=http_headers,
+            json_codec=json_codec,
+            response_format=response_format,
+            compress_requests_over=compress_requests_over,
+            coalesce=coalesce,
+            result_parsing=result_parsing,
+        )
+        self.context = None
+        if cafile:
+            self.context = ssl.create_default_context()
+            self.context.load_verify_locations(cafile=cafile)
+        self.max_concurrency = max_concurrency
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._session = None
+        self._semaphore = None
+        self._loop = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """Close the connections to the broker."""
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    def _get_session(self):
+        loop = asyncio.get_running_loop()
+        open_session = self._session is not None and not self._session.closed
+        if open_session and self._loop is not loop:
+            # the connections of the session belong to the other loop, and
+            # can't be closed from this one
+            raise RuntimeError(
+                "The client is used in another event loop: close it with "
+                "`await client.close()` before using it in a new one"
+            )
+        if not open_session:
+            # sessions and semaphores can't be shared between event loops
+            connector = aiohttp.TCPConnector(
+                limit=self.max_concurrency, ssl=self.context or True
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=self.connect_timeout,
+                sock_read=self.read_timeout,
+            )
+            # bodies are decompressed by the client, to support zstd and count
+            # the bytes received
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=timeout, auto_decompress=False
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._session
+
+    async def _open(self, query, response_format=None):
+        """Send the query to the broker, returning the HTTP response."""
+        headers, querystr, url = self._prepare_url_headers_and_body(
+            query, response_format
+        )
+        proxy = None
+        if self.proxies:
+            proxy = self.proxies.get(url.split(":", 1)[0])
+
+        response = await self._get_session().post(
+            url, data=querystr, headers=headers, proxy=proxy
+        )
+        if response.status != 200:
+            try:
+                body = await response.read()
+            finally:
+                response.release()
+            self._handle_http_error(response, body, query)
+        return response
+
+    @staticmethod
+    def _handle_http_error(response, body, query):
+        err = transport.decompress(body, response.headers.get("Content-Encoding"))
+        err = err.decode("utf-8", "replace")
+        if response.status == 500:
+            # has Druid returned an error?
+            try:
+                err = json.loads(err).get("error", err)
+            except (ValueError, AttributeError):
+                if HTML_ERROR.search(err):
+                    err = HTML_ERROR.search(err).group(1)
+        raise IOError(
+            "HTTP Error {0}: {1}\n Druid Error: {2}\n Query is: {3}".format(
+                response.status,
+                response.reason,
+                err,
+                json.dumps(
+                    query.query_dict, indent=4, sort_keys=True, separators=(",", ": ")
+                ),
+            )
+        )
+
+    async def cancel(self, query):
+        url, headers = self._prepare_cancel(query)
+        proxy = None
+        if self.proxies:
+            proxy = self.proxies.get(url.split(":", 1)[0])
+
+        async with self._get_session().delete(
+            url, headers=headers, proxy=proxy
+        ) as response:
+            # the query may have completed already
+            if response.status not in (200, 202, 404):
+                raise IOError(
+                    "Unable to cancel the query: HTTP Error {0}: {1}".format(
+                        response.status, response.reason
+                    )
+                )
+
+    async def _cancel_quietly(self, query):
+        # shielded, as this runs when the task sending the query is cancelled
+        try:
+            await asyncio.shield(self.cancel(query))
+        except Exception:
+            pass
+
+    async def _post(self, query):
+        self._set_query_id(query)
+        if not self.coalesce:
+            return await self._fetch(query)
+
+        # identical queries share the task of the first one; there's no need
+        # for a lock as everything runs in the event loop
+        key = query.fingerprint
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._fetch(query))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # a caller being cancelled mustn't cancel the query for the others
+        shared = await asyncio.shield(task)
+        return self._share(shared, query)
+
+    async def _fetch(self, query):
+        self._get_session()
+        async with self._semaphore:
+            try:
+                response = await self._open(query)
+                try:
+                    body = await response.read()
+                finally:
+                    response.release()
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                # don't leave the query running in the cluster
+                await self._cancel_quietly(query)
+                raise
+
+        encoding = response.headers.get("Content-Encoding")
+        data = b"".join(self._decode_body(query, encoding, [body]))
+        return self._parse(query, data)
+
+    async def _post_sharded(self, query, shards):
+        self._set_query_id(query)
+        queries = sharding.split_query(query, shards)
+        queries = await asyncio.gather(*[self._post(query) for query in queries])
+        return sharding.merge_results(
+            query,
+            queries,
+            self.json_codec,
+            decode=self.result_parsing != "passthrough",
+        )
+
+    async def stream(self, query, chunk_size=CHUNK_SIZE):
+        """
+        Execute a query, yielding the items of the result as they arrive.
+
+        This is an async generator, like `PyDruid.stream`.
+        """
+        self._get_session()
+        async with self._semaphore:
+            try:
+                response = await self._open(query, "json")
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                await self._cancel_quietly(query)
+                raise
+            completed = False
+            try:
+                decoder = transport.BodyDecoder(
+                    response.headers.get("Content-Encoding"), query.transfer_stats
+                )
+                text_decoder = codecs.getincrementaldecoder("utf-8")()
+                splitter = RowSplitter()
+                loads = self.json_codec.loads
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    text = text_decoder.decode(decoder.decode(chunk))
+                    for row in splitter.parse(text, loads):
+                        yield row
+                text = text_decoder.decode(decoder.flush(), final=True)
+                for row in splitter.parse(text, loads):
+                    yield row
+                completed = True
+            finally:
+                response.release()
+                if not completed:
+                    # the results are given up on, e.g. the task was cancelled
+                    await self._cancel_quietly(query)
+
+    def scan(self, **kwargs):
+        """
+        A scan query returns raw Druid rows.
+
+        See `PyDruid.scan` for the arguments.
+        """
+        query = self.query_builder.scan(kwargs)
+        return self._post(query)
+
+    def scan_iter(self, **kwargs):
+        """
+        Stream the results of a scan query, yielding one block of events at a
+        time as an async generator.
+        """
+        query = self.query_builder.scan(kwargs)
+        return self.stream(query)
+
+    def search(self, **kwargs):
+        """
+        A search query returns dimension values matching the search
+        specification.
+
+        :param str datasource: Data source to query
+        :param str granularity: Time bucket to aggregate data by hour, day, minute, etc.
+        :param intervals: ISO-8601 intervals for which to run the query on
+        :type intervals: str or list
+        :param dict query: Search query spec, e.g.
+          `{"type": "insensitive_contains", "value": "druid"}`
+        :param list searchDimensions: Dimensions to search in
+        """
+        query = self.query_builder.search(kwargs)
+        return self._post(query)
+
+    def execute_many(self, queries, max_concurrency=None, as_completed=False):
+        """
+        Execute several queries concurrently.
+
+        Queries are given like for `PyDruid.execute_many`. This returns an
+        awaitable resolving to the results in order, with exceptions in place
+        of the failed queries; with `as_completed`, it returns an async
+        generator of `(index, result)` tuples instead.
+
+        :param int max_concurrency: maximum number of queries of the batch
+          sent at once, in addition to the limit of the client
+        """
+        queries = [self._build_batch_query(query) for query in queries]
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+        async def execute(index, query):
+            if isinstance(query, Exception):
+                return index, query
+            try:
+                if semaphore is None:
+                    return index, await self._post(query)
+                async with semaphore:
+                    return index, await self._post(query)
+            except Exception as e:
+                return index, e
+
+        tasks = [execute(index, query) for index, query in enumerate(queries)]
+        if as_completed:
+            return self._as_completed(tasks)
+        return self._gather(tasks)
+
+    @staticmethod
+    async def _gather(tasks):
+        return [result for _, result in await asyncio.gather(*tasks)]
+
+    @staticmethod
+    async def _as_completed(tasks):
+        tasks = [asyncio.ensure_future(task) for task in tasks]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # don't send the queries left if the caller stops early
+            for task in tasks:
+                task.cancel()
@@ -16,9 +16,10 @@
 import json
 
 from pydruid.client import BaseDruidClient
+from pydruid.utils import transport
 
 try:
-    from tornado import gen
+    from tornado import gen, locks
     from tornado.httpclient import AsyncHTTPClient, HTTPError
 except ImportError:
     print("Warning: unable to import Tornado. The asynchronous client will not work.")
@@ -39,6 +40,10 @@ class AsyncPyDruid(BaseDruidClient):
     :param dict defaults: (optional) Dict of parameters for the Async HTTP Client subclass
     :param str http_client: Tornado HTTP client implementation to use.
         Default: None (use simple_httpclient)
+    :param bool coalesce: Send identical queries issued concurrently only
+        once, sharing the results between the callers
+    :param str result_parsing: How results are parsed, `eager`, `lazy` or
+        `passthrough`, like for PyDruid
 
     Example
 
@@ -95,25 +100,108 @@ class AsyncPyDruid(BaseDruidClient):
                 1      6  2013-10-04T00:00:00.000Z         user_2
     """
 
-    def __init__(self, url, endpoint, defaults=None, http_client=None):
-        super(AsyncPyDruid, self).__init__(url, endpoint)
+    def __init__(
+        self,
+        url,
+        endpoint,
+        defaults=None,
+        http_client=None,
+        json_codec=None,
+        response_format="json",
+        compress_requests_over=None,
+        coalesce=False,
+        result_parsing="eager",
+    ):
+        super(AsyncPyDruid, self).__init__(
+            url,
+            endpoint,
+            json_codec=json_codec,
+            response_format=response_format,
+            compress_requests_over=compress_requests_over,
+            coalesce=coalesce,
+            result_parsing=result_parsing,
+        )
         self.async_http_defaults = defaults
         self.http_client = http_client
 
     @gen.coroutine
     def _post(self, query):
+        if not self.coalesce:
+            result = yield self._fetch(query)
+            raise gen.Return(result)
+
+        # identical queries share the future of the first one; there's no need
+        # for a lock as everything runs in the IO loop
+        key = query.fingerprint
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._inflight[key] = self._fetch(query)
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        shared = yield future
+        raise gen.Return(self._share(shared, query))
+
+    @gen.coroutine
+    def _fetch(self, query):
         AsyncHTTPClient.configure(self.http_client, defaults=self.async_http_defaults)
         http_client = AsyncHTTPClient()
         try:
             headers, querystr, url = self._prepare_url_headers_and_body(query)
+            # the body is decompressed here, to support zstd and record the
+            # number of bytes received
             response = yield http_client.fetch(
-                url, method="POST", headers=headers, body=querystr
+                url,
+                method="POST",
+                headers=headers,
+                body=querystr,
+                decompress_response=False,
             )
         except HTTPError as e:
+            if e.code == 599:
+                # the request timed out, don't leave the query running
+                try:
+                    yield self.cancel(query)
+                except Exception:
+                    pass
             self.__handle_http_error(e, query)
         else:
-            query.parse(response.body.decode("utf-8"))
-            raise gen.Return(query)
+            encoding = response.headers.get("Content-Encoding")
+            data = b"".join(self._decode_body(query, encoding, [response.body]))
+            raise gen.Return(self._parse(query, data))
+
+    @gen.coroutine
+    def cancel(self, query):
+        url, headers = self._prepare_cancel(query)
+        AsyncHTTPClient.configure(self.http_client, defaults=self.async_http_defaults)
+        try:
+            yield AsyncHTTPClient().fetch(url, method="DELETE", headers=headers)
+        except HTTPError as e:
+            # the query may have completed already
+            if e.code != 404:
+                raise IOError("Unable to cancel the query: {0}".format(e))
+
+    @gen.coroutine
+    def execute_many(self, queries, max_concurrency=10):
+        """
+        Execute several queries concurrently.
+
+        Queries are given like for `PyDruid.execute_many`, and the results are
+        returned in order, with exceptions in place of the failed queries.
+        """
+        semaphore = locks.Semaphore(max_concurrency)
+
+        @gen.coroutine
+        def execute(query):
+            if isinstance(query, Exception):
+                raise gen.Return(query)
+            with (yield semaphore.acquire()):
+                try:
+                    result = yield self._post(query)
+                except Exception as e:
+                    result = e
+            raise gen.Return(result)
+
+        results = yield [execute(self._build_batch_query(query)) for query in queries]
+        raise gen.Return(results)
 
     @staticmethod
     def __handle_http_error(e, query):
@@ -121,7 +209,10 @@ class AsyncPyDruid(BaseDruidClient):
         if e.code == 500:
             # has Druid returned an error?
             try:
-                err = json.loads(e.response.body.decode("utf-8"))
+                body = transport.decompress(
+                    e.response.body, e.response.headers.get("Content-Encoding")
+                )
+                err = json.loads(body.decode("utf-8"))
             except ValueError:
                 pass
             else:
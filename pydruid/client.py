@@ -13,25 +13,86 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import codecs
+import concurrent.futures
+import gzip
 import json
 import re
 import ssl
+import threading
+import time
 import urllib.error
+import urllib.parse
 import urllib.request
+import uuid
 from base64 import b64encode
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from pydruid.query import QueryBuilder
+from pydruid.query import Query, QueryBuilder
+from pydruid.utils import sharding, smile, transport
+from pydruid.utils.balancer import BrokerPool
+from pydruid.utils.cache import execute_cached
+from pydruid.utils.json_codec import get_codec
+from pydruid.utils.query_utils import rows_from_chunks
+from pydruid.utils.transport import ACCEPT_ENCODING, ConnectionPool, KeepAliveHandler
 
 # extract error from the <PRE> tag inside the HTML response
 HTML_ERROR = re.compile("<pre>\\s*(.*?)\\s*</pre>", re.IGNORECASE)
 
+# content types of the formats native query results can be requested in
+RESPONSE_FORMATS = {"json": "application/json", "smile": smile.CONTENT_TYPE}
+
+# how results are parsed: when they're received, on first access to
+# `Query.result`, or on first access without decoding `Query.result_json`
+RESULT_PARSING = ("eager", "lazy", "passthrough")
+
+# number of bytes read at once when streaming a response
+CHUNK_SIZE = 64 * 1024
+
+# query builder methods that `execute_many` accepts as `query_type`
+BATCH_QUERY_TYPES = (
+    "topn",
+    "timeseries",
+    "groupby",
+    "search",
+    "select",
+    "scan",
+    "segment_metadata",
+    "time_boundary",
+)
+
 
 class BaseDruidClient(object):
-    def __init__(self, url, endpoint, http_headers=None):
+    def __init__(
+        self,
+        url,
+        endpoint,
+        http_headers=None,
+        json_codec=None,
+        response_format="json",
+        compress_requests_over=None,
+        coalesce=False,
+        result_parsing="eager",
+    ):
+        if response_format not in RESPONSE_FORMATS:
+            raise ValueError(
+                "Unsupported response format: {0}".format(response_format)
+            )
+        if result_parsing not in RESULT_PARSING:
+            raise ValueError("Unsupported result parsing: {0}".format(result_parsing))
+
         self.url = url
         self.endpoint = endpoint
         self.query_builder = QueryBuilder()
         self.http_headers = http_headers or {}
+        self.json_codec = get_codec(json_codec)
+        self.response_format = response_format
+        self.compress_requests_over = compress_requests_over
+        self.coalesce = coalesce
+        self.result_parsing = result_parsing
+        # queries being sent, by fingerprint
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
         self.username = None
         self.password = None
         self.proxies = None
@@ -42,25 +103,114 @@ class BaseDruidClient(object):
 
     def set_proxies(self, proxies):
         self.proxies = proxies
-        proxy_support = urllib.request.ProxyHandler(proxies)
-        opener = urllib.request.build_opener(proxy_support)
-        urllib.request.install_opener(opener)
-
-    def _prepare_url_headers_and_body(self, query):
-        querystr = json.dumps(query.query_dict).encode("utf-8")
-        if self.url.endswith("/"):
-            url = self.url + self.endpoint
-        else:
-            url = self.url + "/" + self.endpoint
+
+    def _prepare_url_headers_and_body(self, query, response_format=None, url=None):
+        self._set_query_id(query)
+        querystr = self.json_codec.dumps(query.query_dict)
+        url = self._endpoint_url(url)
         headers = {"Content-Type": "application/json"}
+        if (
+            self.compress_requests_over is not None
+            and len(querystr) > self.compress_requests_over
+        ):
+            querystr = gzip.compress(querystr)
+            headers["Content-Encoding"] = "gzip"
+        headers["Accept-Encoding"] = ACCEPT_ENCODING
+        response_format = response_format or self.response_format
+        if response_format != "json":
+            headers["Accept"] = RESPONSE_FORMATS[response_format]
+        headers.update(self._auth_headers())
+
+        query.transfer_stats = {
+            "request_bytes": len(querystr),
+            "response_bytes": 0,
+            "decoded_bytes": 0,
+            "content_encoding": None,
+        }
+        return headers, querystr, url
+
+    def _endpoint_url(self, url=None):
+        url = url or self.url
+        if url.endswith("/"):
+            return url + self.endpoint
+        return url + "/" + self.endpoint
+
+    def _auth_headers(self):
+        headers = {}
         if (self.username is not None) and (self.password is not None):
             authstring = "{}:{}".format(self.username, self.password)
             b64string = b64encode(authstring.encode()).decode()
             headers["Authorization"] = "Basic {}".format(b64string)
 
         headers.update(self.http_headers)
+        return headers
+
+    @staticmethod
+    def _set_query_id(query):
+        """Give a query a random `queryId` in its context, unless it has one."""
+        context = query.query_dict.get("context") or {}
+        if context.get("queryId") is None:
+            # the context may be shared with other queries
+            context = dict(context, queryId=str(uuid.uuid4()))
+            query.query_dict["context"] = context
+        return context["queryId"]
+
+    def _prepare_cancel(self, query, url=None):
+        """
+        Return the URL and headers of the request cancelling a query.
 
-        return headers, querystr, url
+        :param query: a Query, or the `queryId` of a query
+        :param str url: URL of the broker running the query
+        """
+        query_id = query if isinstance(query, str) else query.query_id
+        if query_id is None:
+            raise ValueError("The query has no queryId, it was never sent")
+        url = "{0}/{1}".format(
+            self._endpoint_url(url).rstrip("/"), urllib.parse.quote(query_id, safe="")
+        )
+        return url, self._auth_headers()
+
+    def cancel(self, query):
+        """
+        Cancel a query running in the cluster.
+
+        Queries are given a random `queryId` in their context when they're
+        sent, unless they have one; the broker is asked to cancel the queries
+        with that id, freeing the historicals that are still processing it.
+
+        :param query: a Query sent by this client, or its `queryId`
+        """
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def _cancel_quietly(self, query, *args):
+        """Cancel a query that's being given up on, ignoring errors."""
+        try:
+            self.cancel(query, *args)
+        except Exception:
+            pass
+
+    @staticmethod
+    def _decode_body(query, content_encoding, chunks):
+        """
+        Generate the decompressed chunks of a response body.
+
+        The transfer statistics of the query are updated as the chunks are
+        decompressed.
+        """
+        decoder = transport.BodyDecoder(content_encoding, query.transfer_stats)
+        for chunk in chunks:
+            yield decoder.decode(chunk)
+        yield decoder.flush()
+
+    def _parse(self, query, data):
+        """Fill the query with the result from the body of the response."""
+        query.parse(
+            data,
+            self.json_codec,
+            lazy=self.result_parsing != "eager",
+            decode=self.result_parsing != "passthrough",
+        )
+        return query
 
     def _post(self, query):
         """
@@ -73,6 +223,59 @@ class BaseDruidClient(object):
         """
         raise NotImplementedError("Subclasses must implement this method")
 
+    def _post_coalesced(self, query, post):
+        """
+        Fills Query object with results, sharing identical concurrent queries.
+
+        Only the first of the queries with the same fingerprint is sent, with
+        `post`; the other callers wait for it and get its results.
+        """
+        key = query.fingerprint
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            return self._share(future.result(), query)
+
+        try:
+            future.set_result(post(query))
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+        return query
+
+    @staticmethod
+    def _share(shared, query):
+        """Fill a query with the results of an identical query."""
+        if shared is not query:
+            query.copy_result(shared)
+        return query
+
+    def _post_sharded(self, query, shards):
+        """
+        Fills Query object with results, splitting it by interval.
+
+        The shards are sent concurrently from a thread pool.
+        """
+        # the shards share the id of the query, so that they're cancelled
+        # together
+        self._set_query_id(query)
+        queries = sharding.split_query(query, shards)
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            queries = list(executor.map(self._post, queries))
+        return sharding.merge_results(
+            query,
+            queries,
+            self.json_codec,
+            decode=self.result_parsing != "passthrough",
+        )
+
     # --------- Query implementations ---------
 
     def topn(self, **kwargs):
@@ -153,6 +356,9 @@ class BaseDruidClient(object):
         :param post_aggregations:   A dict with string key =
           'post_aggregator_name', and value pydruid.utils.PostAggregator
         :param dict context: A dict of query context options
+        :param int shards: Split the intervals into up to this many shards,
+          aligned to the granularity, and run them concurrently. This raises
+          a ValueError if the results of the shards can't be merged exactly.
 
         Example:
 
@@ -174,7 +380,10 @@ class BaseDruidClient(object):
                     'result': {'count': 9619.0, 'rows': 8007,
                     'percent': 120.13238416385663}}]
         """
+        shards = kwargs.pop("shards", None)
         query = self.query_builder.timeseries(kwargs)
+        if shards:
+            return self._post_sharded(query, shards)
         return self._post(query)
 
     def topn_sub_query(self, **kwargs):
@@ -264,6 +473,9 @@ class BaseDruidClient(object):
         :param dict context: A dict of query context options
         :param dict limit_spec: A dict of parameters defining how to limit
           the rows returned, as specified in the Druid api documentation
+        :param int shards: Split the intervals into up to this many shards,
+          aligned to the granularity, and run them concurrently. This raises
+          a ValueError if the results of the shards can't be merged exactly.
 
         Example:
 
@@ -306,7 +518,10 @@ class BaseDruidClient(object):
                     }
                 }
         """
+        shards = kwargs.pop("shards", None)
         query = self.query_builder.groupby(kwargs)
+        if shards:
+            return self._post_sharded(query, shards)
         return self._post(query)
 
     def segment_metadata(self, **kwargs):
@@ -444,6 +659,95 @@ class BaseDruidClient(object):
         query = self.query_builder.select(kwargs)
         return self._post(query)
 
+    def execute_many(self, queries, max_concurrency=10, as_completed=False):
+        """
+        Execute several queries concurrently.
+
+        Each query is either a Query, e.g. built with `client.query_builder`,
+        or a dict of query arguments with a `query_type` naming the method of
+        the query builder to build it with, e.g. `topn` or `search`.
+
+        The queries are sent from a pool of `max_concurrency` threads, which
+        share the keep-alive connections of the client. A query that fails,
+        or can't be built, doesn't abort the others: its exception is
+        returned in place of its result.
+
+        :param list queries: the queries to execute
+        :param int max_concurrency: maximum number of queries sent at once
+        :param bool as_completed: yield `(index, result)` tuples as queries
+          complete, instead of returning the results in order
+
+        :return: The Query objects filled with results, or exceptions
+        :rtype: list
+
+        Example:
+
+        .. code-block:: python
+            :linenos:
+
+                >>> results = client.execute_many([
+                        {
+                            'query_type': 'timeseries',
+                            'datasource': 'twitterstream',
+                            'granularity': 'day',
+                            'intervals': '2013-06-14/p1d',
+                            'aggregations': {"count": doublesum("count")},
+                        },
+                        client.query_builder.time_boundary(
+                            {'datasource': 'twitterstream'}
+                        ),
+                    ])
+        """
+        queries = [self._build_batch_query(query) for query in queries]
+        if as_completed:
+            return self._execute_as_completed(queries, max_concurrency)
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = [self._submit(executor, query) for query in queries]
+        return [self._batch_result(future) for future in futures]
+
+    def _build_batch_query(self, query):
+        if isinstance(query, Query):
+            return query
+        args = dict(query)
+        query_type = args.pop("query_type", None)
+        if query_type not in BATCH_QUERY_TYPES:
+            return ValueError("Unsupported query type: {0}".format(query_type))
+        try:
+            return getattr(self.query_builder, query_type)(args)
+        except Exception as e:
+            return e
+
+    def _submit(self, executor, query):
+        future = Future()
+        if isinstance(query, Exception):
+            future.set_exception(query)
+            return future
+        return executor.submit(self._post, query)
+
+    @staticmethod
+    def _batch_result(future):
+        try:
+            return future.result()
+        except Exception as e:
+            return e
+
+    def _execute_as_completed(self, queries, max_concurrency):
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {
+                self._submit(executor, query): index
+                for index, query in enumerate(queries)
+            }
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    yield futures[future], self._batch_result(future)
+            finally:
+                # don't send the queries left if the caller stops early, and
+                # cancel those running in the cluster
+                for future, index in futures.items():
+                    if not future.cancel() and not future.done():
+                        self._cancel_quietly(queries[index])
+
     def export_tsv(self, dest_path):
         """
         Export the current query result to a tsv file.
@@ -479,11 +783,36 @@ class PyDruid(BaseDruidClient):
     Returns Query objects that can be used for exporting query results
     into TSV files or pandas.DataFrame objects for subsequent analysis.
 
-    :param str url: URL of Broker node in the Druid cluster
+    :param url: URL of Broker node in the Druid cluster, or a list of URLs of
+    brokers or routers; queries are then sent to the one with the fewest
+    requests in flight, and brokers that can't be reached are ejected for a
+    while (see `pydruid.utils.balancer`)
+    :type url: str or list
     :param str endpoint: Endpoint that Broker listens for queries on
     :param str cafile: Optional cafile that point to a single file
     containing a bundle of CA certificates, useful when using Imply Cloud or
     other Druid deployments via HTTPS.
+    :param int pool_size: Maximum number of idle keep-alive connections kept
+    per broker. The client is thread-safe, and concurrent queries use
+    separate connections.
+    :param float connect_timeout: Timeout in seconds to connect to the broker
+    :param float read_timeout: Timeout in seconds waiting for the broker to
+    send data
+    :param pydruid.utils.cache.Cache cache: Optional cache of the results of
+    timeseries, topN and groupBy queries; only the granularity buckets that
+    aren't cached are fetched from the broker
+    :param bool coalesce: Send identical queries issued concurrently from
+    several threads only once, sharing the results between the callers
+    :param float health_check_interval: With several brokers, seconds between
+    checks of their `/status/health` endpoint, in a background thread;
+    unhealthy brokers are ejected until they pass a check
+    :param bool hedge: With several brokers, send a query to a second broker
+    when the first one takes longer than the 95th percentile of the recent
+    queries; the slower of the two is cancelled
+    :param str result_parsing: `eager` to parse results when they're received,
+    `lazy` to parse them on the first access to `Query.result`, or
+    `passthrough` to also keep `Query.result_json` as the bytes received,
+    for callers that forward it without looking at the result
 
     Example
 
@@ -549,22 +878,101 @@ class PyDruid(BaseDruidClient):
                 1      6  2013-10-04T00:00:00.000Z         user_2
     """
 
-    def __init__(self, url, endpoint, cafile=None, http_headers=None):
-        super(PyDruid, self).__init__(url, endpoint, http_headers=http_headers)
+    def __init__(
+        self,
+        url,
+        endpoint,
+        cafile=None,
+        http_headers=None,
+        pool_size=10,
+        connect_timeout=None,
+        read_timeout=None,
+        json_codec=None,
+        response_format="json",
+        compress_requests_over=None,
+        cache=None,
+        coalesce=False,
+        health_check_interval=None,
+        hedge=False,
+        result_parsing="eager",
+    ):
+        urls = url if isinstance(url, (list, tuple)) else None
+        super(PyDruid, self).__init__(
+            urls[0] if urls else url,
+            endpoint,
+            http_headers=http_headers,
+            json_codec=json_codec,
+            response_format=response_format,
+            compress_requests_over=compress_requests_over,
+            coalesce=coalesce,
+            result_parsing=result_parsing,
+        )
         self.context = None
         if cafile:
             self.context = ssl.create_default_context()
             self.context.load_verify_locations(cafile=cafile)
+        self.pool = ConnectionPool(
+            pool_size, connect_timeout, read_timeout, context=self.context
+        )
+        self.opener = self._build_opener()
+        self.cache = cache
+        self.brokers = None
+        if urls:
+            self.brokers = BrokerPool(
+                urls,
+                health_check=self._check_health,
+                health_check_interval=health_check_interval,
+            )
+        self.hedge = hedge
 
-    def _post(self, query):
+    def set_proxies(self, proxies):
+        super(PyDruid, self).set_proxies(proxies)
+        self.opener = self._build_opener()
+
+    def pool_stats(self):
+        """
+        Return statistics about the pooled HTTP connections.
+
+        For each broker this returns the number of connections opened, the
+        number of requests sent and the number of idle keep-alive connections.
+        """
+        return self.pool.stats()
+
+    def broker_stats(self):
+        """
+        Return the state of the brokers, when the client has several.
+
+        See `pydruid.utils.balancer.BrokerPool.stats`.
+        """
+        return self.brokers.stats() if self.brokers is not None else {}
+
+    def close(self):
+        """Close the idle connections to the brokers, and stop health checks."""
+        self.pool.close()
+        if self.brokers is not None:
+            self.brokers.close()
+
+    def _check_health(self, url):
+        req = urllib.request.Request(url.rstrip("/") + "/status/health")
+        with self.opener.open(req) as res:
+            return res.read().strip() == b"true"
+
+    def _build_opener(self):
+        handlers = [KeepAliveHandler(self.pool)]
+        if self.proxies is not None:
+            handlers.append(urllib.request.ProxyHandler(self.proxies))
+        return urllib.request.build_opener(*handlers)
+
+    def _open(self, query, response_format=None, broker=None):
+        """Send the query to the broker, returning the HTTP response."""
         try:
-            headers, querystr, url = self._prepare_url_headers_and_body(query)
+            headers, querystr, url = self._prepare_url_headers_and_body(
+                query, response_format, broker.url if broker else None
+            )
             req = urllib.request.Request(url, querystr, headers)
-            res = urllib.request.urlopen(url=req, context=self.context)
-            data = res.read().decode("utf-8")
-            res.close()
+            return self.opener.open(req)
         except urllib.error.HTTPError as e:
-            err = e.read()
+            err = transport.decompress(e.read(), e.headers.get("Content-Encoding"))
             if e.code == 500:
                 # has Druid returned an error?
                 try:
@@ -587,9 +995,188 @@ class PyDruid(BaseDruidClient):
                     ),
                 )
             )
+
+    def cancel(self, query, url=None):
+        """
+        Cancel a query running in the cluster.
+
+        Queries are given a random `queryId` in their context when they're
+        sent, unless they have one; the broker is asked to cancel the queries
+        with that id, freeing the historicals that are still processing it.
+
+        :param query: a Query sent by this client, or its `queryId`
+        :param str url: URL of the broker running the query; by default all the
+          brokers of the client are asked to cancel it
+        """
+        if url is not None:
+            urls = [url]
+        elif self.brokers is not None:
+            urls = [broker.url for broker in self.brokers.brokers]
         else:
-            query.parse(data)
-            return query
+            urls = [self.url]
+
+        error = None
+        for url in urls:
+            cancel_url, headers = self._prepare_cancel(query, url)
+            req = urllib.request.Request(cancel_url, headers=headers, method="DELETE")
+            try:
+                self.opener.open(req).close()
+            except urllib.error.HTTPError as e:
+                # the query may have completed already
+                if e.code != 404:
+                    error = error or IOError(
+                        "Unable to cancel the query: {0}".format(e)
+                    )
+            except urllib.error.URLError as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    def _post(self, query):
+        # the id is set before the query is split into the buckets to fetch
+        self._set_query_id(query)
+        if self.coalesce:
+            return self._post_coalesced(query, self._fetch)
+        return self._fetch(query)
+
+    def _fetch(self, query):
+        if self.cache is not None:
+            return execute_cached(
+                self.cache,
+                query,
+                self._send,
+                self.json_codec,
+                decode=self.result_parsing != "passthrough",
+            )
+        return self._send(query)
+
+    def _send(self, query):
+        if self.brokers is None:
+            return self._send_to(query, None)
+        if self.hedge:
+            return self._send_hedged(query)
+        return self._send_to(query, self.brokers.acquire())
+
+    def _send_to(self, query, broker):
+        """Send a query to a broker of the pool, or to the only broker."""
+        start = time.monotonic()
+        elapsed = None
+        failed = False
+        res = None
+        try:
+            res = self._open(query, broker=broker)
+            data = b"".join(self._read_body(res, query))
+            elapsed = time.monotonic() - start
+        except (ConnectionError, TimeoutError, urllib.error.URLError) as e:
+            # the broker can't be reached or is too slow
+            failed = True
+            if isinstance(e, TimeoutError) or isinstance(
+                getattr(e, "reason", None), TimeoutError
+            ):
+                # don't leave the query running in the cluster
+                self._cancel_quietly(query, broker.url if broker else None)
+            raise
+        finally:
+            if res is not None:
+                res.close()
+            if broker is not None:
+                self.brokers.release(broker, elapsed, failed)
+        return self._parse(query, data)
+
+    def _send_hedged(self, query):
+        """
+        Send a query, and send it again to another broker if it's slow.
+
+        The query is sent again when it takes longer than the 95th percentile
+        of the recent latencies; the first response wins, and the query still
+        running on the other broker is cancelled.
+        """
+        delay = self.brokers.hedge_delay()
+        first = self.brokers.acquire()
+        if delay is None:
+            return self._send_to(query, first)
+
+        # both attempts have the same id, and each fills its own copy of the
+        # query
+        self._set_query_id(query)
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            attempt = Query(query.query_dict, query.query_type)
+            attempts = {executor.submit(self._send_to, attempt, first): first}
+            done, _ = concurrent.futures.wait(attempts, timeout=delay)
+            if not done:
+                second = self.brokers.acquire(exclude=first)
+                if second is not None:
+                    attempt = Query(query.query_dict, query.query_type)
+                    attempts[executor.submit(self._send_to, attempt, second)] = second
+
+            error = None
+            pending = set(attempts)
+            while pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    if future.exception() is None:
+                        for loser in pending:
+                            self._cancel_quietly(query, attempts[loser].url)
+                        return self._share(future.result(), query)
+                    error = error or future.exception()
+            raise error
+        finally:
+            # the losing attempt isn't waited for
+            executor.shutdown(wait=False)
+
+    def stream(self, query, chunk_size=CHUNK_SIZE):
+        """
+        Execute a query, yielding the items of the result as they arrive.
+
+        Unlike the query methods, the response is never held in memory as a
+        whole: it is read `chunk_size` bytes at a time, and every complete item
+        of the top-level JSON array is parsed and yielded as soon as it has
+        been received. The query object is not filled with the results.
+        Results are always requested as JSON.
+
+        :param Query query: query to execute
+        :param int chunk_size: number of bytes read from the response at once
+
+        :return: A generator of result items
+        """
+        broker = self.brokers.acquire() if self.brokers is not None else None
+        try:
+            res = self._open(query, "json", broker)
+        except BaseException as e:
+            if broker is not None:
+                failed = isinstance(e, (ConnectionError, urllib.error.URLError))
+                self.brokers.release(broker, failed=failed)
+            raise
+        completed = False
+        try:
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            chunks = self._read_body(res, query, chunk_size)
+            chunks = (decoder.decode(chunk) for chunk in chunks)
+            for row in rows_from_chunks(chunks, self.json_codec):
+                yield row
+            completed = True
+        finally:
+            res.close()
+            if broker is not None:
+                self.brokers.release(broker)
+            if not completed:
+                # the results are given up on, e.g. the generator was closed
+                self._cancel_quietly(query, broker.url if broker else None)
+
+    def _read_body(self, res, query, chunk_size=None):
+        """
+        Generate the decompressed chunks of the response body.
+
+        The body is read at once unless a `chunk_size` is given.
+        """
+        if chunk_size is None:
+            chunks = [res.read()]
+        else:
+            chunks = iter(lambda: res.read1(chunk_size), b"")
+        return self._decode_body(query, res.headers.get("Content-Encoding"), chunks)
 
     def scan(self, **kwargs):
         """
@@ -612,6 +1199,12 @@ class PyDruid(BaseDruidClient):
         :param list metrics: The list of metrics to select. If left empty,
           all metrics are returned
         :param dict context: A dict of query context options
+        :param int batchSize: The maximum number of rows in each block of
+          the result
+        :param str resultFormat: `list` (the default) returns every event as
+          a dict, `compactedList` returns the values of each event as a list
+          in the order of the `columns` of its block. The latter is much
+          smaller on the wire and faster to parse
 
         :return: The query result
         :rtype: Query
@@ -639,3 +1232,35 @@ class PyDruid(BaseDruidClient):
         """
         query = self.query_builder.scan(kwargs)
         return self._post(query)
+
+    def scan_iter(self, **kwargs):
+        """
+        A scan query yielding the result one segment block at a time.
+
+        This takes the same arguments as :meth:`scan`, but the response is
+        parsed while it is being received, so memory usage is bounded by the
+        size of a block (see the `batchSize` parameter) rather than by the
+        size of the whole result. With `resultFormat='compactedList'`, each
+        block can be decoded into columns with
+        :func:`pydruid.utils.query_utils.scan_columns`.
+
+        :return: A generator of result blocks, each with `segmentId`,
+          `columns` and `events`
+
+        Example:
+
+        .. code-block:: python
+            :linenos:
+
+                >>> blocks = client.scan_iter(
+                        datasource=twitterstream,
+                        granularity='all',
+                        intervals='2013-06-14/pt1h',
+                        batchSize=1000,
+                    )
+                >>> for block in blocks:
+                >>>     for event in block['events']:
+                >>>         process(event)
+        """
+        query = self.query_builder.scan(kwargs)
+        return self.stream(query)
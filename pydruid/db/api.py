@@ -1,11 +1,30 @@
+import csv
+import gzip
 import itertools
-import json
+import time
+import uuid
 from collections import namedtuple, OrderedDict
 from urllib import parse
 
 import requests
 
 from pydruid.db import exceptions
+from pydruid.utils.balancer import BrokerPool
+from pydruid.utils.json_codec import get_codec
+from pydruid.utils.query_utils import (
+    columns_to_arrow,
+    LineSplitter,
+    rows_from_chunks,
+)
+
+# result formats supported by the cursor; `None` uses the server default
+RESULT_FORMATS = {None, "object", "objectLines", "arrayLines", "csv"}
+
+# result formats where each row is a single line
+LINE_FORMATS = {"objectLines", "arrayLines", "csv"}
+
+# result formats where rows don't carry the column names
+ARRAY_FORMATS = {"arrayLines", "csv"}
 
 
 class Type(object):
@@ -22,6 +41,7 @@ class BearerAuth(requests.auth.AuthBase):
         r.headers["Authorization"] = f"Bearer {self.token}"
         return r
 
+
 def connect(
     host="localhost",
     port=8082,
@@ -35,6 +55,11 @@ def connect(
     ssl_client_cert=None,
     proxies=None,
     jwt=None,
+    result_format=None,
+    pool_size=10,
+    json_codec=None,
+    compress_requests_over=None,
+    health_check_interval=None,
 ):  # noqa: E125
     """
     Constructor for creating a connection to the database.
@@ -42,6 +67,24 @@ def connect(
         >>> conn = connect('localhost', 8082)
         >>> curs = conn.cursor()
 
+    `host` can be a list of brokers or routers, as host names or `host:port`;
+    each query is sent to the one with the fewest queries in flight, and the
+    brokers that can't be reached are ejected for a while. With a
+    `health_check_interval`, their `/status/health` endpoint is checked in the
+    background, and unhealthy brokers are ejected until they pass a check.
+
+    The `result_format` can be set to one of the line-oriented formats
+    supported by Druid SQL (`objectLines`, `arrayLines` or `csv`), which are
+    decoded one line at a time instead of scanning a JSON array for rows.
+
+    Cursors from the same connection share a pool of up to `pool_size`
+    keep-alive connections to the broker.
+
+    Results are decoded with the fastest installed JSON backend, unless
+    `json_codec` names another one (see `pydruid.utils.json_codec`).
+
+    Results are received compressed with gzip when the broker supports it;
+    queries larger than `compress_requests_over` bytes are sent gzipped too.
     """
     context = context or {}
 
@@ -58,9 +101,23 @@ def connect(
         ssl_client_cert,
         proxies,
         jwt,
+        result_format,
+        pool_size,
+        json_codec,
+        compress_requests_over,
+        health_check_interval,
     )
 
 
+def create_session(pool_size):
+    """Create a session keeping up to `pool_size` connections alive per host."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 def check_closed(f):
     """Decorator that checks if connection/cursor is closed."""
 
@@ -141,9 +198,25 @@ class Connection(object):
         ssl_client_cert=None,
         proxies=None,
         jwt=None,
+        result_format=None,
+        pool_size=10,
+        json_codec=None,
+        compress_requests_over=None,
+        health_check_interval=None,
     ):
-        netloc = "{host}:{port}".format(host=host, port=port)
-        self.url = parse.urlunparse((scheme, netloc, path, None, None, None))
+        hosts = host if isinstance(host, (list, tuple)) else [host]
+        urls = []
+        for name in hosts:
+            netloc = name if ":" in name else "{0}:{1}".format(name, port)
+            urls.append(parse.urlunparse((scheme, netloc, path, None, None, None)))
+        self.url = urls[0]
+        self.brokers = None
+        if len(hosts) > 1:
+            self.brokers = BrokerPool(
+                urls,
+                health_check=self._check_health,
+                health_check_interval=health_check_interval,
+            )
         self.context = context or {}
         self.closed = False
         self.cursors = []
@@ -154,6 +227,10 @@ class Connection(object):
         self.ssl_client_cert = ssl_client_cert
         self.proxies = proxies
         self.jwt = jwt
+        self.result_format = result_format
+        self.session = create_session(pool_size)
+        self.json_codec = get_codec(json_codec)
+        self.compress_requests_over = compress_requests_over
 
     @check_closed
     def close(self):
@@ -164,6 +241,39 @@ class Connection(object):
                 cursor.close()
             except exceptions.Error:
                 pass  # already closed
+        self.session.close()
+        if self.brokers is not None:
+            self.brokers.close()
+
+    @check_closed
+    def pool_stats(self):
+        """
+        Return statistics about the pooled HTTP connections.
+
+        For each broker this returns the number of connections opened, the
+        number of requests sent and the number of idle keep-alive connections.
+        """
+        stats = {}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                url = "{0}://{1}:{2}".format(key.key_scheme, key.key_host, key.key_port)
+                stats[url] = {
+                    "connections": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "idle": sum(1 for conn in list(pool.pool.queue) if conn),
+                }
+        return stats
+
+    @check_closed
+    def broker_stats(self):
+        """
+        Return the state of the brokers, when the connection has several.
+
+        See `pydruid.utils.balancer.BrokerPool.stats`.
+        """
+        return self.brokers.stats() if self.brokers is not None else {}
 
     @check_closed
     def commit(self):
@@ -175,8 +285,13 @@ class Connection(object):
         pass
 
     @check_closed
-    def cursor(self):
-        """Return a new Cursor Object using the connection."""
+    def cursor(self, stream=False):
+        """
+        Return a new Cursor Object using the connection.
+
+        With `stream`, the cursor never holds the whole result in memory: it
+        doesn't count the rows, and its `rowcount` is -1.
+        """
 
         cursor = Cursor(
             self.url,
@@ -188,6 +303,12 @@ class Connection(object):
             self.ssl_client_cert,
             self.proxies,
             self.jwt,
+            self.result_format,
+            self.session,
+            self.json_codec,
+            self.compress_requests_over,
+            stream,
+            self.brokers,
         )
 
         self.cursors.append(cursor)
@@ -205,6 +326,18 @@ class Connection(object):
     def __exit__(self, *exc):
         self.close()
 
+    def _check_health(self, url):
+        scheme, netloc = parse.urlparse(url)[:2]
+        r = self.session.get(
+            "{0}://{1}/status/health".format(scheme, netloc),
+            verify=self.ssl_verify_cert,
+            cert=self.ssl_client_cert,
+            proxies=self.proxies,
+            timeout=self.brokers.health_check_interval,
+        )
+        r.close()
+        return r.status_code == 200
+
 
 class Cursor(object):
     """Connection cursor."""
@@ -220,7 +353,18 @@ class Cursor(object):
         ssl_client_cert=None,
         proxies=None,
         jwt=None,
+        result_format=None,
+        session=None,
+        json_codec=None,
+        compress_requests_over=None,
+        stream=False,
+        brokers=None,
     ):
+        if result_format not in RESULT_FORMATS:
+            raise exceptions.NotSupportedError(
+                "Result format {0} is not supported".format(result_format)
+            )
+
         self.url = url
         self.context = context or {}
         self.header = header
@@ -230,6 +374,13 @@ class Cursor(object):
         self.ssl_client_cert = ssl_client_cert
         self.proxies = proxies
         self.jwt = jwt
+        self.result_format = result_format
+        self.session = session
+        self.json_codec = get_codec(json_codec)
+        self.compress_requests_over = compress_requests_over
+        self.stream = stream
+        # the `BrokerPool` queries are balanced on, if any
+        self.brokers = brokers
 
         # This read/write attribute specifies the number of rows to fetch at a
         # time with .fetchmany(). It defaults to 1 meaning to fetch a single
@@ -244,20 +395,102 @@ class Cursor(object):
         # this is set to an iterator after a successfull query
         self._results = None
 
+        # the response being streamed, if any
+        self._response = None
+
+        # the `sqlQueryId` of the last query, used to cancel it
+        self.query_id = None
+
+        # whether the rows of the last query are still being received
+        self._running = False
+
+        # URL the last query was sent to, and the broker it holds in the pool
+        self._query_url = None
+        self._broker = None
+        self._elapsed = None
+
     @property
     @check_result
     @check_closed
     def rowcount(self):
+        if self.stream:
+            # the number of rows isn't known until they've all been fetched
+            return -1
+
         # consume the iterator
         results = list(self._results)
         n = len(results)
         self._results = iter(results)
         return n
 
+    @property
+    @check_closed
+    def transfer_stats(self):
+        """
+        Bytes sent and received for the last query.
+
+        This has the `request_bytes` sent, the `response_bytes` received so far
+        and the `content_encoding` of the response; the response is
+        decompressed by `requests` while it's streamed.
+        """
+        r = self._response
+        if r is None:
+            return None
+        return {
+            "request_bytes": len(r.request.body or b"") if r.request else None,
+            "response_bytes": r.raw.tell(),
+            "content_encoding": r.headers.get("Content-Encoding", "identity"),
+        }
+
     @check_closed
     def close(self):
-        """Close the cursor."""
+        """Close the cursor, cancelling the query if it's still running."""
+        if self._running:
+            try:
+                self.cancel()
+            except Exception:
+                pass
         self.closed = True
+        if self._response is not None:
+            # release the connection back to the pool
+            self._response.close()
+            self._response = None
+
+    @check_closed
+    def cancel(self):
+        """
+        Cancel the query being executed.
+
+        The rows left are discarded and the broker is asked to cancel the query,
+        identified by the `sqlQueryId` in its context.
+        """
+        self._running = False
+        self._release_broker()
+        if self._results is not None:
+            self._results = iter([])
+        if self._response is not None:
+            self._response.close()
+        if self.query_id is None:
+            return
+
+        query_id = parse.quote(str(self.query_id), safe="")
+        url = self._query_url.rstrip("/") + "/" + query_id
+        http = self.session or requests
+        r = http.delete(
+            url,
+            auth=self._auth(),
+            verify=self.ssl_verify_cert,
+            cert=self.ssl_client_cert,
+            proxies=self.proxies,
+        )
+        r.close()
+        # the query may have completed already
+        if r.status_code not in (200, 202, 404):
+            raise exceptions.OperationalError(
+                "Unable to cancel query {0}: HTTP {1}".format(
+                    self.query_id, r.status_code
+                )
+            )
 
     @check_closed
     def execute(self, operation, parameters=None):
@@ -316,6 +549,22 @@ class Cursor(object):
         """
         return list(self._results)
 
+    @check_result
+    @check_closed
+    def fetch_arrow_table(self, batch_size=65536):
+        """
+        Fetch all (remaining) rows of a query result as an Arrow table.
+
+        Rows are converted to Arrow record batches of `batch_size` rows while
+        they are streamed, so the whole result is never held as Python objects.
+        """
+        names = [column[0] for column in self.description or []]
+        batches = (
+            OrderedDict(zip(names, map(list, zip(*rows))))
+            for rows in iter(lambda: self.fetchmany(batch_size), [])
+        )
+        return columns_to_arrow(batches, names)
+
     @check_closed
     def setinputsizes(self, sizes):
         # not supported
@@ -336,6 +585,18 @@ class Cursor(object):
 
     next = __next__
 
+    def _release_broker(self, failed=False):
+        if self._broker is not None:
+            self.brokers.release(self._broker, self._elapsed, failed)
+            self._broker = None
+
+    def _auth(self):
+        if self.user:
+            return requests.auth.HTTPBasicAuth(self.user, self.password)
+        if self.jwt:
+            return BearerAuth(self.jwt)
+        return None
+
     def _stream_query(self, query):
         """
         Stream rows from a query.
@@ -347,25 +608,46 @@ class Cursor(object):
 
         headers = {"Content-Type": "application/json"}
 
-        payload = {"query": query, "context": self.context, "header": self.header}
-
-        if self.user:
-            auth = requests.auth.HTTPBasicAuth(self.user, self.password)
-        elif self.jwt:
-            auth = BearerAuth(self.jwt)
-        else:
-            auth = None
-
-        r = requests.post(
-            self.url,
-            stream=True,
-            headers=headers,
-            json=payload,
-            auth=auth,
-            verify=self.ssl_verify_cert,
-            cert=self.ssl_client_cert,
-            proxies=self.proxies,
-        )
+        payload = build_payload(query, self.context, self.header, self.result_format)
+        self.query_id = payload["context"]["sqlQueryId"]
+        auth = self._auth()
+
+        body = {"json": payload}
+        if self.compress_requests_over is not None:
+            data = self.json_codec.dumps(payload)
+            if len(data) > self.compress_requests_over:
+                headers["Content-Encoding"] = "gzip"
+                body = {"data": gzip.compress(data)}
+
+        # the previous query may not have been read to the end
+        self._release_broker()
+        self._query_url = self.url
+        if self.brokers is not None:
+            self._broker = self.brokers.acquire()
+            self._query_url = self._broker.url
+        self._elapsed = None
+
+        # use the pooled session from the connection, if any
+        http = self.session or requests
+        start = time.monotonic()
+        try:
+            r = http.post(
+                self._query_url,
+                stream=True,
+                headers=headers,
+                **body,
+                auth=auth,
+                verify=self.ssl_verify_cert,
+                cert=self.ssl_client_cert,
+                proxies=self.proxies,
+            )
+        except requests.exceptions.RequestException:
+            # counts towards ejecting the broker
+            self._release_broker(failed=True)
+            raise
+        if self._response is not None:
+            self._response.close()
+        self._response = r
         if r.encoding is None:
             r.encoding = "utf-8"
         # raise any error messages
@@ -373,24 +655,99 @@ class Cursor(object):
             try:
                 payload = r.json()
             except Exception:
-                payload = {
-                    "error": "Unknown error",
-                    "errorClass": "Unknown",
-                    "errorMessage": r.text,
-                }
+                payload = None
+            self._release_broker()
+            raise get_error(payload, r.text)
+
+        self._elapsed = time.monotonic() - start
+        self._running = True
+        if self.result_format in LINE_FORMATS:
+            chunks = r.iter_content(chunk_size=None, decode_unicode=True)
+            quotechar = '"' if self.result_format == "csv" else None
+            lines = lines_from_chunks(chunks, quotechar)
+            rows = rows_from_lines(lines, self.result_format, self.json_codec)
+        else:
+            # Druid will stream the data in chunks of 8k bytes, splitting the
+            # JSON between them; setting `chunk_size` to `None` makes it use the
+            # server size
+            chunks = r.iter_content(chunk_size=None, decode_unicode=True)
+            rows = rows_from_chunks(chunks, self.json_codec)
+
+        builder = RowBuilder(self.header, self.result_format)
+        for row in builder.build(rows):
+            if self.description is None:
+                self.description = builder.description
+            yield row
+        self._running = False
+        self._release_broker()
+
+
+def build_payload(query, context, header=False, result_format=None):
+    """
+    Return the body of a Druid SQL request.
+
+    The query is given a random `sqlQueryId` in its context, unless it has one,
+    so that it can be cancelled.
+    """
+    if context.get("sqlQueryId") is None:
+        # the context is shared by the cursors of a connection
+        context = dict(context, sqlQueryId=str(uuid.uuid4()))
+    payload = {"query": query, "context": context, "header": header}
+    if result_format:
+        payload["resultFormat"] = result_format
+        if result_format in ARRAY_FORMATS:
+            # column names are only sent in the header
+            payload["header"] = True
+    return payload
+
+
+def get_error(payload, text):
+    """
+    Return the exception for a failed Druid SQL request.
+
+    :param dict payload: the decoded JSON error, or `None` if the body of the
+      response isn't JSON
+    :param str text: the body of the response
+    """
+    if payload is None:
+        payload = {
+            "error": "Unknown error",
+            "errorClass": "Unknown",
+            "errorMessage": text,
+        }
+
+    category = payload.pop("category", payload.pop("errorClass", "Unknown"))
+    error = payload.get("error") or "Unknown"
+    error_message = payload.get("errorMessage") or "Unknown"
+    msg = f"{error} ({category}): {error_message}"
+    return exceptions.ProgrammingError(msg)
+
+
+class RowBuilder(object):
+    """
+    Turn the decoded rows of a result into named tuples.
+
+    The description of the result is inferred from the first row. Rows can be
+    given in several calls to `build`, as they're received.
+
+    :param bool header: whether the first row is the header
+    :param str result_format: the result format of the query
+    """
+
+    def __init__(self, header=False, result_format=None):
+        self.header = header
+        self.arrays = result_format in ARRAY_FORMATS
+        self.description = None
+        self.names = None
+        self.Row = None
+
+    def build(self, rows):
+        """Generate the named tuples of decoded rows."""
+        if self.arrays:
+            yield from self._build_arrays(iter(rows))
+            return
 
-            category = payload.pop("category", payload.pop("errorClass", "Unknown"))
-            error = payload.get("error") or "Unknown"
-            error_message = payload.get("errorMessage") or "Unknown"
-            msg = f"{error} ({category}): {error_message}"
-            raise exceptions.ProgrammingError(msg)
-
-        # Druid will stream the data in chunks of 8k bytes, splitting the JSON
-        # between them; setting `chunk_size` to `None` makes it use the server
-        # size
-        chunks = r.iter_content(chunk_size=None, decode_unicode=True)
-        Row = None
-        for row in rows_from_chunks(chunks):
+        for row in rows:
             # update description
             if self.description is None:
                 self.description = (
@@ -398,52 +755,69 @@ class Cursor(object):
                 )
 
             # return row in namedtuple
-            if Row is None:
-                Row = namedtuple("Row", row.keys(), rename=True)
-            yield Row(*row.values())
+            if self.Row is None:
+                self.Row = namedtuple("Row", row.keys(), rename=True)
+            yield self.Row(*row.values())
 
+    def _build_arrays(self, rows):
+        """
+        Build rows from a result format without column names in each row.
+
+        The first row is always the header with the column names; it's yielded
+        back only if the header was requested, to keep the same protocol as
+        object rows.
+        """
+        if self.names is None:
+            self.names = next(rows, None)
+            if self.names is None:
+                return
+
+            self.Row = namedtuple("Row", self.names, rename=True)
+            if self.header:
+                self.description = [(name, None) for name in self.names]
+                yield self.Row(*self.names)
+
+        Row = self.Row
+        for values in rows:
+            # update description
+            if self.description is None:
+                self.description = get_description_from_row(
+                    dict(zip(self.names, values))
+                )
+
+            yield Row(*values)
 
-def rows_from_chunks(chunks):
+
+def lines_from_chunks(chunks, quotechar=None):
     """
-    A generator that yields rows from JSON chunks.
+    A generator that yields the lines of text streamed in chunks.
 
-    Druid will return the data in chunks, but they are not aligned with the
-    JSON objects. This function will parse all complete rows inside each chunk,
-    yielding them as soon as possible.
+    With a `quotechar`, a quoted value can span several lines, e.g. in CSV.
     """
-    body = ""
+    splitter = LineSplitter(quotechar)
     for chunk in chunks:
-        if chunk:
-            body = "".join((body, chunk))
-
-        # find last complete row
-        boundary = 0
-        brackets = 0
-        in_string = False
-        for i, char in enumerate(body):
-            if char == '"':
-                if not in_string:
-                    in_string = True
-                elif body[i - 1] != "\\":
-                    in_string = False
-
-            if in_string:
-                continue
-
-            if char == "{":
-                brackets += 1
-            elif char == "}":
-                brackets -= 1
-                if brackets == 0 and i > boundary:
-                    boundary = i + 1
-
-        rows = body[:boundary].lstrip("[,")
-        body = body[boundary:]
-
-        for row in json.loads(
-            "[{rows}]".format(rows=rows), object_pairs_hook=OrderedDict
-        ):
-            yield row
+        yield from splitter.feed(chunk)
+    yield from splitter.flush()
+
+
+def rows_from_lines(lines, result_format, json_codec=None):
+    """
+    A generator that yields rows from a line-oriented result format.
+
+    Each row in `objectLines`, `arrayLines` and `csv` is a single line, so
+    there's no need to look for row boundaries. Results are terminated by an
+    empty line.
+    """
+    if result_format == "csv":
+        # add back the line terminators, since values can have newlines
+        rows = csv.reader(line + "\n" for line in lines)
+        yield from (row for row in rows if row)
+        return
+
+    loads = get_codec(json_codec).loads
+    for line in lines:
+        if line:
+            yield loads(line)
 
 
 def apply_parameters(operation, parameters):
@@ -0,0 +1,541 @@
+import asyncio
+import codecs
+import gzip
+import ssl
+from base64 import b64encode
+from collections import deque
+from urllib import parse
+
+from pydruid.db import exceptions
+from pydruid.db.api import (
+    apply_parameters,
+    build_payload,
+    check_closed,
+    check_result,
+    get_error,
+    LINE_FORMATS,
+    RESULT_FORMATS,
+    RowBuilder,
+    rows_from_lines,
+)
+from pydruid.utils.json_codec import get_codec
+from pydruid.utils.query_utils import LineSplitter, RowSplitter
+
+try:
+    import aiohttp
+except ImportError:
+    print("Warning: unable to import aiohttp. The asyncio DB API will not work.")
+
+
+def connect(
+    host="localhost",
+    port=8082,
+    path="/druid/v2/sql/",
+    scheme="http",
+    user=None,
+    password=None,
+    context=None,
+    header=False,
+    ssl_verify_cert=True,
+    ssl_client_cert=None,
+    proxies=None,
+    jwt=None,
+    result_format=None,
+    pool_size=10,
+    json_codec=None,
+    compress_requests_over=None,
+):  # noqa: E125
+    """
+    Constructor for creating an asyncio connection to the database.
+
+        >>> conn = connect('localhost', 8082)
+        >>> curs = conn.cursor()
+        >>> await curs.execute('SELECT 1')
+        >>> async for row in curs:
+        ...     print(row)
+
+    The arguments are the same as for `pydruid.db.api.connect`. Cursors from
+    the same connection share an aiohttp session, with up to `pool_size`
+    connections to the broker.
+    """
+    context = context or {}
+
+    return AsyncConnection(
+        host,
+        port,
+        path,
+        scheme,
+        user,
+        password,
+        context,
+        header,
+        ssl_verify_cert,
+        ssl_client_cert,
+        proxies,
+        jwt,
+        result_format,
+        pool_size,
+        json_codec,
+        compress_requests_over,
+    )
+
+
+def create_ssl_context(ssl_verify_cert=True, ssl_client_cert=None):
+    """
+    Return the `ssl` argument of aiohttp requests.
+
+    The arguments have the meaning of the `verify` and `cert` arguments of
+    `requests`: the certificate can be verified with the default CAs, with a
+    bundle of CAs or not at all, and a client certificate can be given as a
+    path or a `(cert, key)` tuple.
+    """
+    if ssl_verify_cert is True and ssl_client_cert is None:
+        return True
+
+    cafile = ssl_verify_cert if isinstance(ssl_verify_cert, str) else None
+    context = ssl.create_default_context(cafile=cafile)
+    if ssl_verify_cert is False:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if ssl_client_cert:
+        if isinstance(ssl_client_cert, str):
+            context.load_cert_chain(ssl_client_cert)
+        else:
+            context.load_cert_chain(*ssl_client_cert)
+    return context
+
+
+def create_session(pool_size):
+    """Create a session keeping up to `pool_size` connections to the broker."""
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=pool_size))
+
+
+class AsyncConnection(object):
+    """Asyncio connection to a Druid database."""
+
+    def __init__(
+        self,
+        host="localhost",
+        port=8082,
+        path="/druid/v2/sql/",
+        scheme="http",
+        user=None,
+        password=None,
+        context=None,
+        header=False,
+        ssl_verify_cert=True,
+        ssl_client_cert=None,
+        proxies=None,
+        jwt=None,
+        result_format=None,
+        pool_size=10,
+        json_codec=None,
+        compress_requests_over=None,
+    ):
+        netloc = "{host}:{port}".format(host=host, port=port)
+        self.url = parse.urlunparse((scheme, netloc, path, None, None, None))
+        self.context = context or {}
+        self.closed = False
+        self.cursors = []
+        self.header = header
+        self.user = user
+        self.password = password
+        self.ssl_verify_cert = ssl_verify_cert
+        self.ssl_client_cert = ssl_client_cert
+        self.proxies = proxies
+        self.jwt = jwt
+        self.result_format = result_format
+        self.pool_size = pool_size
+        self.json_codec = get_codec(json_codec)
+        self.compress_requests_over = compress_requests_over
+        # the session is created in the event loop, by the first cursor
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = create_session(self.pool_size)
+        return self._session
+
+    @check_closed
+    async def close(self):
+        """Close the connection now."""
+        self.closed = True
+        for cursor in list(self.cursors):
+            try:
+                await cursor.close()
+            except exceptions.Error:
+                pass  # already closed
+        if self._session is not None:
+            await self._session.close()
+
+    @check_closed
+    async def commit(self):
+        """
+        Commit any pending transaction to the database.
+
+        Not supported.
+        """
+        pass
+
+    @check_closed
+    def cursor(self):
+        """Return a new AsyncCursor Object using the connection."""
+
+        cursor = AsyncCursor(
+            self.url,
+            self.user,
+            self.password,
+            self.context,
+            self.header,
+            self.ssl_verify_cert,
+            self.ssl_client_cert,
+            self.proxies,
+            self.jwt,
+            self.result_format,
+            self,
+            self.json_codec,
+            self.compress_requests_over,
+        )
+
+        self.cursors.append(cursor)
+
+        return cursor
+
+    @check_closed
+    async def execute(self, operation, parameters=None):
+        cursor = self.cursor()
+        return await cursor.execute(operation, parameters)
+
+    async def __aenter__(self):
+        return self.cursor()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class AsyncCursor(object):
+    """
+    Asyncio connection cursor.
+
+    Rows are parsed as they're received from the broker, like with
+    `pydruid.db.api.Cursor`; the fetch methods are coroutines, and the cursor
+    is an asynchronous iterator.
+    """
+
+    def __init__(
+        self,
+        url,
+        user=None,
+        password=None,
+        context=None,
+        header=False,
+        ssl_verify_cert=True,
+        ssl_client_cert=None,
+        proxies=None,
+        jwt=None,
+        result_format=None,
+        connection=None,
+        json_codec=None,
+        compress_requests_over=None,
+    ):
+        if result_format not in RESULT_FORMATS:
+            raise exceptions.NotSupportedError(
+                "Result format {0} is not supported".format(result_format)
+            )
+
+        self.url = url
+        self.context = context or {}
+        self.header = header
+        self.user = user
+        self.password = password
+        self.ssl = create_ssl_context(ssl_verify_cert, ssl_client_cert)
+        self.proxies = proxies
+        self.jwt = jwt
+        self.result_format = result_format
+        self.connection = connection
+        self.json_codec = get_codec(json_codec)
+        self.compress_requests_over = compress_requests_over
+
+        # This read/write attribute specifies the number of rows to fetch at a
+        # time with .fetchmany(). It defaults to 1 meaning to fetch a single
+        # row at a time.
+        self.arraysize = 1
+
+        # the number of rows is only known once they've all been fetched
+        self.rowcount = -1
+
+        self.closed = False
+
+        # this is updated only after a query
+        self.description = None
+
+        # this is set to an async generator of row batches after a query
+        self._results = None
+
+        # rows received but not fetched yet
+        self._rows = deque()
+
+        # the response being streamed, if any
+        self._response = None
+
+        # a session owned by the cursor, when it has no connection
+        self._session = None
+
+        # the `sqlQueryId` of the last query, used to cancel it
+        self.query_id = None
+
+    @check_closed
+    async def close(self):
+        """Close the cursor, cancelling the query if it's still running."""
+        if self._response is not None:
+            await self._cancel_quietly()
+        self.closed = True
+        await self._release()
+        if self.connection is not None:
+            # connections are long-lived when they're pooled
+            self.connection.cursors.remove(self)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @check_closed
+    async def cancel(self):
+        """
+        Cancel the query being executed.
+
+        The rows left are discarded, the response is closed and the broker is
+        asked to cancel the query, identified by the `sqlQueryId` in its context.
+        """
+        await self._release()
+        query_id = self.query_id
+        if query_id is None:
+            return
+
+        url = self.url.rstrip("/") + "/" + parse.quote(str(query_id), safe="")
+        async with self._session_for_request().delete(
+            url, **self._request_options()
+        ) as response:
+            # the query may have completed already
+            if response.status not in (200, 202, 404):
+                raise exceptions.OperationalError(
+                    "Unable to cancel query {0}: HTTP {1}".format(
+                        query_id, response.status
+                    )
+                )
+
+    async def _cancel_quietly(self):
+        # shielded, as this runs when the task executing the query is cancelled
+        try:
+            await asyncio.shield(self.cancel())
+        except Exception:
+            pass
+
+    @check_closed
+    async def execute(self, operation, parameters=None):
+        query = apply_parameters(operation, parameters)
+        await self._release()
+        self.description = None
+        self.rowcount = -1
+
+        try:
+            self._response = await self._post(query)
+        except asyncio.CancelledError:
+            # don't leave the query running in the cluster
+            await self._cancel_quietly()
+            raise
+        self._results = self._stream_rows(self._response)
+
+        # receive the first rows so that `description` is properly set, and
+        # drop the header
+        if await self._fill() and self.header:
+            self._rows.popleft()
+
+        return self
+
+    @check_closed
+    async def executemany(self, operation, seq_of_parameters=None):
+        raise exceptions.NotSupportedError(
+            "`executemany` is not supported, use `execute` instead"
+        )
+
+    @check_result
+    @check_closed
+    async def fetchone(self):
+        """
+        Fetch the next row of a query result set, returning a single sequence,
+        or `None` when no more data is available.
+        """
+        if not await self._fill():
+            return None
+        return self._rows.popleft()
+
+    @check_result
+    @check_closed
+    async def fetchmany(self, size=None):
+        """
+        Fetch the next set of rows of a query result, returning a sequence of
+        sequences (e.g. a list of tuples). An empty sequence is returned when
+        no more rows are available.
+        """
+        size = size or self.arraysize
+        rows = []
+        while len(rows) < size and await self._fill():
+            for _ in range(min(size - len(rows), len(self._rows))):
+                rows.append(self._rows.popleft())
+        return rows
+
+    @check_result
+    @check_closed
+    async def fetchall(self):
+        """
+        Fetch all (remaining) rows of a query result, returning them as a
+        sequence of sequences (e.g. a list of tuples).
+        """
+        rows = []
+        while await self._fill():
+            rows.extend(self._rows)
+            self._rows.clear()
+        return rows
+
+    @check_closed
+    def setinputsizes(self, sizes):
+        # not supported
+        pass
+
+    @check_closed
+    def setoutputsizes(self, sizes):
+        # not supported
+        pass
+
+    @check_closed
+    def __aiter__(self):
+        return self
+
+    @check_closed
+    async def __anext__(self):
+        if self._results is None or not await self._fill():
+            raise StopAsyncIteration
+        return self._rows.popleft()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        if not self.closed:
+            await self.close()
+
+    def _session_for_request(self):
+        if self.connection is not None:
+            return self.connection.session
+        if self._session is None:
+            self._session = create_session(1)
+        return self._session
+
+    def _request_options(self):
+        options = {"ssl": self.ssl}
+        if self.proxies:
+            options["proxy"] = self.proxies.get(parse.urlparse(self.url).scheme)
+        if self.user:
+            authstring = "{}:{}".format(self.user, self.password or "")
+            b64string = b64encode(authstring.encode()).decode()
+            options["headers"] = {"Authorization": f"Basic {b64string}"}
+        elif self.jwt:
+            options["headers"] = {"Authorization": f"Bearer {self.jwt}"}
+        return options
+
+    async def _post(self, query):
+        """Send a query, returning the response once its headers are received."""
+        options = self._request_options()
+        headers = options.setdefault("headers", {})
+        headers["Content-Type"] = "application/json"
+
+        payload = build_payload(query, self.context, self.header, self.result_format)
+        self.query_id = payload["context"]["sqlQueryId"]
+        data = self.json_codec.dumps(payload)
+        if (
+            self.compress_requests_over is not None
+            and len(data) > self.compress_requests_over
+        ):
+            headers["Content-Encoding"] = "gzip"
+            data = gzip.compress(data)
+
+        response = await self._session_for_request().post(
+            self.url, data=data, **options
+        )
+        # raise any error messages
+        if response.status != 200:
+            try:
+                text = await response.text(errors="replace")
+            finally:
+                response.release()
+            try:
+                payload = self.json_codec.loads(text)
+            except Exception:
+                payload = None
+            raise get_error(payload, text)
+
+        return response
+
+    async def _stream_rows(self, response):
+        """
+        Generate batches of rows as the data is returned in chunks from the
+        server.
+        """
+        builder = RowBuilder(self.header, self.result_format)
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        lines = self.result_format in LINE_FORMATS
+        if lines:
+            splitter = LineSplitter('"' if self.result_format == "csv" else None)
+        else:
+            splitter = RowSplitter()
+            loads = self.json_codec.loads
+
+        def parse_chunk(text, final=False):
+            if not lines:
+                return builder.build(splitter.parse(text, loads))
+            completed = splitter.feed(text) + (splitter.flush() if final else [])
+            return builder.build(
+                rows_from_lines(completed, self.result_format, self.json_codec)
+            )
+
+        try:
+            async for chunk in response.content.iter_any():
+                rows = list(parse_chunk(decoder.decode(chunk)))
+                if self.description is None:
+                    self.description = builder.description
+                if rows:
+                    yield rows
+
+            rows = list(parse_chunk(decoder.decode(b"", final=True), final=True))
+            if self.description is None:
+                self.description = builder.description
+            if rows:
+                yield rows
+        finally:
+            response.release()
+
+    async def _fill(self):
+        """Receive rows until some are available; return `False` at the end."""
+        while not self._rows:
+            try:
+                rows = await self._results.__anext__()
+            except StopAsyncIteration:
+                self._response = None
+                return False
+            except asyncio.CancelledError:
+                await self._cancel_quietly()
+                raise
+            self._rows.extend(rows)
+        return True
+
+    async def _release(self):
+        """Stop streaming the current results, if any."""
+        self._rows.clear()
+        if self._response is not None:
+            # the unread data can't be left on the connection
+            self._response.close()
+            self._response = None
+        if self._results is not None:
+            # the generator is kept, so that fetching returns no more rows
+            await self._results.aclose()
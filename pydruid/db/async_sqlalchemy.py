@@ -0,0 +1,215 @@
+"""
+SQLAlchemy dialect for asyncio engines, built on `pydruid.db.async_api`.
+
+This requires SQLAlchemy 1.4 or later::
+
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine("druid+async://localhost:8082/druid/v2/sql/")
+
+SQLAlchemy runs the synchronous dialect code in a greenlet, and the adapters
+below wait on the coroutines of the async cursor from there.
+"""
+
+from collections import deque
+
+from sqlalchemy import pool
+from sqlalchemy.engine import AdaptedConnection
+from sqlalchemy.util.concurrency import await_only
+
+from pydruid.db import exceptions
+from pydruid.db.sqlalchemy import DruidDialect, DruidExecutionContext
+
+
+class AsyncAdaptedCursor(object):
+    """
+    Blocking DB API cursor wrapping an `AsyncCursor`.
+
+    All the rows are fetched when the query is executed, so that the results
+    can be consumed after the connection has been returned to the pool.
+    """
+
+    def __init__(self, adapt_connection):
+        self._adapt_connection = adapt_connection
+        self.await_ = adapt_connection.await_
+        self.arraysize = 1
+        self.rowcount = -1
+        self.description = None
+        self._rows = deque()
+
+    def close(self):
+        # this can be called outside of the greenlet, once the rows are
+        # consumed; the async cursor was closed already
+        self._rows.clear()
+
+    def execute(self, operation, parameters=None):
+        cursor = self._adapt_connection._connection.cursor()
+        try:
+            self.await_(cursor.execute(operation, parameters))
+            self.description = cursor.description
+            self._rows = deque(self.await_(cursor.fetchall()))
+            self.rowcount = len(self._rows)
+        finally:
+            self.await_(cursor.close())
+
+    def executemany(self, operation, seq_of_parameters=None):
+        raise exceptions.NotSupportedError(
+            "`executemany` is not supported, use `execute` instead"
+        )
+
+    def setinputsizes(self, *inputsizes):
+        pass
+
+    def __iter__(self):
+        while self._rows:
+            yield self._rows.popleft()
+
+    def fetchone(self):
+        return self._rows.popleft() if self._rows else None
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        return [self._rows.popleft() for _ in range(min(size, len(self._rows)))]
+
+    def fetchall(self):
+        rows = list(self._rows)
+        self._rows.clear()
+        return rows
+
+
+class AsyncAdaptedServerSideCursor(AsyncAdaptedCursor):
+    """Cursor streaming the rows, used for `stream_results`."""
+
+    def __init__(self, adapt_connection):
+        super(AsyncAdaptedServerSideCursor, self).__init__(adapt_connection)
+        self._cursor = None
+
+    def close(self):
+        if self._cursor is not None:
+            self.await_(self._cursor.close())
+            self._cursor = None
+
+    def execute(self, operation, parameters=None):
+        self.close()
+        self._cursor = self._adapt_connection._connection.cursor()
+        self.await_(self._cursor.execute(operation, parameters))
+        self.description = self._cursor.description
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def fetchone(self):
+        return self.await_(self._cursor.fetchone())
+
+    def fetchmany(self, size=None):
+        return self.await_(self._cursor.fetchmany(size or self.arraysize))
+
+    def fetchall(self):
+        return self.await_(self._cursor.fetchall())
+
+
+class AsyncAdaptedConnection(AdaptedConnection):
+    """Blocking DB API connection wrapping an `AsyncConnection`."""
+
+    await_ = staticmethod(await_only)
+    __slots__ = ("dbapi", "_connection")
+
+    def __init__(self, dbapi, connection):
+        self.dbapi = dbapi
+        self._connection = connection
+
+    def cursor(self, server_side=False):
+        if server_side:
+            return AsyncAdaptedServerSideCursor(self)
+        return AsyncAdaptedCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        if not self._connection.closed:
+            self.await_(self._connection.close())
+
+
+class AsyncAdaptedDBAPI(object):
+    """The DB API module seen by SQLAlchemy."""
+
+    apilevel = "2.0"
+    threadsafety = 2
+    paramstyle = "pyformat"
+
+    def __init__(self, async_api):
+        self.async_api = async_api
+        for name in (
+            "DatabaseError",
+            "DataError",
+            "Error",
+            "IntegrityError",
+            "InterfaceError",
+            "InternalError",
+            "NotSupportedError",
+            "OperationalError",
+            "ProgrammingError",
+            "Warning",
+        ):
+            setattr(self, name, getattr(exceptions, name))
+
+    def connect(self, *args, **kwargs):
+        return AsyncAdaptedConnection(self, self.async_api.connect(*args, **kwargs))
+
+
+class DruidAsyncExecutionContext(DruidExecutionContext):
+    def create_server_side_cursor(self):
+        return self._dbapi_connection.cursor(server_side=True)
+
+
+class DruidAsyncDialect(DruidDialect):
+
+    driver = "aiohttp"
+    is_async = True
+    execution_ctx_cls = DruidAsyncExecutionContext
+
+    @classmethod
+    def dbapi(cls):
+        from pydruid.db import async_api
+
+        return AsyncAdaptedDBAPI(async_api)
+
+    # SQLAlchemy 2.0 name of `dbapi`
+    import_dbapi = dbapi
+
+    @classmethod
+    def get_pool_class(cls, url):
+        return pool.AsyncAdaptedQueuePool
+
+    def get_driver_connection(self, connection):
+        return connection._connection
+
+    def do_ping(self, dbapi_connection):
+        """
+        Return if the database can be reached.
+        """
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        except Exception:
+            return False
+        finally:
+            cursor.close()
+
+        return True
+
+
+DruidAsyncHTTPDialect = DruidAsyncDialect
+
+
+class DruidAsyncHTTPSDialect(DruidAsyncDialect):
+
+    scheme = "https"
@@ -1,3 +1,6 @@
+import threading
+import time
+
 from sqlalchemy import text, types, util
 from sqlalchemy.engine import default
 from sqlalchemy.sql import compiler
@@ -76,6 +79,12 @@ class DruidTypeCompiler(compiler.GenericTypeCompiler):
     visit_BINARY = visit_BLOB
 
 
+class DruidExecutionContext(default.DefaultExecutionContext):
+    def create_server_side_cursor(self):
+        # rows are streamed from the response as they're fetched
+        return self._dbapi_connection.cursor(stream=True)
+
+
 class DruidDialect(default.DefaultDialect):
 
     name = "druid"
@@ -95,10 +104,16 @@ class DruidDialect(default.DefaultDialect):
     returns_unicode_strings = True
     description_encoding = None
     supports_native_boolean = True
+    supports_server_side_cursors = True
+    execution_ctx_cls = DruidExecutionContext
 
-    def __init__(self, context=None, *args, **kwargs):
+    def __init__(self, context=None, reflection_cache_ttl=None, *args, **kwargs):
         super(DruidDialect, self).__init__(*args, **kwargs)
         self.context = context or {}
+        # seconds the columns of a schema are cached for, if set
+        self.reflection_cache_ttl = reflection_cache_ttl
+        self._reflection_cache = {}
+        self._reflection_cache_lock = threading.Lock()
 
     @classmethod
     def dbapi(cls):
@@ -142,6 +157,9 @@ class DruidDialect(default.DefaultDialect):
         ]
 
     def has_table(self, connection, table_name, schema=None):
+        if self.reflection_cache_ttl is not None:
+            return (schema, table_name) in self._get_cached_columns(connection, schema)
+
         query = """
             SELECT COUNT(*) > 0 AS exists_
               FROM INFORMATION_SCHEMA.TABLES
@@ -154,6 +172,10 @@ class DruidDialect(default.DefaultDialect):
         return result.fetchone().exists_
 
     def get_table_names(self, connection, schema=None, **kwargs):
+        if self.reflection_cache_ttl is not None:
+            columns = self._get_cached_columns(connection, schema)
+            return [table_name for _, table_name in columns]
+
         query = "SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES"
         if schema:
             query = "{query} WHERE TABLE_SCHEMA = '{schema}'".format(
@@ -170,6 +192,11 @@ class DruidDialect(default.DefaultDialect):
         return {}
 
     def get_columns(self, connection, table_name, schema=None, **kwargs):
+        if self.reflection_cache_ttl is not None:
+            columns = self._get_cached_columns(connection, schema)
+            # SQLAlchemy updates the columns it's given
+            return [dict(column) for column in columns.get((schema, table_name), [])]
+
         query = """
             SELECT COLUMN_NAME,
                    JDBC_TYPE,
@@ -187,15 +214,76 @@ class DruidDialect(default.DefaultDialect):
 
         result = connection.execute(text(query))
 
-        return [
-            {
-                "name": row.COLUMN_NAME,
-                "type": self._map_jdbc_type(row),
-                "nullable": get_is_nullable(row.IS_NULLABLE),
-                "default": get_default(row.COLUMN_DEFAULT),
-            }
-            for row in result
-        ]
+        return [self._get_column(row) for row in result]
+
+    def get_multi_columns(self, connection, schema=None, filter_names=None, **kwargs):
+        """
+        Return the columns of all the tables of a schema, in a single query.
+
+        :return: a dict mapping `(schema, table_name)` to the columns of the
+          table, like `get_columns` returns them
+        """
+        if self.reflection_cache_ttl is not None:
+            columns = self._get_cached_columns(connection, schema)
+        else:
+            columns = self._get_schema_columns(connection, schema)
+        if filter_names is not None:
+            filter_names = set(filter_names)
+        return {
+            key: [dict(column) for column in table_columns]
+            for key, table_columns in columns.items()
+            if filter_names is None or key[1] in filter_names
+        }
+
+    def clear_reflection_cache(self):
+        """Forget the cached columns, so that they're queried again."""
+        with self._reflection_cache_lock:
+            self._reflection_cache.clear()
+
+    def _get_cached_columns(self, connection, schema):
+        with self._reflection_cache_lock:
+            cached = self._reflection_cache.get(schema)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        # the lock isn't held while querying, as the async dialect may switch
+        # to another query on the same thread
+        columns = self._get_schema_columns(connection, schema)
+        expires = time.monotonic() + self.reflection_cache_ttl
+        with self._reflection_cache_lock:
+            self._reflection_cache[schema] = (expires, columns)
+        return columns
+
+    def _get_schema_columns(self, connection, schema):
+        """Query the columns of all the tables of a schema, or of all schemas."""
+        query = """
+            SELECT TABLE_NAME,
+                   COLUMN_NAME,
+                   JDBC_TYPE,
+                   IS_NULLABLE,
+                   COLUMN_DEFAULT
+              FROM INFORMATION_SCHEMA.COLUMNS
+        """
+        if schema:
+            query = "{query} WHERE TABLE_SCHEMA = '{schema}'".format(
+                query=query, schema=schema
+            )
+
+        result = connection.execute(text(query))
+
+        columns = {}
+        for row in result:
+            key = (schema, row.TABLE_NAME)
+            columns.setdefault(key, []).append(self._get_column(row))
+        return columns
+
+    def _get_column(self, row):
+        return {
+            "name": row.COLUMN_NAME,
+            "type": self._map_jdbc_type(row),
+            "nullable": get_is_nullable(row.IS_NULLABLE),
+            "default": get_default(row.COLUMN_DEFAULT),
+        }
 
     def get_pk_constraint(self, connection, table_name, schema=None, **kwargs):
         return {"constrained_columns": [], "name": None}
@@ -14,15 +14,24 @@
 # limitations under the License.
 #
 
-import json
+import itertools
+from collections import OrderedDict
 from collections.abc import MutableSequence
 
+from pydruid.utils import smile
 from pydruid.utils.aggregators import build_aggregators
 from pydruid.utils.dimensions import build_dimension
 from pydruid.utils.filters import Filter
 from pydruid.utils.having import Having
+from pydruid.utils.json_codec import get_codec
 from pydruid.utils.postaggregator import Postaggregator
-from pydruid.utils.query_utils import UnicodeWriter
+from pydruid.utils.query_utils import (
+    columns_to_arrow,
+    fingerprint,
+    rows_to_columns,
+    scan_columns,
+    UnicodeWriter,
+)
 
 
 class Query(MutableSequence):
@@ -34,10 +43,17 @@ class Query(MutableSequence):
 
     Query acts as a wrapper over raw result list of dictionaries.
 
-    :ivar str result_json: JSON object representing a query result. Initial value: None
-    :ivar list result: Query result parsed into a list of dicts. Initial value: None
+    :ivar str result_json: JSON object representing a query result, or the bytes
+      of the result when it was received in Smile or passed through without
+      being decoded. Initial value: None
+    :ivar list result: Query result parsed into a list of dicts; a result parsed
+      lazily is parsed on first access. Initial value: None
     :ivar str query_type: Name of most recently run query, e.g., topN. Initial value: None
     :ivar dict query_dict: JSON object representing the query. Initial value: None
+    :ivar dict transfer_stats: Bytes sent and received for the query: the
+      `request_bytes` sent, the `response_bytes` received, the `decoded_bytes`
+      after decompression and the `content_encoding` of the response.
+      Initial value: None
     """
 
     def __init__(self, query_dict, query_type):
@@ -46,12 +62,88 @@ class Query(MutableSequence):
         self.query_type = query_type
         self.result = None
         self.result_json = None
+        self.transfer_stats = None
+
+    @property
+    def result(self):
+        loads = self._loads
+        if loads is not None:
+            # parsed on first access; concurrent readers may both parse it
+            self._result = loads(self._result_json)
+            self._loads = None
+        return self._result
+
+    @result.setter
+    def result(self, value):
+        self._result = value
+        # the function parsing `result_json`, until it's parsed
+        self._loads = None
+
+    @property
+    def result_json(self):
+        if self._decode:
+            # JSON received as bytes is decoded on first access
+            self._result_json = self._result_json.decode("utf-8")
+            self._decode = False
+        return self._result_json
+
+    @result_json.setter
+    def result_json(self, value):
+        self._result_json = value
+        self._decode = False
+
+    @property
+    def fingerprint(self):
+        """
+        Hash identifying the results of the query.
+
+        Queries built differently but returning the same results, e.g. with
+        their filters combined in another order, have the same fingerprint;
+        see `pydruid.utils.query_utils.normalize_query`.
+        """
+        return fingerprint(self.query_dict)
 
-    def parse(self, data):
+    @property
+    def query_id(self):
+        """
+        The `queryId` in the context of the query, which the clients set when
+        they send it, or None.
+        """
+        return (self.query_dict.get("context") or {}).get("queryId")
+
+    def copy_result(self, query):
+        """Fill the query with the result of another one, without parsing it."""
+        self._result_json = query._result_json
+        self._decode = query._decode
+        self._result = query._result
+        self._loads = query._loads
+        self.transfer_stats = query.transfer_stats
+
+    def parse(self, data, json_codec=None, lazy=False, decode=True):
+        """
+        Parse the result of the query.
+
+        :param data: the JSON result, or the result encoded in Smile
+        :type data: str or bytes
+        :param json_codec: the `JSONCodec` or the name of the JSON backend used
+          to parse the result; by default the fastest installed one
+        :param bool lazy: keep the data and parse it on the first access to
+          `result`, e.g. when it's only forwarded as `result_json`
+        :param bool decode: make `result_json` a `str` when the JSON result is
+          given as `bytes`; it's decoded on first access
+        """
         if data:
             self.result_json = data
-            res = json.loads(self.result_json)
-            self.result = res
+            if isinstance(data, bytes) and data.startswith(smile.HEADER):
+                loads = smile.loads
+            else:
+                loads = get_codec(json_codec).loads
+                self._decode = decode and isinstance(data, bytes)
+            if lazy:
+                self.result = None
+                self._loads = loads
+            else:
+                self.result = loads(data)
         else:
             raise IOError(
                 "Error parsing result: {0} for {1} query".format(
@@ -59,11 +151,23 @@ class Query(MutableSequence):
                 )
             )
 
-    def export_tsv(self, dest_path):
+    def export_tsv(self, dest_path, result=None, batch_size=10000):
         """
         Export the current query result to a tsv file.
 
+        Rows are written in batches, so when `result` is a generator, such as
+        the one returned by `PyDruid.stream`, the result is written to the file
+        while it's received and never held in memory as a whole.
+
+        The header has the names of the columns in the first batch, followed
+        by the dimensions, aggregations and post-aggregations of the query
+        that were not in it, so that it doesn't depend on which keys the first
+        row happens to have. Values missing from a row are left empty.
+
         :param str dest_path: file to write query results to
+        :param result: items of the result to export instead of the current
+          result, e.g. a generator
+        :param int batch_size: number of rows written at once
         :raise NotImplementedError:
 
         Example
@@ -87,49 +191,97 @@ class Query(MutableSequence):
                 >>> count	user_name	timestamp
                     7.0	user_1	2013-10-04T00:00:00.000Z
                     6.0	user_2	2013-10-04T00:00:00.000Z
-        """
-        f = open(dest_path, "w", newline="", encoding="utf-8")
-        w = UnicodeWriter(f)
 
-        if self.query_type == "timeseries":
-            header = list(self.result[0]["result"].keys())
-            header.append("timestamp")
-        elif self.query_type == "topN":
-            header = list(self.result[0]["result"][0].keys())
-            header.append("timestamp")
+                >>> scan = client.query_builder.scan({...})
+                >>> scan.export_tsv('scan.tsv', result=client.stream(scan))
+        """
+        if self.query_type in ("timeseries", "topN"):
+            trailing = ["timestamp"]
         elif self.query_type == "groupBy":
-            header = list(self.result[0]["event"].keys())
-            header.append("timestamp")
-            header.append("version")
+            trailing = ["timestamp", "version"]
+        elif self.query_type in ("select", "scan"):
+            trailing = []
         else:
             raise NotImplementedError(
                 "TSV export not implemented for query type: {0}".format(self.query_type)
             )
 
-        w.writerow(header)
+        rows = self._rows(self.result if result is None else result)
+        batch = list(itertools.islice(rows, batch_size))
 
-        if self.result:
-            if self.query_type == "topN" or self.query_type == "timeseries":
-                for item in self.result:
-                    timestamp = item["timestamp"]
-                    result = item["result"]
-                    if type(result) is list:  # topN
-                        for line in result:
-                            w.writerow(list(line.values()) + [timestamp])
-                    else:  # timeseries
-                        w.writerow(list(result.values()) + [timestamp])
+        header = list(rows_to_columns(batch).keys()) + self._output_names()
+        header = [name for name in OrderedDict.fromkeys(header) if name not in trailing]
+        header += trailing
+
+        with open(dest_path, "w", newline="", encoding="utf-8") as f:
+            w = UnicodeWriter(f)
+            w.writerow(header)
+            while batch:
+                w.writerows([[row.get(name) for name in header] for row in batch])
+                batch = list(itertools.islice(rows, batch_size))
+
+    def _rows(self, result):
+        """Generate a flat dict for every row of the result items."""
+        for item in result or []:
+            if self.query_type == "timeseries":
+                row = dict(item["result"])
+                row["timestamp"] = item["timestamp"]
+                yield row
+            elif self.query_type == "topN":
+                for res in item["result"]:
+                    row = dict(res)
+                    row["timestamp"] = item["timestamp"]
+                    yield row
             elif self.query_type == "groupBy":
-                for item in self.result:
-                    timestamp = item["timestamp"]
-                    version = item["version"]
-                    w.writerow(list(item["event"].values()) + [timestamp] + [version])
+                row = dict(item["event"])
+                row["timestamp"] = item["timestamp"]
+                row["version"] = item.get("version")
+                yield row
+            elif self.query_type == "select":
+                for event in item["result"]["events"]:
+                    yield event["event"]
+            elif self.query_type == "scan":
+                columns = item.get("columns")
+                for event in item.get("events") or []:
+                    if not isinstance(event, dict):  # compactedList
+                        event = dict(zip(columns, event))
+                    yield event
+
+    def _output_names(self):
+        """Return the names of the columns declared by the query."""
+        query = self.query_dict
+        if self.query_type == "scan":
+            return list(query.get("columns") or [])
+        if self.query_type == "select":
+            return list(query.get("dimensions") or []) + list(
+                query.get("metrics") or []
+            )
 
-        f.close()
+        names = []
+        dimensions = [query["dimension"]] if "dimension" in query else []
+        for dimension in dimensions + list(query.get("dimensions") or []):
+            if isinstance(dimension, dict):
+                dimension = dimension.get("outputName") or dimension.get("dimension")
+            names.append(dimension)
 
-    def export_pandas(self):
+        aggregations = query.get("aggregations") or []
+        for aggregation in aggregations + (query.get("postAggregations") or []):
+            # filtered aggregators are named after the aggregator they wrap
+            while "name" not in aggregation and "aggregator" in aggregation:
+                aggregation = aggregation["aggregator"]
+            names.append(aggregation.get("name"))
+
+        return [name for name in names if isinstance(name, str)]
+
+    def export_pandas(self, parse_timestamps=False):
         """
         Export the current query result to a Pandas DataFrame object.
 
+        The result is gathered into one list of values per column, from which
+        the DataFrame is built.
+
+        :param bool parse_timestamps: convert the `timestamp` column (or the
+          `__time` column of scan queries) to `datetime64` values in UTC
         :return: The DataFrame representing the query result
         :rtype: DataFrame
         :raise NotImplementedError:
@@ -159,46 +311,87 @@ class Query(MutableSequence):
         import pandas
 
         if self.result:
-            if self.query_type == "timeseries":
-                nres = [
-                    list(v["result"].items()) + [("timestamp", v["timestamp"])]
-                    for v in self.result
-                ]
-                nres = [dict(v) for v in nres]
-            elif self.query_type == "topN":
-                nres = []
-                for item in self.result:
-                    timestamp = item["timestamp"]
-                    results = item["result"]
-                    tres = [
-                        dict(list(res.items()) + [("timestamp", timestamp)])
-                        for res in results
-                    ]
-                    nres += tres
-            elif self.query_type == "groupBy":
-                nres = [
-                    list(v["event"].items()) + [("timestamp", v["timestamp"])]
-                    for v in self.result
-                ]
-                nres = [dict(v) for v in nres]
-            elif self.query_type == "select":
-                nres = []
-                for item in self.result:
-                    nres += [e.get("event") for e in item["result"].get("events")]
-            elif self.query_type == "scan":
-                nres = []
-                for item in self.result:
-                    nres += [e for e in item.get("events")]
-            else:
-                raise NotImplementedError(
-                    "Pandas export not implemented for query "
-                    "type: {0}".format(self.query_type)
-                )
-
-            return pandas.DataFrame(nres)
+            columns = self._columns()
+            if parse_timestamps:
+                if self.query_type == "scan" and "__time" in columns:
+                    columns["__time"] = pandas.to_datetime(
+                        columns["__time"], unit="ms", utc=True
+                    )
+                elif "timestamp" in columns:
+                    columns["timestamp"] = pandas.to_datetime(
+                        columns["timestamp"], utc=True
+                    )
+            return pandas.DataFrame(columns)
 
         return pandas.DataFrame()
 
+    def export_arrow(self):
+        """
+        Export the current query result to an Arrow table.
+
+        Scan results are converted one block at a time.
+
+        :return: The table representing the query result
+        :rtype: pyarrow.Table
+        :raise NotImplementedError:
+
+        Example
+
+        .. code-block:: python
+            :linenos:
+
+                >>> top = client.topn(...)
+                >>> table = top.export_arrow()
+                >>> polars.from_arrow(table)
+        """
+        if not self.result:
+            return columns_to_arrow([])
+        if self.query_type == "scan":
+            return columns_to_arrow(scan_columns([block]) for block in self.result)
+        return columns_to_arrow([self._columns()])
+
+    def export_parquet(self, dest_path, **kwargs):
+        """
+        Export the current query result to a Parquet file.
+
+        :param str dest_path: file to write query results to
+        :param kwargs: options passed to `pyarrow.parquet.write_table`, e.g.
+          `compression`
+        :raise NotImplementedError:
+        """
+        import pyarrow.parquet
+
+        pyarrow.parquet.write_table(self.export_arrow(), dest_path, **kwargs)
+
+    def _columns(self):
+        """Gather the current query result into a list of values per column."""
+        if self.query_type == "timeseries":
+            columns = rows_to_columns(v["result"] for v in self.result)
+            columns["timestamp"] = [v["timestamp"] for v in self.result]
+        elif self.query_type == "topN":
+            columns = rows_to_columns(
+                res for item in self.result for res in item["result"]
+            )
+            columns["timestamp"] = [
+                item["timestamp"] for item in self.result for _ in item["result"]
+            ]
+        elif self.query_type == "groupBy":
+            columns = rows_to_columns(v["event"] for v in self.result)
+            columns["timestamp"] = [v["timestamp"] for v in self.result]
+        elif self.query_type == "select":
+            columns = rows_to_columns(
+                e.get("event")
+                for item in self.result
+                for e in item["result"].get("events")
+            )
+        elif self.query_type == "scan":
+            columns = scan_columns(self.result)
+        else:
+            raise NotImplementedError(
+                "Export not implemented for query type: {0}".format(self.query_type)
+            )
+        return columns
+
     def __str__(self):
         return str(self.result)
 
@@ -520,7 +713,9 @@ class QueryBuilder(object):
             "intervals",
             "limit",
             "order",
-            "offset"
+            "offset",
+            "batchSize",
+            "resultFormat",
         ]
         self.validate_query(query_type, valid_parts, args)
         return self.build_query(query_type, args)
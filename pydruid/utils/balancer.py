@@ -0,0 +1,208 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Load balancing of queries between the brokers or routers of a cluster.
+
+Each query goes to the broker with the fewest requests in flight, so that a
+broker that's slow, e.g. during a garbage collection, gets fewer queries.
+Brokers failing `max_failures` requests in a row, or failing a health check,
+are ejected: they're not sent queries until they pass a health check, or for
+`eject_for` seconds when there are no health checks.
+"""
+
+import threading
+import time
+from collections import deque
+
+# consecutive failed requests after which a broker is ejected
+MAX_FAILURES = 3
+
+# seconds during which an ejected broker isn't sent queries
+EJECT_FOR = 30
+
+# number of recent request latencies kept to compute the hedging delay
+LATENCY_WINDOW = 1000
+
+# number of latencies needed before requests are hedged
+MIN_LATENCIES = 20
+
+
+class Broker(object):
+    """
+    A broker of a `BrokerPool`.
+
+    :ivar str url: URL of the broker
+    :ivar int outstanding: number of requests in flight
+    :ivar int failures: number of consecutive failed requests
+    :ivar bool healthy: whether the last health check passed
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0
+        self.healthy = True
+        # time until which the broker isn't sent queries
+        self.ejected_until = 0
+
+    def available(self, now):
+        return self.healthy and self.ejected_until <= now
+
+
+class BrokerPool(object):
+    """
+    Brokers of a cluster, balanced by least outstanding requests.
+
+    Callers `acquire` a broker for each request and `release` it when the
+    request completes. The pool is thread-safe.
+
+    :param list urls: URLs of the brokers or routers
+    :param health_check: function called with the URL of a broker, returning
+      whether it's healthy
+    :param float health_check_interval: seconds between health checks of all
+      the brokers, in a background thread; there are no health checks by
+      default
+    :param int max_failures: consecutive failed requests after which a broker
+      is ejected
+    :param float eject_for: seconds during which a broker ejected after failed
+      requests isn't sent queries
+    """
+
+    def __init__(
+        self,
+        urls,
+        health_check=None,
+        health_check_interval=None,
+        max_failures=MAX_FAILURES,
+        eject_for=EJECT_FOR,
+    ):
+        if not urls:
+            raise ValueError("At least one broker is required")
+
+        self.brokers = [Broker(url) for url in urls]
+        self.health_check = health_check
+        self.health_check_interval = health_check_interval
+        self.max_failures = max_failures
+        self.eject_for = eject_for
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        # rotates the brokers tried first, to spread the load when they're
+        # all idle
+        self._next = 0
+        self._closed = threading.Event()
+        if health_check is not None and health_check_interval:
+            thread = threading.Thread(
+                target=self._run_health_checks, name="pydruid-health-checks"
+            )
+            thread.daemon = True
+            thread.start()
+
+    def __len__(self):
+        return len(self.brokers)
+
+    def acquire(self, exclude=None):
+        """
+        Return the broker with the fewest outstanding requests.
+
+        Ejected brokers are only used when all the brokers are ejected, as
+        trying one of them beats failing right away.
+
+        :param Broker exclude: a broker not to return, e.g. the one a request
+          is hedged against
+        :return: the broker, or None if `exclude` is the only one
+        """
+        with self._lock:
+            start = self._next
+            self._next = (start + 1) % len(self.brokers)
+            rotated = self.brokers[start:] + self.brokers[:start]
+            candidates = [broker for broker in rotated if broker is not exclude]
+            if not candidates:
+                return None
+
+            now = time.monotonic()
+            available = [broker for broker in candidates if broker.available(now)]
+            broker = min(available or candidates, key=lambda b: b.outstanding)
+            broker.outstanding += 1
+            return broker
+
+    def release(self, broker, elapsed=None, failed=False):
+        """
+        Record the completion of a request.
+
+        :param Broker broker: the broker the request was sent to
+        :param float elapsed: seconds the request took, when it succeeded
+        :param bool failed: whether the broker couldn't be reached or timed out
+        """
+        with self._lock:
+            broker.outstanding -= 1
+            if failed:
+                broker.failures += 1
+                if broker.failures >= self.max_failures:
+                    broker.ejected_until = time.monotonic() + self.eject_for
+                return
+
+            broker.failures = 0
+            if elapsed is not None:
+                self._latencies.append(elapsed)
+
+    def hedge_delay(self, quantile=0.95):
+        """
+        Return the `quantile` of the recent request latencies, in seconds.
+
+        This is None until enough requests have completed.
+        """
+        with self._lock:
+            if len(self._latencies) < MIN_LATENCIES:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(int(len(latencies) * quantile), len(latencies) - 1)]
+
+    def check_health(self):
+        """Check the health of every broker, ejecting the failing ones."""
+        for broker in self.brokers:
+            try:
+                healthy = bool(self.health_check(broker.url))
+            except Exception:
+                healthy = False
+            with self._lock:
+                broker.healthy = healthy
+                if healthy:
+                    broker.failures = 0
+                    broker.ejected_until = 0
+
+    def stats(self):
+        """
+        Return the state of the brokers.
+
+        For each broker this returns the number of `outstanding` requests, the
+        number of consecutive `failures` and whether it's `ejected`.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                broker.url: {
+                    "outstanding": broker.outstanding,
+                    "failures": broker.failures,
+                    "ejected": not broker.available(now),
+                }
+                for broker in self.brokers
+            }
+
+    def close(self):
+        """Stop the health checks."""
+        self._closed.set()
+
+    def _run_health_checks(self):
+        while not self._closed.wait(self.health_check_interval):
+            self.check_health()
@@ -0,0 +1,273 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Client-side cache of native query results, stored per granularity bucket.
+
+Results of timeseries, topN and groupBy queries are split by the bucket of
+their timestamp. When the same query runs again over an overlapping range,
+only the buckets that aren't cached are fetched from the broker. Buckets that
+are only partially covered by the query intervals, or that end less than
+`mutable_window` seconds ago and may still receive data, are never cached.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from pydruid.query import Query
+from pydruid.utils.intervals import (
+    buckets,
+    floor,
+    format_datetime,
+    format_interval,
+    parse_datetime,
+    parse_intervals,
+    simple_granularity,
+)
+from pydruid.utils.json_codec import DEFAULT_CODEC, get_codec
+from pydruid.utils.query_utils import fingerprint
+
+CACHED_QUERY_TYPES = ("timeseries", "topN", "groupBy")
+
+
+class Cache(object):
+    """
+    Base class of the result caches.
+
+    :param int maxsize: maximum number of buckets kept; the least recently
+      used ones are evicted first
+    :param float ttl: seconds after which a cached bucket expires, or `None`
+      to keep buckets until they're evicted
+    :param float mutable_window: buckets ending less than this many seconds
+      ago are always fetched again
+    """
+
+    def __init__(self, maxsize=10000, ttl=None, mutable_window=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.mutable_window = mutable_window
+
+    def get(self, key):
+        """Return a cached value, or `None` if it's missing or expired."""
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def set(self, key, value):
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def clear(self):
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def _expires(self):
+        return None if self.ttl is None else time.time() + self.ttl
+
+
+class MemoryCache(Cache):
+    """
+    Thread-safe in-memory cache.
+
+    Cached results are shared with the queries returning them, so they must
+    not be modified.
+    """
+
+    def __init__(self, maxsize=10000, ttl=None, mutable_window=3600):
+        super(MemoryCache, self).__init__(maxsize, ttl, mutable_window)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, self._expires())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache(Cache):
+    """
+    Thread-safe cache persisted in a SQLite database.
+
+    :param str path: path of the database file
+    """
+
+    def __init__(self, path, maxsize=100000, ttl=None, mutable_window=3600):
+        super(DiskCache, self).__init__(maxsize, ttl, mutable_window)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, value BLOB, expires REAL, used REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS buckets_used ON buckets(used)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT value, expires FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires <= now:
+                self._db.execute("DELETE FROM buckets WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE buckets SET used = ? WHERE key = ?", (now, key))
+        return DEFAULT_CODEC.loads(value)
+
+    def set(self, key, value):
+        value = DEFAULT_CODEC.dumps(value)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)",
+                (key, value, self._expires(), time.time()),
+            )
+            self._db.execute(
+                "DELETE FROM buckets WHERE key IN (SELECT key FROM buckets "
+                "ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            )
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM buckets")
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+
+def cacheable(query):
+    """Tell whether the results of a query can be cached per bucket."""
+    query_dict = query.query_dict
+    granularity = simple_granularity(query_dict.get("granularity", "all"))
+    return (
+        query.query_type in CACHED_QUERY_TYPES
+        and granularity not in (None, "all", "none")
+        and "intervals" in query_dict
+        and not query_dict.get("limitSpec")
+        and not query_dict.get("subtotalsSpec")
+        and not query_dict.get("context", {}).get("grandTotal")
+    )
+
+
+def cache_key(query):
+    """Return the key of a query, which is its fingerprint without intervals."""
+    return fingerprint(query.query_dict, intervals=False)
+
+
+def _contiguous(ranges):
+    merged = []
+    for start, end in ranges:
+        if merged and merged[-1][1] == start:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def execute_cached(cache, query, post, json_codec=None, decode=True):
+    """
+    Fill a query with results from the cache and the broker.
+
+    Queries that can't be cached are sent as they are. For the others the
+    merged result is serialized again into `result_json`.
+
+    :param Cache cache: the cache
+    :param Query query: the query to execute
+    :param post: function sending a query to the broker and returning it,
+      filled with results
+    :param json_codec: the `JSONCodec` or the name of the JSON backend used to
+      serialize the result; by default the fastest installed one
+    :param bool decode: make `result_json` a `str` rather than `bytes`
+    :return: the query
+    :rtype: Query
+    """
+    if not cacheable(query):
+        return post(query)
+
+    query_dict = query.query_dict
+    granularity = simple_granularity(query_dict.get("granularity", "all"))
+    key = cache_key(query)
+    horizon = datetime.now(timezone.utc) - timedelta(seconds=cache.mutable_window)
+
+    results = {}
+    missing = []
+    for start, end in sorted(parse_intervals(query_dict["intervals"])):
+        for lower, upper, full in buckets(start, end, granularity):
+            bucket = floor(lower, granularity)
+            store = full and upper <= horizon
+            bucket_key = "{0}/{1}".format(key, format_datetime(bucket))
+            cached = cache.get(bucket_key) if store else None
+            if cached is not None:
+                results[bucket] = cached
+            else:
+                missing.append((lower, upper, bucket_key if store else None))
+
+    query.transfer_stats = None
+    if missing:
+        fetch = Query(dict(query_dict), query.query_type)
+        fetch.query_dict["intervals"] = [
+            format_interval(start, end)
+            for start, end in _contiguous((lower, upper) for lower, upper, _ in missing)
+        ]
+        post(fetch)
+
+        fetched = {}
+        for item in fetch.result:
+            bucket = floor(parse_datetime(item["timestamp"]), granularity)
+            fetched.setdefault(bucket, []).append(item)
+        for lower, _, bucket_key in missing:
+            bucket = floor(lower, granularity)
+            results[bucket] = fetched.pop(bucket, [])
+            if bucket_key is not None:
+                cache.set(bucket_key, results[bucket])
+        # items out of the requested buckets, if any
+        results.update(fetched)
+        query.transfer_stats = fetch.transfer_stats
+
+    descending = bool(query_dict.get("descending"))
+    query.result = [
+        item
+        for bucket in sorted(results, reverse=descending)
+        for item in results[bucket]
+    ]
+    data = get_codec(json_codec).dumps(query.result)
+    query.result_json = data.decode("utf-8") if decode else data
+    return query
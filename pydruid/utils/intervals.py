@@ -0,0 +1,230 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+ISO-8601 intervals and the simple Druid granularities.
+
+Datetimes without a time zone are in UTC, like in Druid.
+"""
+
+import re
+from datetime import datetime, timedelta, timezone
+
+PERIOD = re.compile(
+    r"^P(?:(\d+)Y)?(?:(\d+)M)?(?:(\d+)W)?(?:(\d+)D)?"
+    r"(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d+)?)S)?)?$",
+    re.IGNORECASE,
+)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# granularities that are a fixed number of milliseconds, aligned to the epoch
+DURATIONS = {
+    "none": 1,
+    "second": 1000,
+    "minute": 60 * 1000,
+    "five_minute": 5 * 60 * 1000,
+    "ten_minute": 10 * 60 * 1000,
+    "fifteen_minute": 15 * 60 * 1000,
+    "thirty_minute": 30 * 60 * 1000,
+    "hour": 60 * 60 * 1000,
+    "six_hour": 6 * 60 * 60 * 1000,
+    "eight_hour": 8 * 60 * 60 * 1000,
+    "day": 24 * 60 * 60 * 1000,
+}
+
+# granularities aligned to the calendar
+CALENDAR = {"week", "month", "quarter", "year"}
+
+
+def parse_datetime(value):
+    """Parse an ISO-8601 datetime, returning it in UTC."""
+    value = value.strip()
+    if value.upper().endswith("Z"):
+        value = value[:-1] + "+00:00"
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError("Invalid datetime: {0}".format(value))
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def format_datetime(dt):
+    """Format a datetime like Druid does, e.g. `2013-06-14T00:00:00.000Z`."""
+    dt = dt.astimezone(timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.") + "{0:03d}Z".format(dt.microsecond // 1000)
+
+
+def add_period(dt, period, sign=1):
+    """Add (or subtract, with a negative `sign`) an ISO-8601 period."""
+    match = PERIOD.match(period.strip())
+    if not match or not any(match.groups()):
+        raise ValueError("Invalid period: {0}".format(period))
+
+    years, months, weeks, days, hours, minutes = (
+        int(value or 0) for value in match.groups()[:6]
+    )
+    seconds = float(match.group(7) or 0)
+    if years or months:
+        dt = add_months(dt, sign * (12 * years + months))
+    delta = timedelta(
+        weeks=weeks, days=days, hours=hours, minutes=minutes, seconds=seconds
+    )
+    return dt + sign * delta
+
+
+def add_months(dt, months):
+    month = dt.month - 1 + months
+    year, month = dt.year + month // 12, month % 12 + 1
+    # clamp the day to the end of shorter months
+    day = dt.day
+    while True:
+        try:
+            return dt.replace(year=year, month=month, day=day)
+        except ValueError:
+            day -= 1
+
+
+def parse_interval(interval):
+    """
+    Parse an ISO-8601 interval into its `(start, end)` datetimes.
+
+    Both ends can be a datetime, or one of them a period, e.g.
+    `2013-06-14/pt1h` or `P1D/2013-06-15`.
+    """
+    try:
+        start, end = interval.split("/")
+    except ValueError:
+        raise ValueError("Invalid interval: {0}".format(interval))
+
+    if start.upper().startswith("P"):
+        end = parse_datetime(end)
+        return add_period(end, start, sign=-1), end
+    start = parse_datetime(start)
+    if end.upper().startswith("P"):
+        return start, add_period(start, end)
+    return start, parse_datetime(end)
+
+
+def format_interval(start, end):
+    return "{0}/{1}".format(format_datetime(start), format_datetime(end))
+
+
+def parse_intervals(intervals):
+    """Parse the intervals of a query, given as a string or a list."""
+    if isinstance(intervals, str):
+        intervals = [intervals]
+    return [parse_interval(interval) for interval in intervals]
+
+
+def simple_granularity(granularity):
+    """
+    Return the name of a simple granularity, or `None` for other ones.
+
+    Granularities with a period, a time zone or an origin are not simple.
+    """
+    if isinstance(granularity, dict):
+        if set(granularity) == {"type"}:
+            granularity = granularity["type"]
+        else:
+            return None
+    if not isinstance(granularity, str):
+        return None
+    granularity = granularity.lower()
+    if granularity == "all" or granularity in DURATIONS or granularity in CALENDAR:
+        return granularity
+    return None
+
+
+def floor(dt, granularity):
+    """Truncate a datetime to the start of its bucket for a simple granularity."""
+    if granularity == "all":
+        return dt
+    if granularity in DURATIONS:
+        millis = (dt - EPOCH) // timedelta(milliseconds=1)
+        millis -= millis % DURATIONS[granularity]
+        return EPOCH + timedelta(milliseconds=millis)
+
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "week":
+        # weeks start on Monday
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    if granularity == "quarter":
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    if granularity == "year":
+        return day.replace(month=1, day=1)
+    raise ValueError("Unsupported granularity: {0}".format(granularity))
+
+
+def next_bucket(dt, granularity):
+    """Return the start of the bucket following the one starting at `dt`."""
+    if granularity in DURATIONS:
+        return dt + timedelta(milliseconds=DURATIONS[granularity])
+    if granularity == "week":
+        return dt + timedelta(weeks=1)
+    if granularity in ("month", "quarter", "year"):
+        return add_months(dt, {"month": 1, "quarter": 3, "year": 12}[granularity])
+    raise ValueError("Unsupported granularity: {0}".format(granularity))
+
+
+def buckets(start, end, granularity):
+    """
+    Generate the buckets of a granularity overlapping an interval.
+
+    :return: `(start, end, full)` tuples, where the bounds are clipped to the
+      interval and `full` tells whether the whole bucket is in the interval
+    """
+    lower = floor(start, granularity)
+    while lower < end:
+        upper = next_bucket(lower, granularity)
+        yield max(lower, start), min(upper, end), lower >= start and upper <= end
+        lower = upper
+
+
+def split_intervals(intervals, granularity, shards):
+    """
+    Split intervals into up to `shards` consecutive groups of intervals.
+
+    The groups cover about the same time span and are split at the boundaries
+    of the buckets of the granularity, so that no bucket spans two groups.
+
+    :param list intervals: `(start, end)` datetimes, as from `parse_intervals`
+    :param str granularity: a simple granularity
+    :param int shards: maximum number of groups
+    :return: a list of groups of `(start, end)` datetimes, in time order
+    """
+    intervals = sorted(intervals)
+    start = intervals[0][0]
+    end = max(interval_end for _, interval_end in intervals)
+
+    boundaries = [start]
+    for i in range(1, shards):
+        boundary = floor(start + (end - start) * i / shards, granularity)
+        if boundary > boundaries[-1] and boundary < end:
+            boundaries.append(boundary)
+    boundaries.append(end)
+
+    groups = []
+    for lower, upper in zip(boundaries, boundaries[1:]):
+        group = [
+            (max(lower, interval_start), min(upper, interval_end))
+            for interval_start, interval_end in intervals
+            if interval_start < upper and interval_end > lower
+        ]
+        if group:
+            groups.append(group)
+    return groups
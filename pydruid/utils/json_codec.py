@@ -0,0 +1,101 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+from collections import OrderedDict
+
+
+class JSONCodec(object):
+    """
+    A JSON backend used to encode queries and decode results.
+
+    :param str name: name of the backend
+    :param dumps: function serializing an object to UTF-8 encoded `bytes`
+    :param loads: function parsing a `str` or `bytes` document
+    """
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return "JSONCodec({0!r})".format(self.name)
+
+
+def _json():
+    def dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+
+    return JSONCodec("json", dumps, json.loads)
+
+
+def _orjson():
+    import orjson
+
+    return JSONCodec("orjson", orjson.dumps, orjson.loads)
+
+
+def _simdjson():
+    import simdjson
+
+    # simdjson only parses documents
+    return JSONCodec("simdjson", _json().dumps, simdjson.loads)
+
+
+def _ujson():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(
+            obj, ensure_ascii=False, escape_forward_slashes=False
+        ).encode("utf-8")
+
+    return JSONCodec("ujson", dumps, ujson.loads)
+
+
+# supported backends, fastest first
+BACKENDS = OrderedDict(
+    [("orjson", _orjson), ("simdjson", _simdjson), ("ujson", _ujson), ("json", _json)]
+)
+
+
+def _fastest():
+    for backend in BACKENDS.values():
+        try:
+            return backend()
+        except ImportError:
+            pass
+
+
+# the fastest installed backend, used unless another one is requested
+DEFAULT_CODEC = _fastest()
+
+
+def get_codec(codec=None):
+    """
+    Return a JSON codec.
+
+    :param codec: a `JSONCodec`, or the name of a backend (`orjson`,
+      `simdjson`, `ujson` or `json`); by default the fastest installed
+      backend is used
+    :raise ValueError: if the backend is unknown
+    :raise ImportError: if the backend is not installed
+    """
+    if codec is None:
+        return DEFAULT_CODEC
+    if isinstance(codec, JSONCodec):
+        return codec
+    if codec not in BACKENDS:
+        raise ValueError("Unknown JSON codec: {0}".format(codec))
+    return BACKENDS[codec]()
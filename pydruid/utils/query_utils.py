@@ -15,6 +15,47 @@
 #
 import codecs
 import csv
+import hashlib
+import json
+import re
+from collections import OrderedDict
+
+from pydruid.utils.intervals import format_interval, parse_intervals, simple_granularity
+from pydruid.utils.json_codec import get_codec
+
+# context keys that don't change the result of a query
+IGNORED_CONTEXT = ("queryId", "sqlQueryId", "timeout", "priority", "lane")
+
+# logical filters and having specs, and the key of their operands
+LOGICAL_OPERANDS = {"and": ("fields", "havingSpecs"), "or": ("fields", "havingSpecs")}
+
+# a JSON string, with escaped characters
+JSON_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+
+# the remainder of a JSON string, up to the closing quote or the end of the
+# chunk; the group captures the closing quote or a trailing backslash
+STRING_TAIL = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*("|\\)?', re.S)
+
+# tokens that change the state of the row splitter
+ROW_TOKENS = re.compile(r'[{}]|"' + STRING_TAIL.pattern, re.S)
+
+
+def nested_object_pattern(levels):
+    """
+    Build a regular expression matching a complete JSON object.
+
+    Python regular expressions can't match arbitrarily nested brackets, so the
+    pattern supports up to `levels` of nested objects; deeper rows are handled
+    by the slower tokenizer. The loops are unrolled so that a failed match
+    doesn't backtrack exponentially.
+    """
+    pattern = r'\{[^{}"]*(?:' + JSON_STRING + r'[^{}"]*)*\}'
+    for _ in range(levels):
+        pattern = r'\{[^{}"]*(?:(?:' + JSON_STRING + "|" + pattern + r')[^{}"]*)*\}'
+    return pattern
+
+
+ROW = re.compile(nested_object_pattern(3), re.S)
 
 # A special CSV writer which will write rows to TSV file "f", which is encoded in utf-8.
 # this is necessary because the values in druid are not all ASCII.
@@ -37,5 +78,355 @@ class UnicodeWriter(object):
         self.writer.writerow(row)
 
     def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
+        self.writer.writerows(rows)
+
+
+class RowSplitter(object):
+    """
+    Incremental splitter for a JSON array of objects streamed in chunks.
+
+    Rows that are fully contained in a chunk are matched in a single pass of
+    the `ROW` regular expression. Rows spanning chunks are tokenized, keeping
+    the bracket depth and the string/escape state between calls to `feed`, so
+    every character is scanned only once no matter how rows and chunks align.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        # pieces of a row that started in a previous chunk
+        self.partial = []
+
+    def feed(self, chunk):
+        """Consume a chunk, returning the JSON text of every row it completes."""
+        rows = []
+        pos = self._scan(chunk, 0, rows) if self.depth else 0
+        while pos is not None:
+            start = chunk.find("{", pos)
+            if start == -1:
+                break
+
+            match = ROW.match(chunk, start)
+            if match:
+                rows.append(match.group())
+                pos = match.end()
+            else:
+                pos = self._scan(chunk, start, rows)
+
+        return rows
+
+    def parse(self, chunk, loads):
+        """Consume a chunk, returning the rows it completes parsed with `loads`."""
+        if not chunk:
+            return []
+        rows = self.feed(chunk)
+        if not rows:
+            return []
+        return loads("[{rows}]".format(rows=",".join(rows)))
+
+    def _scan(self, chunk, pos, rows):
+        """
+        Tokenize a row that is incomplete or too deeply nested for `ROW`.
+
+        Returns the position after the end of the row, or `None` if the row
+        continues in the next chunk.
+        """
+        start = pos
+        if self.in_string:
+            match = STRING_TAIL.match(chunk, pos + 1 if self.escaped else pos)
+            if match.group(1) != '"':
+                self.escaped = match.group(1) == "\\"
+                self.partial.append(chunk[start:])
+                return None
+            self.in_string = False
+            pos = match.end()
+
+        depth = self.depth
+        for match in ROW_TOKENS.finditer(chunk, pos):
+            token = match.group()
+            if token == "{":
+                depth += 1
+            elif token == "}":
+                depth -= 1
+                if depth == 0:
+                    end = match.end()
+                    self.depth = 0
+                    self.partial.append(chunk[start:end])
+                    row = "".join(self.partial)
+                    self.partial = []
+                    rows.append(row)
+                    return end
+            elif match.group(1) != '"':
+                # string continues in the next chunk
+                self.in_string = True
+                self.escaped = match.group(1) == "\\"
+
+        self.depth = depth
+        self.partial.append(chunk[start:])
+        return None
+
+
+class LineSplitter(object):
+    """
+    Incremental splitter for text streamed in chunks, yielding complete lines.
+
+    With a `quotechar`, newlines between quotes don't end a line, so that CSV
+    records with multi-line values are kept whole.
+    """
+
+    def __init__(self, quotechar=None):
+        self.quotechar = quotechar
+        # the incomplete line at the end of the previous chunk
+        self.buffer = ""
+
+    def feed(self, chunk):
+        """Consume a chunk, returning every line it completes."""
+        lines = (self.buffer + chunk).split("\n")
+        self.buffer = lines.pop()
+        if self.quotechar is None:
+            return lines
+
+        records = []
+        pending = None
+        for line in lines:
+            pending = line if pending is None else pending + "\n" + line
+            if pending.count(self.quotechar) % 2 == 0:
+                records.append(pending)
+                pending = None
+        if pending is not None:
+            self.buffer = pending + "\n" + self.buffer
+        return records
+
+    def flush(self):
+        """Return the last line, if the text doesn't end with a newline."""
+        buffer, self.buffer = self.buffer, ""
+        return [buffer] if buffer else []
+
+
+def rows_from_chunks(chunks, json_codec=None):
+    """
+    A generator that yields rows from JSON chunks.
+
+    Druid will return the data in chunks, but they are not aligned with the
+    JSON objects. This function will parse all complete rows inside each chunk,
+    yielding them as soon as possible.
+    """
+    loads = get_codec(json_codec).loads
+    splitter = RowSplitter()
+    for chunk in chunks:
+        for row in splitter.parse(chunk, loads):
+            yield row
+
+
+def scan_columns(blocks):
+    """
+    Gather the events of scan result blocks into a list of values per column.
+
+    Blocks in the `compactedList` result format have every event as a list of
+    values in the order of the `columns` header, so they are transposed
+    without building a dict per row. Blocks in the `list` format are also
+    accepted. Columns missing from some blocks are filled with `None`.
+
+    :param blocks: the scan result, or an iterable of blocks such as the one
+      returned by `PyDruid.scan_iter`
+    :return: an ordered dict mapping column names to lists of values
+    """
+    columns = OrderedDict()
+    count = 0
+    for block in blocks:
+        events = block.get("events")
+        if not events:
+            continue
+
+        names = block["columns"]
+        if isinstance(events[0], dict):
+            values = ([event.get(name) for event in events] for name in names)
+        else:
+            values = zip(*events)
+
+        for name, column in zip(names, values):
+            if name not in columns:
+                columns[name] = [None] * count
+            columns[name].extend(column)
+
+        count += len(events)
+        for column in columns.values():
+            if len(column) < count:
+                column.extend([None] * (count - len(column)))
+
+    return columns
+
+
+def rows_to_columns(rows):
+    """
+    Gather dict rows into a list of values per column, in a single pass.
+
+    Columns are ordered by their first appearance, and keys missing from some
+    rows are filled with `None`.
+
+    :param rows: an iterable of dicts
+    :return: an ordered dict mapping column names to lists of values
+    """
+    columns = OrderedDict()
+    count = 0
+    for row in rows:
+        for name, value in row.items():
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = [None] * count
+            column.append(value)
+
+        count += 1
+        if len(row) != len(columns):
+            for column in columns.values():
+                if len(column) < count:
+                    column.append(None)
+
+    return columns
+
+
+def columns_to_arrow(batches, names=None):
+    """
+    Build an Arrow table from batches of columns.
+
+    Every batch is converted to Arrow as soon as it is received, so that only
+    one batch of Python values is held in memory at a time. Columns missing
+    from some batches are filled with nulls, and columns that are null in some
+    batches take the type they have in the others.
+
+    :param batches: an iterable of dicts mapping column names to lists of values
+    :param list names: column names of the table when there are no batches
+    :return: a `pyarrow.Table`
+    """
+    import pyarrow
+
+    tables = [pyarrow.table(columns) for columns in batches if columns]
+    if not tables:
+        return pyarrow.table(
+            OrderedDict((name, pyarrow.array([], pyarrow.null())) for name in names or [])
+        )
+
+    schema = pyarrow.unify_schemas([table.schema for table in tables])
+    for i, table in enumerate(tables):
+        tables[i] = pyarrow.Table.from_arrays(
+            [
+                table.column(field.name).cast(field.type)
+                if field.name in table.column_names
+                else pyarrow.nulls(table.num_rows, field.type)
+                for field in schema
+            ],
+            schema=schema,
+        )
+
+    return pyarrow.concat_tables(tables)
+
+
+def _canonical_json(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def _normalize(value):
+    """Normalize the filters and having specs nested in a value."""
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    value = {key: _normalize(item) for key, item in value.items()}
+    operator = value.get("type")
+    if operator in LOGICAL_OPERANDS:
+        for key in LOGICAL_OPERANDS[operator]:
+            if isinstance(value.get(key), list):
+                value[key] = _logical_operands(operator, key, value[key])
+                if len(value[key]) == 1 and len(value) == 2:
+                    # a single operand is the same as the operand itself
+                    return value[key][0]
+    elif operator == "in" and isinstance(value.get("values"), list):
+        value["values"] = sorted(set(value["values"]), key=_canonical_json)
+    return value
+
+
+def _logical_operands(operator, key, operands):
+    """Flatten nested operations of the same type, and sort their operands."""
+    flattened = {}
+    for operand in operands:
+        if (
+            isinstance(operand, dict)
+            and operand.get("type") == operator
+            and isinstance(operand.get(key), list)
+            and len(operand) == 2
+        ):
+            nested = operand[key]
+        else:
+            nested = [operand]
+        for item in nested:
+            flattened[_canonical_json(item)] = item
+    return [flattened[key] for key in sorted(flattened)]
+
+
+def normalize_query(query_dict, intervals=True):
+    """
+    Return a canonical version of a native query.
+
+    Queries that are built differently but return the same results normalize
+    to the same dict: nested `and` and `or` filters are flattened and their
+    fields sorted, aggregators are sorted by name, intervals and granularity
+    are normalized, and context keys not changing the results are dropped.
+
+    :param dict query_dict: the query
+    :param bool intervals: keep the intervals; queries with the same
+      normalized dict without intervals only differ by their time range
+    """
+    query = _normalize(query_dict)
+
+    if "aggregations" in query:
+        query["aggregations"] = sorted(query["aggregations"], key=_canonical_json)
+
+    if not intervals:
+        query.pop("intervals", None)
+    elif "intervals" in query:
+        try:
+            query["intervals"] = sorted(
+                format_interval(start, end)
+                for start, end in parse_intervals(query["intervals"])
+            )
+        except (AttributeError, TypeError, ValueError):
+            pass  # leave unsupported intervals unchanged
+
+    granularity = query.get("granularity")
+    if granularity is not None:
+        simple = simple_granularity(granularity)
+        if simple is not None:
+            query["granularity"] = simple
+        elif isinstance(granularity, dict) and "period" in granularity:
+            query["granularity"] = dict(
+                granularity, period=granularity["period"].upper()
+            )
+
+    datasource = query.get("dataSource")
+    if isinstance(datasource, dict) and set(datasource) == {"type", "name"}:
+        if datasource["type"] == "table":
+            query["dataSource"] = datasource["name"]
+
+    context = {
+        key: value
+        for key, value in (query.pop("context", None) or {}).items()
+        if key not in IGNORED_CONTEXT
+    }
+    if context:
+        query["context"] = context
+    return query
+
+
+def fingerprint(query_dict, intervals=True):
+    """
+    Return a hash of the normalized version of a native query.
+
+    :param dict query_dict: the query
+    :param bool intervals: include the intervals
+    :return: a SHA-256 hex digest
+    :rtype: str
+    """
+    normalized = normalize_query(query_dict, intervals)
+    return hashlib.sha256(_canonical_json(normalized).encode("utf-8")).hexdigest()
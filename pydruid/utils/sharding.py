@@ -0,0 +1,237 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Split timeseries and groupBy queries by interval, and merge their results.
+
+Shards are split at the bucket boundaries of the query granularity, so with
+any granularity but `all` every bucket is computed by a single shard and the
+results are simply concatenated. With the `all` granularity the shards
+compute partial aggregates of the same bucket, which are merged here; this is
+only exact for sums, counts, minimums and maximums.
+"""
+
+import copy
+
+from pydruid.query import Query
+from pydruid.utils.intervals import (
+    format_interval,
+    parse_intervals,
+    simple_granularity,
+    split_intervals,
+)
+from pydruid.utils.json_codec import get_codec
+
+SHARDED_QUERY_TYPES = ("timeseries", "groupBy")
+
+# functions merging the partial results of the aggregators
+MERGE_FUNCTIONS = {
+    "count": sum,
+    "longSum": sum,
+    "doubleSum": sum,
+    "floatSum": sum,
+    "min": min,
+    "longMin": min,
+    "doubleMin": min,
+    "floatMin": min,
+    "max": max,
+    "longMax": max,
+    "doubleMax": max,
+    "floatMax": max,
+}
+
+
+def _merge_function(aggregator):
+    if aggregator.get("type") == "filtered":
+        return _merge_function(aggregator["aggregator"])
+    return MERGE_FUNCTIONS.get(aggregator.get("type"))
+
+
+def _name(aggregator):
+    # filtered aggregators are named by the aggregator they wrap
+    if "name" not in aggregator and aggregator.get("type") == "filtered":
+        return _name(aggregator["aggregator"])
+    return aggregator.get("name")
+
+
+def _mergers(query_dict):
+    """
+    Return the functions merging the aggregates of the `all` granularity.
+
+    :raise ValueError: if the partial results can't be merged exactly
+    """
+    if query_dict.get("postAggregations"):
+        raise ValueError("Post-aggregations can't be merged across shards")
+    if query_dict.get("having"):
+        raise ValueError("A having filter can't be applied across shards")
+
+    mergers = {}
+    for aggregator in query_dict.get("aggregations", []):
+        merge = _merge_function(aggregator)
+        if merge is None:
+            raise ValueError(
+                "Aggregator {0} of type {1} can't be merged across shards".format(
+                    _name(aggregator), aggregator.get("type")
+                )
+            )
+        mergers[_name(aggregator)] = merge
+    return mergers
+
+
+def split_query(query, shards):
+    """
+    Split a query into up to `shards` queries over consecutive intervals.
+
+    :param Query query: a timeseries or groupBy query
+    :param int shards: maximum number of queries
+    :return: the queries, in time order
+    :rtype: list
+    :raise ValueError: if the results of the queries can't be merged exactly
+    """
+    query_dict = query.query_dict
+    if query.query_type not in SHARDED_QUERY_TYPES:
+        raise ValueError(
+            "Only timeseries and groupBy queries can be sharded, not {0}".format(
+                query.query_type
+            )
+        )
+    if shards < 1:
+        raise ValueError("The number of shards must be positive")
+
+    granularity = simple_granularity(query_dict.get("granularity", "all"))
+    if granularity is None:
+        raise ValueError(
+            "Granularity {0} is not supported for sharding".format(
+                query_dict.get("granularity")
+            )
+        )
+    if query_dict.get("limitSpec"):
+        raise ValueError("A limit spec can't be applied across shards")
+    if query_dict.get("subtotalsSpec"):
+        raise ValueError("Subtotals can't be computed across shards")
+    if query_dict.get("context", {}).get("grandTotal"):
+        raise ValueError("A grand total can't be computed across shards")
+    if granularity == "all":
+        # fail early
+        _mergers(query_dict)
+
+    groups = split_intervals(
+        parse_intervals(query_dict["intervals"]), granularity, shards
+    )
+    queries = []
+    for group in groups:
+        shard_dict = copy.deepcopy(query_dict)
+        shard_dict["intervals"] = [format_interval(*interval) for interval in group]
+        queries.append(Query(shard_dict, query.query_type))
+    return queries
+
+
+def merge_results(query, shards, json_codec=None, decode=True):
+    """
+    Fill a query with the results of its shards.
+
+    The merged result is serialized again into `result_json`.
+
+    :param Query query: the query that was split
+    :param list shards: the queries returned by `split_query`, with results
+    :param json_codec: the `JSONCodec` or the name of the JSON backend used to
+      serialize the result; by default the fastest installed one
+    :param bool decode: make `result_json` a `str` rather than `bytes`
+    :return: the query
+    :rtype: Query
+    """
+    query_dict = query.query_dict
+    if query_dict.get("descending"):
+        shards = shards[::-1]
+
+    results = [shard.result for shard in shards]
+    if simple_granularity(query_dict.get("granularity", "all")) == "all":
+        mergers = _mergers(query_dict)
+        if query.query_type == "timeseries":
+            result = _merge_timeseries(results, mergers)
+        else:
+            result = _merge_groupby(results, mergers)
+    else:
+        result = [item for items in results for item in items]
+
+    query.result = result
+    data = get_codec(json_codec).dumps(result)
+    query.result_json = data.decode("utf-8") if decode else data
+    query.transfer_stats = _sum_stats(shard.transfer_stats for shard in shards)
+    return query
+
+
+def _merge(values, merge):
+    values = [value for value in values if value is not None]
+    return merge(values) if values else None
+
+
+def _merge_rows(rows, mergers):
+    merged = {}
+    for name in rows[0]:
+        if name in mergers:
+            merged[name] = _merge((row.get(name) for row in rows), mergers[name])
+        else:
+            merged[name] = rows[0][name]
+    return merged
+
+
+def _merge_timeseries(results, mergers):
+    items = [item for items in results for item in items]
+    if not items:
+        return []
+    return [
+        {
+            "timestamp": min(item["timestamp"] for item in items),
+            "result": _merge_rows([item["result"] for item in items], mergers),
+        }
+    ]
+
+
+def _merge_groupby(results, mergers):
+    items = [item for items in results for item in items]
+    if not items:
+        return []
+    timestamp = min(item["timestamp"] for item in items)
+
+    # group the rows by their dimension values, keeping the first seen order
+    groups = {}
+    for item in items:
+        event = item["event"]
+        key = tuple(
+            (name, tuple(value) if isinstance(value, list) else value)
+            for name, value in event.items()
+            if name not in mergers
+        )
+        groups.setdefault(key, []).append(item)
+
+    merged = []
+    for group in groups.values():
+        item = dict(group[0], timestamp=timestamp)
+        item["event"] = _merge_rows([row["event"] for row in group], mergers)
+        merged.append(item)
+    return merged
+
+
+def _sum_stats(stats):
+    total = None
+    for shard_stats in stats:
+        if shard_stats is None:
+            continue
+        if total is None:
+            total = dict(shard_stats)
+            continue
+        for name, value in shard_stats.items():
+            if isinstance(value, int) and isinstance(total.get(name), int):
+                total[name] += value
+    return total
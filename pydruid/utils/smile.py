@@ -0,0 +1,303 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Decoder for Smile, the binary JSON format of Jackson.
+
+Druid brokers send native query results in Smile when the request has an
+``Accept: application/x-jackson-smile`` header. The format is described in
+https://github.com/FasterXML/smile-format-specification.
+"""
+import struct
+from decimal import Decimal
+
+CONTENT_TYPE = "application/x-jackson-smile"
+
+# every document starts with ":)\n" followed by a version and flags byte
+HEADER = b":)\n"
+
+FLAG_SHARED_NAMES = 0x01
+FLAG_SHARED_VALUES = 0x02
+
+# shared name and value tables are reset once they have this many entries
+MAX_SHARED = 1024
+
+# small ints are zigzag encoded in the 5 lower bits of the token
+SMALL_INTS = [(v >> 1) ^ -(v & 1) for v in range(32)]
+
+END_OF_STRING = 0xFC
+
+
+class SmileError(ValueError):
+    pass
+
+
+def zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+class SmileDecoder(object):
+    """
+    Decode a Smile document into Python objects, like `json.loads`.
+
+    Strings and names are decoded straight from the input buffer, and shared
+    names and values are resolved from the back-reference tables.
+    """
+
+    def __init__(self, data):
+        if data[:3] != HEADER or len(data) < 4:
+            raise SmileError("Missing Smile header")
+        flags = data[3]
+        if flags >> 4:
+            raise SmileError("Unsupported Smile version {0}".format(flags >> 4))
+
+        self.data = data
+        self.pos = 4
+        self.names = [] if flags & FLAG_SHARED_NAMES else None
+        self.values = [] if flags & FLAG_SHARED_VALUES else None
+
+    def decode(self):
+        try:
+            value = self._value()
+        except (IndexError, TypeError):
+            # a truncated document, or a reference to a missing shared string
+            raise SmileError("Invalid Smile document")
+
+        # an end marker is optional
+        if self.pos < len(self.data) and self.data[self.pos] != 0xFF:
+            raise SmileError("Extra data at position {0}".format(self.pos))
+        return value
+
+    def _value(self):
+        data = self.data
+        pos = self.pos
+        token = data[pos]
+        pos += 1
+
+        if token >= 0x40 and token < 0xC0:
+            # tiny and short ASCII (1 - 64 bytes) and Unicode (2 - 65 bytes)
+            if token < 0x80:
+                end = pos + token - 0x3F
+                text = data[pos:end].decode("ascii")
+            else:
+                end = pos + token - 0x7E
+                text = data[pos:end].decode("utf-8")
+            if end > len(data):
+                raise IndexError("Truncated string")
+            self.pos = end
+            if self.values is not None:
+                self._share(self.values, text)
+            return text
+
+        self.pos = pos
+        if token >= 0xC0 and token < 0xE0:
+            return SMALL_INTS[token & 0x1F]
+        if token == 0xFA:
+            return self._object()
+        if token == 0xF8:
+            return self._array()
+        if token < 0x20:
+            return self._shared_value(token - 1)
+        if token < 0x40:
+            return self._literal(token)
+        if token == 0xE0 or token == 0xE4:
+            return self._long_text().decode("ascii" if token == 0xE0 else "utf-8")
+        if token >= 0xEC and token <= 0xEF:
+            self.pos += 1
+            return self._shared_value(((token & 0x03) << 8) | data[pos])
+        if token == 0xE8:
+            return self._7bit_binary(self._vint())
+        if token == 0xFD:
+            length = self._vint()
+            start = self.pos
+            end = self.pos = start + length
+            if end > len(data):
+                raise IndexError("Truncated value")
+            return data[start:end]
+
+        raise SmileError("Invalid token 0x{0:02X} at position {1}".format(token, pos))
+
+    def _literal(self, token):
+        if token == 0x20:
+            return ""
+        if token == 0x21:
+            return None
+        if token == 0x22:
+            return False
+        if token == 0x23:
+            return True
+        if token == 0x24 or token == 0x25:
+            return zigzag(self._vint())
+        if token == 0x26:
+            return int.from_bytes(self._7bit_binary(self._vint()), "big", signed=True)
+        if token == 0x28:
+            bits = self._7bit_int(5) & 0xFFFFFFFF
+            return struct.unpack(">f", bits.to_bytes(4, "big"))[0]
+        if token == 0x29:
+            bits = self._7bit_int(10) & 0xFFFFFFFFFFFFFFFF
+            return struct.unpack(">d", bits.to_bytes(8, "big"))[0]
+        if token == 0x2A:
+            scale = zigzag(self._vint())
+            unscaled = self._7bit_binary(self._vint())
+            return Decimal(int.from_bytes(unscaled, "big", signed=True)).scaleb(-scale)
+
+        raise SmileError(
+            "Invalid token 0x{0:02X} at position {1}".format(token, self.pos - 1)
+        )
+
+    def _object(self):
+        obj = {}
+        data = self.data
+        size = len(data)
+        names = self.names
+        values = self.values
+        pos = self.pos
+        while True:
+            token = data[pos]
+            pos += 1
+
+            # names
+            if token >= 0x40 and token < 0x80:
+                name = names[token & 0x3F]
+            elif token >= 0x80 and token < 0xF8:
+                # short ASCII (1 - 64 bytes) and Unicode (2 - 57 bytes) names
+                if token < 0xC0:
+                    end = pos + token - 0x7F
+                    name = data[pos:end].decode("ascii")
+                else:
+                    end = pos + token - 0xBE
+                    name = data[pos:end].decode("utf-8")
+                if end > size:
+                    raise IndexError("Truncated name")
+                pos = end
+                if names is not None:
+                    self._share(names, name)
+            elif token == 0xFB:
+                self.pos = pos
+                return obj
+            elif token == 0x20:
+                name = ""
+            elif token >= 0x30 and token <= 0x33:
+                name = names[((token & 0x03) << 8) | data[pos]]
+                pos += 1
+            elif token == 0x34:
+                # long names are shared too, unlike long values
+                self.pos = pos
+                name = self._long_text().decode("utf-8")
+                pos = self.pos
+                if names is not None:
+                    self._share(names, name)
+            else:
+                raise SmileError(
+                    "Invalid name token 0x{0:02X} at position {1}".format(
+                        token, pos - 1
+                    )
+                )
+
+            # the most common values are decoded inline
+            token = data[pos]
+            if token >= 0xC0 and token < 0xE0:
+                obj[name] = SMALL_INTS[token & 0x1F]
+                pos += 1
+            elif token >= 0x40 and token < 0x80:
+                pos += 1
+                end = pos + token - 0x3F
+                if end > size:
+                    raise IndexError("Truncated string")
+                text = obj[name] = data[pos:end].decode("ascii")
+                pos = end
+                if values is not None:
+                    self._share(values, text)
+            else:
+                self.pos = pos
+                obj[name] = self._value()
+                pos = self.pos
+
+    def _array(self):
+        array = []
+        data = self.data
+        while data[self.pos] != 0xF9:
+            array.append(self._value())
+        self.pos += 1
+        return array
+
+    @staticmethod
+    def _share(table, text):
+        if len(table) >= MAX_SHARED:
+            del table[:]
+        table.append(text)
+
+    def _shared_value(self, index):
+        try:
+            if index < 0:
+                raise IndexError(index)
+            return self.values[index]
+        except (IndexError, TypeError):
+            raise SmileError("Invalid shared value reference {0}".format(index))
+
+    def _long_text(self):
+        start = self.pos
+        end = self.data.find(END_OF_STRING, start)
+        if end == -1:
+            raise IndexError("Unterminated string")
+        text = self.data[start:end]
+        self.pos = end + 1
+        return text
+
+    def _vint(self):
+        """Read a variable length unsigned int; the last byte has 6 bits."""
+        data = self.data
+        value = 0
+        while True:
+            byte = data[self.pos]
+            self.pos += 1
+            if byte & 0x80:
+                return (value << 6) | (byte & 0x3F)
+            value = (value << 7) | byte
+
+    def _7bit_int(self, length):
+        """Read an int encoded in `length` bytes of 7 bits."""
+        value = 0
+        start = self.pos
+        end = self.pos = start + length
+        for byte in self.data[start:end]:
+            value = (value << 7) | byte
+        if end > len(self.data):
+            raise IndexError("Truncated value")
+        return value
+
+    def _7bit_binary(self, length):
+        """Read `length` bytes encoded in groups of 7 bits."""
+        result = bytearray()
+        for _ in range(length // 7):
+            result += self._7bit_int(8).to_bytes(7, "big")
+
+        left = length % 7
+        if left:
+            # the last byte holds the remaining bits, right-aligned
+            value = (self._7bit_int(left) << left) | self.data[self.pos]
+            self.pos += 1
+            result += value.to_bytes(left, "big")
+
+        return bytes(result)
+
+
+def loads(data):
+    """
+    Decode a Smile document.
+
+    :param bytes data: the Smile document
+    :return: the decoded object
+    :raise SmileError: if the document is invalid
+    """
+    return SmileDecoder(data).decode()
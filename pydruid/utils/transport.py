@@ -0,0 +1,307 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import http.client
+import threading
+import urllib.error
+import urllib.request
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# content encodings the native clients can decompress, preferred first
+ACCEPT_ENCODING = ", ".join((["zstd"] if zstandard else []) + ["gzip", "deflate"])
+
+# errors raised when a keep-alive connection was closed by the server while
+# it was idle in the pool
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionError)
+
+
+def decompressor(content_encoding):
+    """
+    Return an object decompressing a response body incrementally.
+
+    The object has the `decompress(data)` and `flush()` methods of
+    `zlib.decompressobj`; `None` is returned if the body isn't compressed.
+    """
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return None
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        # accept both gzip and zlib headers
+        return zlib.decompressobj(wbits=zlib.MAX_WBITS | 32)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise IOError("Unsupported content encoding: {0}".format(content_encoding))
+
+
+class BodyDecoder(object):
+    """
+    Decompress the chunks of a response body, counting the bytes.
+
+    :param str content_encoding: the `Content-Encoding` of the response
+    :param dict stats: transfer statistics, whose `response_bytes` and
+      `decoded_bytes` are incremented as chunks are decoded
+    """
+
+    def __init__(self, content_encoding, stats):
+        self.decompressor = decompressor(content_encoding)
+        self.stats = stats
+        stats["content_encoding"] = content_encoding or "identity"
+
+    def decode(self, chunk):
+        self.stats["response_bytes"] += len(chunk)
+        if self.decompressor is not None:
+            chunk = self.decompressor.decompress(chunk)
+        self.stats["decoded_bytes"] += len(chunk)
+        return chunk
+
+    def flush(self):
+        """Return the data left in the decompressor at the end of the body."""
+        if self.decompressor is None:
+            return b""
+        chunk = self.decompressor.flush()
+        self.stats["decoded_bytes"] += len(chunk)
+        return chunk
+
+
+def decompress(data, content_encoding):
+    """Decompress a whole response body."""
+    decompressor_ = decompressor(content_encoding)
+    if decompressor_ is None:
+        return data
+    return decompressor_.decompress(data) + decompressor_.flush()
+
+
+class PooledHTTPResponse(http.client.HTTPResponse):
+    """
+    HTTP response that returns its connection to the pool.
+
+    The connection is reused only if the body was read completely; closing
+    the response earlier leaves unread data in the socket, so the connection
+    is discarded instead.
+    """
+
+    release = None
+    reusable = True
+
+    def read1(self, n=-1):
+        data = super(PooledHTTPResponse, self).read1(n)
+        if self.length == 0 and self.fp is not None:
+            # unlike `read`, `read1` doesn't close the connection once the
+            # whole body has been received
+            self._close_conn()
+        return data
+
+    def close(self):
+        if self.fp is not None:
+            self.reusable = False
+        super(PooledHTTPResponse, self).close()
+
+    def _close_conn(self):
+        super(PooledHTTPResponse, self)._close_conn()
+        if self.release is not None:
+            release, self.release = self.release, None
+            release(self.reusable and not self.will_close)
+
+
+class TimeoutMixin(object):
+    """Use separate timeouts for establishing the connection and reading."""
+
+    response_class = PooledHTTPResponse
+
+    def __init__(self, host, connect_timeout=None, read_timeout=None, **kwargs):
+        super(TimeoutMixin, self).__init__(host, timeout=connect_timeout, **kwargs)
+        self.read_timeout = read_timeout
+
+    def connect(self):
+        super(TimeoutMixin, self).connect()
+        self.sock.settimeout(self.read_timeout)
+
+
+class PooledHTTPConnection(TimeoutMixin, http.client.HTTPConnection):
+    pass
+
+
+class PooledHTTPSConnection(TimeoutMixin, http.client.HTTPSConnection):
+    pass
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of keep-alive HTTP connections.
+
+    Up to `maxsize` idle connections are kept for each host; connections
+    opened beyond that when there are more concurrent requests are closed
+    after being used.
+
+    :param int maxsize: maximum number of idle connections kept per host
+    :param float connect_timeout: timeout in seconds to establish a connection
+    :param float read_timeout: timeout in seconds waiting for data
+    :param ssl.SSLContext context: SSL context for HTTPS connections
+    """
+
+    def __init__(
+        self, maxsize=10, connect_timeout=None, read_timeout=None, context=None
+    ):
+        self.maxsize = maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.context = context
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._stats = {}
+
+    def urlopen(self, req):
+        """Send a `urllib.request.Request`, returning the HTTP response."""
+        key = (req.type, req.host, req._tunnel_host)
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers = {name.title(): val for name, val in headers.items()}
+
+        conn = self._get(key)
+        try:
+            response = self._request(conn, req, headers)
+        except STALE_CONNECTION_ERRORS:
+            if not conn.reused:
+                raise
+            # the server closed the idle connection; retry with a new one
+            conn = self._new_connection(key)
+            response = self._request(conn, req, headers)
+
+        # this mimics `urllib.request.AbstractHTTPHandler.do_open`
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        if response.isclosed():
+            # there was no body to read
+            self._release(key, conn, not response.will_close)
+        else:
+            response.release = lambda reusable: self._release(key, conn, reusable)
+        return response
+
+    def stats(self):
+        """
+        Return statistics about the connections for each host.
+
+        This has the number of connections opened, the number of requests sent
+        and the number of idle connections.
+        """
+        with self._lock:
+            return {
+                "{0}://{1}".format(scheme, host): dict(
+                    stats, idle=len(self._idle.get((scheme, host, tunnel), []))
+                )
+                for (scheme, host, tunnel), stats in self._stats.items()
+            }
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+    def _request(self, conn, req, headers):
+        try:
+            conn.request(
+                req.get_method(),
+                req.selector,
+                req.data,
+                headers,
+                encode_chunked=req.has_header("Transfer-encoding"),
+            )
+        except OSError as err:  # timeout error
+            conn.close()
+            if conn.reused and isinstance(err, STALE_CONNECTION_ERRORS):
+                raise
+            raise urllib.error.URLError(err)
+
+        try:
+            response = conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+
+        with self._lock:
+            self._stats[conn.key]["requests"] += 1
+        return response
+
+    def _get(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                conn = idle.pop()
+                conn.reused = True
+                return conn
+        return self._new_connection(key)
+
+    def _new_connection(self, key):
+        scheme, host, tunnel_host = key
+        if scheme == "https":
+            conn = PooledHTTPSConnection(
+                host,
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.read_timeout,
+                context=self.context,
+            )
+        else:
+            conn = PooledHTTPConnection(
+                host,
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.read_timeout,
+            )
+        if tunnel_host:
+            conn.set_tunnel(tunnel_host)
+        conn.key = key
+        conn.reused = False
+
+        with self._lock:
+            stats = self._stats.setdefault(key, {"connections": 0, "requests": 0})
+            stats["connections"] += 1
+        return conn
+
+    def _release(self, key, conn, reusable):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if reusable and len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+
+class KeepAliveHandler(urllib.request.AbstractHTTPHandler):
+    """
+    urllib handler sending HTTP and HTTPS requests through a `ConnectionPool`.
+
+    The default handlers close the connection after every request; this one
+    takes precedence over them, so that openers built with it keep
+    connections alive.
+    """
+
+    handler_order = urllib.request.HTTPHandler.handler_order - 100
+
+    def __init__(self, pool):
+        super(KeepAliveHandler, self).__init__()
+        self.pool = pool
+
+    def http_open(self, req):
+        return self.pool.urlopen(req)
+
+    https_open = http_open
+
+    http_request = urllib.request.AbstractHTTPHandler.do_request_
+    https_request = urllib.request.AbstractHTTPHandler.do_request_
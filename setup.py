@@ -6,7 +6,9 @@ install_requires = ["requests"]
 
 extras_require = {
     "pandas": ["pandas"],
+    "arrow": ["pyarrow"],
     "async": ["tornado"],
+    "aio": ["aiohttp"],
     "sqlalchemy": ["sqlalchemy"],
     "cli": ["pygments", "prompt_toolkit>=2.0.0", "tabulate"],
 }
@@ -39,6 +41,8 @@ setup(
             "druid = pydruid.db.sqlalchemy:DruidHTTPDialect",
             "druid.http = pydruid.db.sqlalchemy:DruidHTTPDialect",
             "druid.https = pydruid.db.sqlalchemy:DruidHTTPSDialect",
+            "druid.async = pydruid.db.async_sqlalchemy:DruidAsyncHTTPDialect",
+            "druid.async_https = pydruid.db.async_sqlalchemy:DruidAsyncHTTPSDialect",
         ],
     },
     include_package_data=True,
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import threading
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pydruid.db.async_api import AsyncCursor, connect
+from pydruid.db.exceptions import Error, ProgrammingError
+
+ROWS = [{"name": "alice", "age": 30}, {"name": "bob", "age": 25}]
+
+BODIES = {
+    None: json.dumps(ROWS),
+    "objectLines": "".join(json.dumps(row) + "\n" for row in ROWS) + "\n",
+    "arrayLines": '["name","age"]\n["alice",30]\n["bob",25]\n\n',
+    "csv": 'name,age\n"alice\nsmith",30\nbob,25\n\n',
+}
+
+
+class SQLHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.headers, payload))
+        if payload["query"] == "SLOW":
+            # wait for the query to be cancelled
+            self.server.released.wait(5)
+        if payload["query"] == "FAIL":
+            body = json.dumps({"error": "Plan", "errorMessage": "Bad query"})
+            self._send(400, [body.encode()])
+            return
+
+        body = BODIES[payload.get("resultFormat")].encode()
+        if payload["header"] and "resultFormat" not in payload:
+            body = b'[{"name": "STRING", "age": "LONG"}, ' + body[1:]
+        # send the body in small chunks, splitting rows
+        self._send(200, [body[i : i + 7] for i in range(0, len(body), 7)])
+
+    def do_DELETE(self):
+        self.server.cancelled.append(self.path)
+        self.server.released.set()
+        self._send(202, [])
+
+    def _send(self, status, chunks):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def broker():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SQLHandler)
+    server.requests = []
+    server.cancelled = []
+    server.released = threading.Event()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run(broker, coroutine_function, **kwargs):
+    async def main():
+        conn = connect(*broker.server_address, **kwargs)
+        try:
+            return await coroutine_function(conn)
+        finally:
+            await conn.close()
+
+    return asyncio.run(main())
+
+
+Row = namedtuple("Row", ["name", "age"])
+
+
+class TestAsyncCursor:
+    @pytest.mark.parametrize("result_format", [None, "objectLines", "arrayLines"])
+    def test_fetchall(self, broker, result_format):
+        async def fetchall(conn):
+            cursor = await conn.execute("SELECT * FROM table")
+            return cursor.description, await cursor.fetchall()
+
+        description, rows = run(broker, fetchall, result_format=result_format)
+
+        assert rows == [Row("alice", 30), Row("bob", 25)]
+        assert [column[0] for column in description] == ["name", "age"]
+        assert broker.requests[0][1]["query"] == "SELECT * FROM table"
+
+    def test_csv(self, broker):
+        async def fetchall(conn):
+            cursor = await conn.execute("SELECT * FROM table")
+            return await cursor.fetchall()
+
+        rows = run(broker, fetchall, result_format="csv")
+
+        assert rows == [Row("alice\nsmith", "30"), Row("bob", "25")]
+
+    def test_header(self, broker):
+        async def fetchall(conn):
+            cursor = await conn.execute("SELECT * FROM table")
+            return cursor.description, await cursor.fetchall()
+
+        description, rows = run(broker, fetchall, header=True)
+
+        assert rows == [Row("alice", 30), Row("bob", 25)]
+        assert description == [("name", "STRING"), ("age", "LONG")]
+
+    def test_iterate_and_fetch(self, broker):
+        async def fetch(conn):
+            cursor = conn.cursor()
+            await cursor.execute("SELECT * FROM table")
+            first = await cursor.fetchone()
+            rest = [row async for row in cursor]
+
+            await cursor.execute("SELECT * FROM table")
+            many = await cursor.fetchmany(5)
+            return first, rest, many, await cursor.fetchone()
+
+        first, rest, many, last = run(broker, fetch)
+
+        assert first == Row("alice", 30)
+        assert rest == [Row("bob", 25)]
+        assert many == [Row("alice", 30), Row("bob", 25)]
+        assert last is None
+
+    def test_error(self, broker):
+        async def fail(conn):
+            await conn.execute("FAIL")
+
+        with pytest.raises(ProgrammingError) as e:
+            run(broker, fail)
+        assert str(e.value) == "Plan (Unknown): Bad query"
+
+    def test_parameters_and_context(self, broker):
+        async def execute(conn):
+            cursor = conn.cursor()
+            await cursor.execute("SELECT * FROM %(table)s", {"table": "t"})
+            return cursor.query_id
+
+        context = {"source": "test"}
+        query_id = run(broker, execute, context=context, user="u", password="p")
+
+        headers, payload = broker.requests[0]
+        assert payload == {
+            "query": "SELECT * FROM 't'",
+            "context": {"source": "test", "sqlQueryId": query_id},
+            "header": False,
+        }
+        assert context == {"source": "test"}
+        assert headers["Authorization"] == "Basic dTpw"
+
+    def test_cancel(self, broker):
+        async def cancel(conn):
+            cursor = conn.cursor()
+            await cursor.execute("SELECT * FROM table")
+            await cursor.cancel()
+            return await cursor.fetchall()
+
+        rows = run(broker, cancel, context={"sqlQueryId": "my query"})
+
+        assert rows == []
+        assert broker.cancelled == ["/druid/v2/sql/my%20query"]
+
+    def test_close_cancels_running_query(self, broker):
+        async def close(conn):
+            cursor = await conn.execute("SELECT * FROM table")
+            await cursor.fetchall()
+            await cursor.close()
+
+            cursor = await conn.execute("SELECT * FROM table")
+            await cursor.fetchone()
+            await cursor.close()
+            return cursor.query_id
+
+        query_id = run(broker, close)
+
+        assert broker.cancelled == ["/druid/v2/sql/" + query_id]
+
+    def test_task_cancelled(self, broker):
+        async def cancel_task(conn):
+            cursor = conn.cursor()
+            task = asyncio.ensure_future(cursor.execute("SLOW"))
+            while not broker.requests:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            return cursor.query_id
+
+        query_id = run(broker, cancel_task)
+
+        assert broker.cancelled == ["/druid/v2/sql/" + query_id]
+
+    def test_closed(self, broker):
+        async def closed(conn):
+            cursor = conn.cursor()
+            with pytest.raises(Error):
+                await cursor.fetchall()
+            await cursor.close()
+            with pytest.raises(Error):
+                await cursor.execute("SELECT 1")
+
+        run(broker, closed)
+
+    def test_cursor_without_connection(self, broker):
+        async def fetchall():
+            url = "http://{0}:{1}/druid/v2/sql/".format(*broker.server_address)
+            async with AsyncCursor(url) as cursor:
+                await cursor.execute("SELECT * FROM table")
+                return await cursor.fetchall()
+
+        assert asyncio.run(fetchall()) == [Row("alice", 30), Row("bob", 25)]
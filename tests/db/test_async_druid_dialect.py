@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from sqlalchemy import inspect, pool, text
+from sqlalchemy.dialects import registry
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from pydruid.db.async_sqlalchemy import DruidAsyncDialect
+
+registry.register("druid.async", "pydruid.db.async_sqlalchemy", "DruidAsyncDialect")
+
+RESULTS = {
+    "SELECT 1": [{"EXPR$0": 1}],
+    "SELECT name FROM places": [{"name": "paris"}, {"name": "rome"}],
+}
+
+
+class SQLHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        query = " ".join(payload["query"].split())
+        self.server.queries.append(query)
+        if query.startswith("SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES"):
+            rows = [{"TABLE_NAME": "places"}]
+        elif "INFORMATION_SCHEMA.COLUMNS" in query:
+            rows = [
+                {
+                    "COLUMN_NAME": "name",
+                    "JDBC_TYPE": 12,
+                    "IS_NULLABLE": "YES",
+                    "COLUMN_DEFAULT": "",
+                }
+            ]
+        else:
+            rows = RESULTS[query]
+
+        body = json.dumps(rows).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def broker():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SQLHandler)
+    server.queries = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run(broker, coroutine_function):
+    async def main():
+        engine = create_async_engine(
+            "druid+async://{0}:{1}/druid/v2/sql/".format(*broker.server_address)
+        )
+        try:
+            return engine, await coroutine_function(engine)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+class TestDruidAsyncDialect:
+    def test_dialect(self, broker):
+        async def dialect(engine):
+            return engine.dialect
+
+        engine, dialect = run(broker, dialect)
+
+        assert isinstance(dialect, DruidAsyncDialect)
+        assert dialect.is_async
+        assert isinstance(engine.pool, pool.AsyncAdaptedQueuePool)
+
+    def test_execute(self, broker):
+        async def execute(engine):
+            async with engine.connect() as conn:
+                result = await conn.execute(text("SELECT name FROM places"))
+                return result.fetchall()
+
+        _, rows = run(broker, execute)
+
+        assert [tuple(row) for row in rows] == [("paris",), ("rome",)]
+
+    def test_stream_results(self, broker):
+        async def stream(engine):
+            async with engine.connect() as conn:
+                result = await conn.stream(text("SELECT name FROM places"))
+                return [row.name async for row in result]
+
+        _, names = run(broker, stream)
+
+        assert names == ["paris", "rome"]
+
+    def test_reflection(self, broker):
+        async def reflect(engine):
+            async with engine.connect() as conn:
+                return await conn.run_sync(
+                    lambda sync_conn: (
+                        inspect(sync_conn).get_table_names(),
+                        inspect(sync_conn).get_columns("places"),
+                    )
+                )
+
+        _, (tables, columns) = run(broker, reflect)
+
+        assert tables == ["places"]
+        assert [column["name"] for column in columns] == ["name"]
+
+    def test_do_ping(self, broker):
+        async def ping_in_greenlet(engine):
+            async with engine.connect() as conn:
+                return await conn.run_sync(
+                    lambda sync_conn: sync_conn.dialect.do_ping(
+                        sync_conn.connection.dbapi_connection
+                    )
+                )
+
+        _, alive = run(broker, ping_in_greenlet)
+
+        assert alive
+        assert broker.queries[-1] == "SELECT 1"
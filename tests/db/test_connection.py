@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 
-import pytest
+import threading
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
 
 from pydruid.db.api import Connection, Cursor
 from pydruid.db.exceptions import Error
@@ -58,6 +62,114 @@ class TestConnection:
         assert cursor.ssl_client_cert == conn.ssl_client_cert
         assert cursor.proxies == conn.proxies
         assert cursor.jwt == conn.jwt
+        assert cursor.result_format == conn.result_format
+
+    # The result format is passed to the new cursors.
+    def test_result_format_passed_to_cursor(self):
+        conn = Connection(host="localhost", port=8082, result_format="arrayLines")
+        cursor = conn.cursor()
+        assert cursor.result_format == "arrayLines"
+
+    # Cursors from the same connection share the pooled session.
+    def test_cursors_share_session(self):
+        conn = Connection(host="localhost", port=8082)
+        assert conn.cursor().session is conn.session
+        assert conn.cursor().session is conn.session
+
+    # Closing the connection closes the pooled session.
+    def test_close_closes_session(self):
+        conn = Connection(host="localhost", port=8082)
+        with patch.object(conn.session, "close") as close_mock:
+            conn.close()
+        close_mock.assert_called_once()
+
+    # Cursors reuse the same keep-alive connection to the broker.
+    def test_keep_alive_connection_reused(self, broker):
+        host, port = broker.server_address
+        conn = Connection(host=host, port=port)
+        for _ in range(3):
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            assert cursor.fetchall() == [(1,)]
+
+        stats = conn.pool_stats()
+        assert stats == {
+            "http://{0}:{1}".format(host, port): {
+                "connections": 1,
+                "requests": 3,
+                "idle": 1,
+            }
+        }
+
+    # Queries are balanced between the brokers, skipping unhealthy ones.
+    def test_brokers_balanced(self, broker, other_broker):
+        hosts = [
+            "{0}:{1}".format(*server.server_address)
+            for server in (broker, other_broker)
+        ]
+        conn = Connection(host=hosts)
+        for _ in range(4):
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            assert cursor.fetchall() == [(1,)]
+        assert (broker.queries, other_broker.queries) == (2, 2)
+
+        other_broker.healthy = False
+        conn.brokers.check_health()
+        for _ in range(2):
+            conn.execute("SELECT 1").fetchall()
+        assert (broker.queries, other_broker.queries) == (4, 2)
+        assert conn.broker_stats()["http://{0}/druid/v2/sql/".format(hosts[1])] == {
+            "outstanding": 0,
+            "failures": 0,
+            "ejected": True,
+        }
+        conn.close()
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"true" if self.server.healthy else b"false"
+        self.send_response(200 if self.server.healthy else 503)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.queries += 1
+        body = b'[{"value": 1}]'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    server.healthy = True
+    server.queries = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def broker():
+    yield from serve()
+
+
+@pytest.fixture
+def other_broker():
+    yield from serve()
 
 
 if __name__ == "__main__":
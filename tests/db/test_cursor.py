@@ -1,15 +1,30 @@
 # -*- coding: utf-8 -*-
 
+import gzip
+import json
 import unittest
 from collections import namedtuple
 from io import BytesIO
 from unittest.mock import ANY, patch
 
+import pyarrow
 import requests
 from requests.models import Response
 from requests.auth import HTTPBasicAuth
 
 from pydruid.db.api import BearerAuth, apply_parameters, Cursor, connect
+from pydruid.db.exceptions import NotSupportedError
+
+
+class ChunkedRaw(BytesIO):
+    """Raw response body read in the given chunks."""
+
+    def __init__(self, chunks):
+        super(ChunkedRaw, self).__init__(b"".join(chunks))
+        self.chunks = chunks
+
+    def stream(self, chunk_size=None, decode_content=None):
+        return iter(self.chunks)
 
 
 class CursorTestSuite(unittest.TestCase):
@@ -29,6 +44,31 @@ class CursorTestSuite(unittest.TestCase):
         expected = [Row(name="alice"), Row(name="bob"), Row(name="charlie")]
         self.assertEqual(result, expected)
 
+    @patch("requests.post")
+    def test_rowcount(self, requests_post_mock):
+        response = Response()
+        response.status_code = 200
+        response.raw = BytesIO(b'[{"name": "alice"}, {"name": "bob"}]')
+        requests_post_mock.return_value = response
+
+        cursor = Cursor("http://example.com/")
+        cursor.execute("SELECT * FROM table")
+        self.assertEqual(cursor.rowcount, 2)
+        self.assertEqual(len(cursor.fetchall()), 2)
+
+    @patch("requests.post")
+    def test_stream_rowcount(self, requests_post_mock):
+        response = Response()
+        response.status_code = 200
+        response.raw = BytesIO(b'[{"name": "alice"}, {"name": "bob"}]')
+        requests_post_mock.return_value = response
+
+        cursor = Cursor("http://example.com/", stream=True)
+        cursor.execute("SELECT * FROM table")
+        # the rows are not consumed to count them
+        self.assertEqual(cursor.rowcount, -1)
+        self.assertEqual(len(cursor.fetchall()), 2)
+
     @patch("requests.post")
     def test_execute_empty_result(self, requests_post_mock):
         response = Response()
@@ -61,11 +101,93 @@ class CursorTestSuite(unittest.TestCase):
             auth=None,
             stream=True,
             headers={"Content-Type": "application/json"},
-            json={"query": query, "context": context, "header": False},
+            json={
+                "query": query,
+                "context": dict(context, sqlQueryId=cursor.query_id),
+                "header": False,
+            },
+            verify=True,
+            cert=None,
+            proxies=None,
+        )
+
+    @patch("requests.post")
+    def test_query_id(self, requests_post_mock):
+        requests_post_mock.side_effect = lambda *args, **kwargs: self._response(b"[]")
+
+        context = {"source": "unittest"}
+        cursor = Cursor("http://example.com/", context=context)
+        cursor.execute("SELECT * FROM table")
+        first_id = cursor.query_id
+        cursor.execute("SELECT * FROM table")
+
+        # each query has its own id, and the shared context isn't modified
+        self.assertIsNotNone(first_id)
+        self.assertNotEqual(cursor.query_id, first_id)
+        self.assertEqual(context, {"source": "unittest"})
+
+        cursor = Cursor("http://example.com/", context={"sqlQueryId": "q1"})
+        cursor.execute("SELECT * FROM table")
+        self.assertEqual(cursor.query_id, "q1")
+
+    @patch("requests.delete")
+    @patch("requests.post")
+    def test_cancel(self, requests_post_mock, requests_delete_mock):
+        response = Response()
+        response.status_code = 200
+        response.raw = BytesIO(b'[{"name": "alice"}, {"name": "bob"}]')
+        requests_post_mock.return_value = response
+        requests_delete_mock.return_value.status_code = 202
+
+        cursor = Cursor(
+            "http://example.com/druid/v2/sql/", context={"sqlQueryId": "my query"}
+        )
+        cursor.execute("SELECT * FROM table")
+        cursor.cancel()
+
+        requests_delete_mock.assert_called_once_with(
+            "http://example.com/druid/v2/sql/my%20query",
+            auth=None,
             verify=True,
             cert=None,
             proxies=None,
         )
+        self.assertEqual(cursor.fetchall(), [])
+
+    @patch("requests.delete")
+    @patch("requests.post")
+    def test_close_cancels_running_query(
+        self, requests_post_mock, requests_delete_mock
+    ):
+        requests_post_mock.side_effect = lambda *args, **kwargs: self._response(
+            b'[{"name": "alice"}, {"name": "bob"}]'
+        )
+        requests_delete_mock.return_value.status_code = 202
+
+        # all the rows were received
+        cursor = Cursor("http://example.com/")
+        cursor.execute("SELECT * FROM table")
+        cursor.fetchall()
+        cursor.close()
+        requests_delete_mock.assert_not_called()
+
+        cursor = Cursor("http://example.com/")
+        cursor.execute("SELECT * FROM table")
+        cursor.close()
+        requests_delete_mock.assert_called_once_with(
+            "http://example.com/" + cursor.query_id,
+            auth=None,
+            verify=True,
+            cert=None,
+            proxies=None,
+        )
+
+    @staticmethod
+    def _response(body):
+        response = Response()
+        response.status_code = 200
+        response.raw = BytesIO(body)
+        return response
 
     @patch("requests.post")
     def test_header_false(self, requests_post_mock):
@@ -121,6 +243,140 @@ class CursorTestSuite(unittest.TestCase):
         self.assertEqual(result, [Row(_0="alice")])
         self.assertEqual(cursor.description, [("_name", None)])
 
+    @patch("requests.post")
+    def test_result_format_object_lines(self, requests_post_mock):
+        response = Response()
+        response.status_code = 200
+        response.raw = BytesIO(b'{"name": "alice"}\n{"name": "bob"}\n\n')
+        requests_post_mock.return_value = response
+        Row = namedtuple("Row", ["name"])
+
+        cursor = Cursor("http://example.com/", result_format="objectLines")
+        cursor.execute("SELECT * FROM table")
+        result = cursor.fetchall()
+        self.assertEqual(result, [Row(name="alice"), Row(name="bob")])
+        self.assertEqual(
+            cursor.description, [("name", 1, None, None, None, None, True)]
+        )
+
+        requests_post_mock.assert_called_with(
+            "http://example.com/",
+            auth=None,
+            stream=True,
+            headers={"Content-Type": "application/json"},
+            json={
+                "query": "SELECT * FROM table",
+                "context": {"sqlQueryId": cursor.query_id},
+                "header": False,
+                "resultFormat": "objectLines",
+            },
+            verify=True,
+            cert=None,
+            proxies=None,
+        )
+
+    @patch("requests.post")
+    def test_result_format_array_lines(self, requests_post_mock):
+        response = Response()
+        response.status_code = 200
+        response.raw = BytesIO(b'["name","age"]\n["alice",42]\n["bob",null]\n\n')
+        requests_post_mock.return_value = response
+        Row = namedtuple("Row", ["name", "age"])
+
+        cursor = Cursor("http://example.com/", result_format="arrayLines")
+        cursor.execute("SELECT * FROM table")
+        result = cursor.fetchall()
+        self.assertEqual(result, [Row(name="alice", age=42), Row(name="bob", age=None)])
+        self.assertEqual(
+            cursor.description,
+            [
+                ("name", 1, None, None, None, None, True),
+                ("age", 2, None, None, None, None, False),
+            ],
+        )
+
+        # the header is always requested, since rows have no column names
+        self.assertEqual(requests_post_mock.call_args.kwargs["json"]["header"], True)
+
+    @patch("requests.post")
+    def test_result_format_array_lines_header(self, requests_post_mock):
+        response = Response()
+        response.status_code = 200
+        response.raw = BytesIO(b'["name"]\n\n')
+        requests_post_mock.return_value = response
+
+        cursor = Cursor("http://example.com/", header=True, result_format="arrayLines")
+        cursor.execute("SELECT * FROM table")
+        self.assertEqual(cursor.fetchall(), [])
+        self.assertEqual(cursor.description, [("name", None)])
+
+    @patch("requests.post")
+    def test_result_format_csv(self, requests_post_mock):
+        response = Response()
+        response.status_code = 200
+        response.raw = BytesIO(b'name,bio\nalice,"line 1\nline 2"\nbob,\n\n')
+        requests_post_mock.return_value = response
+        Row = namedtuple("Row", ["name", "bio"])
+
+        cursor = Cursor("http://example.com/", result_format="csv")
+        cursor.execute("SELECT * FROM table")
+        result = cursor.fetchall()
+        expected = [Row(name="alice", bio="line 1\nline 2"), Row(name="bob", bio="")]
+        self.assertEqual(result, expected)
+
+    @patch("requests.post")
+    def test_result_format_csv_value_across_chunks(self, requests_post_mock):
+        response = Response()
+        response.status_code = 200
+        # the multi-line value is split right after its newline
+        response.raw = ChunkedRaw(
+            [b'name,bio\nalice,"line 1\n', b'line 2"\nbob,', b"\n\n"]
+        )
+        requests_post_mock.return_value = response
+        Row = namedtuple("Row", ["name", "bio"])
+
+        cursor = Cursor("http://example.com/", result_format="csv")
+        cursor.execute("SELECT * FROM table")
+        result = cursor.fetchall()
+        expected = [Row(name="alice", bio="line 1\nline 2"), Row(name="bob", bio="")]
+        self.assertEqual(result, expected)
+
+    @patch("requests.post")
+    def test_fetch_arrow_table(self, requests_post_mock):
+        response = Response()
+        response.status_code = 200
+        response.raw = BytesIO(
+            b'["name","age"]\n["alice",null]\n["bob",42]\n["charlie",7]\n\n'
+        )
+        requests_post_mock.return_value = response
+
+        cursor = Cursor("http://example.com/", result_format="arrayLines")
+        cursor.execute("SELECT * FROM table")
+        table = cursor.fetch_arrow_table(batch_size=1)
+        self.assertEqual(table.schema.names, ["name", "age"])
+        self.assertEqual(table.schema.field("age").type, pyarrow.int64())
+        self.assertEqual(
+            table.to_pydict(),
+            {"name": ["alice", "bob", "charlie"], "age": [None, 42, 7]},
+        )
+
+    @patch("requests.post")
+    def test_fetch_arrow_table_empty_result(self, requests_post_mock):
+        response = Response()
+        response.status_code = 200
+        response.raw = BytesIO(b'["name"]\n\n')
+        requests_post_mock.return_value = response
+
+        cursor = Cursor("http://example.com/", header=True, result_format="arrayLines")
+        cursor.execute("SELECT * FROM table")
+        table = cursor.fetch_arrow_table()
+        self.assertEqual(table.schema.names, ["name"])
+        self.assertEqual(table.num_rows, 0)
+
+    def test_result_format_not_supported(self):
+        with self.assertRaises(NotSupportedError):
+            Cursor("http://example.com/", result_format="array")
+
     def test_apply_parameters(self):
         self.assertEqual(
             apply_parameters('SELECT 100 AS "100%"', None), 'SELECT 100 AS "100%"'
@@ -172,7 +428,11 @@ class CursorTestSuite(unittest.TestCase):
             url,
             stream=True,
             headers={"Content-Type": "application/json"},
-            json={"query": query, "context": cursor.context, "header": cursor.header,},
+            json={
+                "query": query,
+                "context": dict(cursor.context, sqlQueryId=cursor.query_id),
+                "header": cursor.header,
+            },
             auth=requests.auth.HTTPBasicAuth(user, password),
             verify=cursor.ssl_verify_cert,
             cert=cursor.ssl_client_cert,
@@ -198,7 +458,11 @@ class CursorTestSuite(unittest.TestCase):
             url,
             stream=True,
             headers={"Content-Type": "application/json"},
-            json={"query": query, "context": cursor.context, "header": cursor.header,},
+            json={
+                "query": query,
+                "context": dict(cursor.context, sqlQueryId=cursor.query_id),
+                "header": cursor.header,
+            },
             auth=ANY,
             verify=cursor.ssl_verify_cert,
             cert=cursor.ssl_client_cert,
@@ -212,7 +476,7 @@ class CursorTestSuite(unittest.TestCase):
         self.assertEqual(auth_arg.token, jwt)
 
     # Test that no authentication is used when both `user` and `jwt` are None.
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_no_authentication_used(self, requests_post_mock):
         response = Response()
         response.status_code = 200
@@ -259,7 +523,11 @@ class CursorTestSuite(unittest.TestCase):
             url,
             stream=True,
             headers={"Content-Type": "application/json"},
-            json={"query": "SELECT * FROM table", "context": {}, "header": False},
+            json={
+                "query": "SELECT * FROM table",
+                "context": {"sqlQueryId": cursor.query_id},
+                "header": False,
+            },
             auth=ANY,
             verify=True,
             cert=None,
@@ -295,7 +563,11 @@ class CursorTestSuite(unittest.TestCase):
             url,
             stream=True,
             headers={"Content-Type": "application/json"},
-            json={"query": "SELECT * FROM table", "context": {}, "header": True},
+            json={
+                "query": "SELECT * FROM table",
+                "context": {"sqlQueryId": cursor.query_id},
+                "header": True,
+            },
             auth=ANY,
             verify=False,
             cert=None,
@@ -303,7 +575,7 @@ class CursorTestSuite(unittest.TestCase):
         )
 
     # When `user` is not None and `password` is None, `HTTPBasicAuth` is used with empty password.
-    @patch("requests.post")
+    @patch("requests.Session.post")
     @patch("requests.auth.HTTPBasicAuth")
     def test_http_basic_auth_with_empty_user(
         self, http_basic_auth_mock, requests_post_mock
@@ -328,13 +600,44 @@ class CursorTestSuite(unittest.TestCase):
             ANY,
             stream=True,
             headers={"Content-Type": "application/json"},
-            json={"query": "SELECT * FROM table", "context": {}, "header": False},
+            json={
+                "query": "SELECT * FROM table",
+                "context": {"sqlQueryId": cursor.query_id},
+                "header": False,
+            },
             auth=http_basic_auth_mock.return_value,
             verify=True,
             cert=None,
             proxies=None,
         )
 
+    @patch("requests.post")
+    def test_compress_requests_over(self, requests_post_mock):
+        response = Response()
+        response.status_code = 200
+        response.raw = BytesIO(b'[{"name": "alice"}]')
+        requests_post_mock.return_value = response
+
+        cursor = Cursor("http://example.com/", compress_requests_over=10)
+        cursor.execute("SELECT * FROM table")
+
+        kwargs = requests_post_mock.call_args.kwargs
+        self.assertEqual(kwargs["headers"]["Content-Encoding"], "gzip")
+        self.assertNotIn("json", kwargs)
+        self.assertEqual(
+            json.loads(gzip.decompress(kwargs["data"])),
+            {
+                "query": "SELECT * FROM table",
+                "context": {"sqlQueryId": cursor.query_id},
+                "header": False,
+            },
+        )
+        self.assertEqual(cursor.fetchall(), [("alice",)])
+        self.assertEqual(
+            cursor.transfer_stats,
+            {"request_bytes": None, "response_bytes": 19, "content_encoding": "identity"},
+        )
+
     # Test SSL client certificate authentication when `ssl_client_cert` is not None.
     @patch("requests.post")
     def test_ssl_client_cert_authentication_with_patch_imported(
@@ -355,7 +658,11 @@ class CursorTestSuite(unittest.TestCase):
             ANY,
             stream=True,
             headers={"Content-Type": "application/json"},
-            json={"query": "SELECT * FROM table", "context": {}, "header": False},
+            json={
+                "query": "SELECT * FROM table",
+                "context": {"sqlQueryId": cursor.query_id},
+                "header": False,
+            },
             auth=ANY,
             verify=True,
             cert="path/to/cert",
@@ -2,12 +2,17 @@
 
 import unittest
 import warnings
+from io import BytesIO
 from unittest.mock import patch
 
-from sqlalchemy import exc, types
+from requests.models import Response
+from sqlalchemy import create_engine, exc, text, types
+from sqlalchemy.dialects import registry
 
 from pydruid.db.sqlalchemy import DruidDialect
 
+registry.register("druid", "pydruid.db.sqlalchemy", "DruidHTTPDialect")
+
 
 def anonymous_object(**kwargs):
     return type("Object", (), kwargs)
@@ -84,6 +89,107 @@ class DruidDialectTestSuite(unittest.TestCase):
         self.assertEqual(1, len(result))
         self.assertEqual(expected, result[0])
 
+    @patch("pydruid.db.api.Connection")
+    def test_get_multi_columns(self, connection_mock):
+        # fmt: off
+        connection_mock.execute.return_value = [
+            anonymous_object(TABLE_NAME="table1", COLUMN_NAME="__time", JDBC_TYPE=93, IS_NULLABLE="NO", COLUMN_DEFAULT=""),
+            anonymous_object(TABLE_NAME="table1", COLUMN_NAME="name", JDBC_TYPE=12, IS_NULLABLE="YES", COLUMN_DEFAULT=""),
+            anonymous_object(TABLE_NAME="table2", COLUMN_NAME="count", JDBC_TYPE=-5, IS_NULLABLE="NO", COLUMN_DEFAULT=""),
+        ]
+        # fmt: on
+
+        result = self.dialect.get_multi_columns(connection_mock, schema="druid")
+
+        self.assertEqual(connection_mock.execute.call_count, 1)
+        query = str(connection_mock.execute.call_args[0][0])
+        self.assertIn("WHERE TABLE_SCHEMA = 'druid'", query)
+        self.assertEqual(
+            {
+                key: [column["name"] for column in value]
+                for key, value in result.items()
+            },
+            {("druid", "table1"): ["__time", "name"], ("druid", "table2"): ["count"]},
+        )
+
+        result = self.dialect.get_multi_columns(
+            connection_mock, schema="druid", filter_names=["table2"]
+        )
+        self.assertEqual(list(result), [("druid", "table2")])
+
+    @patch("pydruid.db.api.Connection")
+    def test_reflection_cache(self, connection_mock):
+        # fmt: off
+        connection_mock.execute.return_value = [
+            anonymous_object(TABLE_NAME="table1", COLUMN_NAME="name", JDBC_TYPE=12, IS_NULLABLE="YES", COLUMN_DEFAULT=""),
+        ]
+        # fmt: on
+        dialect = DruidDialect(reflection_cache_ttl=60)
+
+        self.assertEqual(dialect.get_table_names(connection_mock), ["table1"])
+        self.assertTrue(dialect.has_table(connection_mock, "table1"))
+        self.assertFalse(dialect.has_table(connection_mock, "table2"))
+        columns = dialect.get_columns(connection_mock, "table1")
+        self.assertEqual([column["name"] for column in columns], ["name"])
+        # a single scan of the columns is used for all the calls
+        self.assertEqual(connection_mock.execute.call_count, 1)
+
+        # the cached columns aren't changed by the caller
+        columns[0]["type"] = None
+        columns = dialect.get_columns(connection_mock, "table1")
+        self.assertEqual(columns[0]["type"], types.String)
+
+        # other schemas are cached separately
+        dialect.get_table_names(connection_mock, schema="sys")
+        self.assertEqual(connection_mock.execute.call_count, 2)
+
+        dialect.clear_reflection_cache()
+        dialect.get_table_names(connection_mock)
+        self.assertEqual(connection_mock.execute.call_count, 3)
+
+    @patch("pydruid.db.api.Connection")
+    def test_reflection_cache_expires(self, connection_mock):
+        connection_mock.execute.return_value = []
+        dialect = DruidDialect(reflection_cache_ttl=0)
+
+        dialect.get_table_names(connection_mock)
+        dialect.get_table_names(connection_mock)
+
+        self.assertEqual(connection_mock.execute.call_count, 2)
+
+    @patch("pydruid.db.api.Connection")
+    def test_reflection_cache_engine(self, connection_mock):
+        connection_mock.execute.return_value = []
+        engine = create_engine(
+            "druid://localhost:8082/druid/v2/sql/", reflection_cache_ttl=60
+        )
+
+        self.assertEqual(engine.dialect.reflection_cache_ttl, 60)
+        engine.dialect.get_table_names(connection_mock)
+        engine.dialect.get_table_names(connection_mock)
+
+        self.assertEqual(connection_mock.execute.call_count, 1)
+
+    @patch("requests.Session.post")
+    def test_stream_results(self, post_mock):
+        response = Response()
+        response.status_code = 200
+        response.raw = BytesIO(b'[{"name": "alice"}, {"name": "bob"}]')
+        post_mock.return_value = response
+        engine = create_engine("druid://localhost:8082/druid/v2/sql/")
+
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(
+                text("SELECT name FROM table")
+            )
+            self.assertTrue(result.cursor.stream)
+            self.assertEqual(result.cursor.rowcount, -1)
+            partitions = [
+                [row.name for row in partition] for partition in result.partitions(1)
+            ]
+
+        self.assertEqual(partitions, [["alice"], ["bob"]])
+
     @patch("pydruid.db.api.Connection")
     def test_do_ping_success(self, connection_mock):
         connection_mock.execute.return_value = [1]
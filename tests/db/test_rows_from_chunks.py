@@ -36,6 +36,31 @@ class RowsFromChunksTestSuite(unittest.TestCase):
         result = list(rows_from_chunks(chunks))
         self.assertEqual(result, expected)
 
+    def test_rows_from_chunks_escaped_backslash(self):
+        chunks = [r'[{"name": "alice\\"}, {"name": "bob"}]']
+        expected = [{"name": "alice\\"}, {"name": "bob"}]
+        result = list(rows_from_chunks(chunks))
+        self.assertEqual(result, expected)
+
+    def test_rows_from_chunks_escape_across_chunks(self):
+        chunks = ['[{"name": "ali\\', '"}{ce"}, {"name": "bob\\', '\\"}]']
+        expected = [{"name": 'ali"}{ce'}, {"name": "bob\\"}]
+        result = list(rows_from_chunks(chunks))
+        self.assertEqual(result, expected)
+
+    def test_rows_from_chunks_row_spanning_many_chunks(self):
+        body = '[{"name": "alice", "tags": {"a": "}"}}, {"name": "bob"}]'
+        chunks = list(body)
+        expected = [{"name": "alice", "tags": {"a": "}"}}, {"name": "bob"}]
+        result = list(rows_from_chunks(chunks))
+        self.assertEqual(result, expected)
+
+    def test_rows_from_chunks_deeply_nested(self):
+        chunks = ['[{"a": {"b": {"c": {"d": {"e": "f"}}}}}, {"a": 1}]']
+        expected = [{"a": {"b": {"c": {"d": {"e": "f"}}}}}, {"a": 1}]
+        result = list(rows_from_chunks(chunks))
+        self.assertEqual(result, expected)
+
 
 if __name__ == "__main__":
     unittest.main()
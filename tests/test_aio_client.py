@@ -0,0 +1,261 @@
+# -*- coding: UTF-8 -*-
+
+import asyncio
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pydruid.aio_client import AioPyDruid
+from pydruid.utils.aggregators import doublesum
+
+RESULT = [
+    {"timestamp": "2015-12-30T14:14:49.000Z", "result": {"count": 1}},
+    {"timestamp": "2015-12-30T15:14:49.000Z", "result": {"count": 2}},
+]
+
+
+class BrokerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        query = json.loads(body)
+        with self.server.lock:
+            self.server.requests.append(query)
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        try:
+            if self.path == "/druid/v2/slow":
+                time.sleep(0.3)
+            if self.path == "/druid/v2/error" or query["dataSource"] == "error":
+                self._send(500, b'{"error": "Druid error"}')
+            elif self.path == "/druid/v2/gzip":
+                self._send(200, gzip.compress(json.dumps(RESULT).encode()), "gzip")
+            else:
+                self._send(200, json.dumps(RESULT).encode())
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def do_DELETE(self):
+        self.server.cancelled.append(self.path)
+        self._send(202, b"")
+
+    def _send(self, status, body, encoding=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def broker():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BrokerHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.active = server.max_active = 0
+    server.cancelled = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def create_client(server, endpoint="druid/v2/", **kwargs):
+    url = "http://{0}:{1}".format(*server.server_address)
+    return AioPyDruid(url, endpoint, **kwargs)
+
+
+def timeseries(client, datasource="testdatasource", **kwargs):
+    return client.timeseries(
+        datasource=datasource,
+        granularity="all",
+        intervals="2015-12-29/pt1h",
+        aggregations={"count": doublesum("count")},
+        **kwargs
+    )
+
+
+def run(coroutine_function, client):
+    async def main():
+        async with client:
+            return await coroutine_function()
+
+    return asyncio.run(main())
+
+
+class TestAioPyDruid:
+    def test_druid_returns_results(self, broker):
+        client = create_client(broker)
+
+        query = run(lambda: timeseries(client), client)
+
+        assert query.result == RESULT
+        assert broker.requests[0]["queryType"] == "timeseries"
+        assert query.transfer_stats["content_encoding"] == "identity"
+
+    def test_event_loops(self, broker):
+        client = create_client(broker)
+
+        # the session is closed at the end of each loop, and created again
+        first = run(lambda: timeseries(client), client)
+        second = run(lambda: timeseries(client), client)
+        assert first.result == second.result == RESULT
+
+        # an open session can't be used in another loop
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(timeseries(client))
+            with pytest.raises(RuntimeError):
+                asyncio.run(timeseries(client))
+            loop.run_until_complete(client.close())
+        finally:
+            loop.close()
+
+    def test_druid_returns_error(self, broker):
+        client = create_client(broker, "druid/v2/error")
+
+        with pytest.raises(IOError) as e:
+            run(lambda: timeseries(client), client)
+        assert "HTTP Error 500" in str(e.value)
+        assert "Druid Error: Druid error" in str(e.value)
+
+    def test_compressed_request_and_response(self, broker):
+        client = create_client(broker, "druid/v2/gzip", compress_requests_over=10)
+
+        query = run(lambda: timeseries(client), client)
+
+        assert query.result == RESULT
+        assert query.transfer_stats["content_encoding"] == "gzip"
+        assert query.transfer_stats["decoded_bytes"] == len(json.dumps(RESULT))
+
+    def test_search(self, broker):
+        client = create_client(broker)
+
+        query = run(
+            lambda: client.search(
+                datasource="testdatasource",
+                granularity="all",
+                intervals="2015-12-29/pt1h",
+                query={"type": "insensitive_contains", "value": "druid"},
+            ),
+            client,
+        )
+
+        assert query.result == RESULT
+        assert broker.requests[0]["queryType"] == "search"
+
+    def test_stream(self, broker):
+        client = create_client(broker, "druid/v2/gzip")
+
+        async def stream():
+            query = client.query_builder.scan(
+                {"datasource": "testdatasource", "intervals": "2015-12-29/pt1h"}
+            )
+            return [row async for row in client.stream(query, chunk_size=8)]
+
+        assert run(stream, client) == RESULT
+
+    def test_max_concurrency(self, broker):
+        client = create_client(broker, "druid/v2/slow", max_concurrency=2)
+
+        async def queries():
+            return await asyncio.gather(*[timeseries(client) for _ in range(5)])
+
+        queries = run(queries, client)
+
+        assert len(queries) == 5
+        assert len(broker.requests) == 5
+        assert broker.max_active == 2
+
+    def test_coalesce(self, broker):
+        client = create_client(broker, "druid/v2/slow", coalesce=True)
+
+        async def queries():
+            return await asyncio.gather(*[timeseries(client) for _ in range(3)])
+
+        queries = run(queries, client)
+
+        assert len(broker.requests) == 1
+        assert len(set(map(id, queries))) == 3
+        for query in queries:
+            assert query.result is queries[0].result
+        assert client._inflight == {}
+
+    def test_shards(self, broker):
+        client = create_client(broker)
+
+        query = run(lambda: timeseries(client, shards=2), client)
+
+        assert len(broker.requests) == 2
+        assert query.result[0]["result"]["count"] == 6
+        assert json.loads(query.result_json) == query.result
+
+    def test_shards_share_query_id(self, broker):
+        client = create_client(broker)
+
+        query = run(lambda: timeseries(client, shards=2), client)
+
+        assert query.query_id is not None
+        assert [request["context"]["queryId"] for request in broker.requests] == [
+            query.query_id,
+            query.query_id,
+        ]
+
+    def test_task_cancelled(self, broker):
+        client = create_client(broker, "druid/v2/slow")
+
+        async def cancel_task():
+            task = asyncio.ensure_future(timeseries(client))
+            while not broker.requests:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        run(cancel_task, client)
+
+        query_id = broker.requests[0]["context"]["queryId"]
+        assert broker.cancelled == ["/druid/v2/slow/" + query_id]
+
+    def test_execute_many(self, broker):
+        client = create_client(broker)
+        queries = [
+            {"query_type": "timeseries", "datasource": "testdatasource"},
+            {"query_type": "timeseries", "datasource": "error"},
+            {"query_type": "unknown"},
+        ]
+        for query in queries[:2]:
+            query.update(
+                granularity="all",
+                intervals="2015-12-29/pt1h",
+                aggregations={"count": doublesum("count")},
+            )
+
+        results = run(lambda: client.execute_many(queries, max_concurrency=2), client)
+
+        assert results[0].result == RESULT
+        assert isinstance(results[1], IOError)
+        assert isinstance(results[2], ValueError)
+
+        async def as_completed():
+            return [
+                result
+                async for result in client.execute_many(queries, as_completed=True)
+            ]
+
+        results = run(as_completed, client)
+        assert sorted(index for index, _ in results) == [0, 1, 2]
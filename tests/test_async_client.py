@@ -15,12 +15,14 @@
 # limitations under the License.
 #
 
+import gzip
 from unittest.mock import Mock
 
 import pytest
 import tornado
 import tornado.ioloop
 import tornado.web
+from tornado import gen
 from tornado.httpclient import HTTPError
 from tornado.testing import AsyncHTTPTestCase
 
@@ -49,12 +51,43 @@ class SuccessHandler(tornado.web.RequestHandler):
         )
 
 
+class GzipHandler(tornado.web.RequestHandler):
+    def post(self):
+        self.set_header("Content-Encoding", "gzip")
+        body = self.request.body
+        if self.request.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        # echo the query back as the result
+        self.write(gzip.compress(b"[" + body + b"]"))
+
+
+class SlowHandler(tornado.web.RequestHandler):
+    requests = 0
+
+    @gen.coroutine
+    def post(self):
+        SlowHandler.requests += 1
+        yield gen.sleep(0.1)
+        self.write('[{"timestamp": "2015", "result": {"count": 1}}]')
+
+
+class CancelHandler(tornado.web.RequestHandler):
+    cancelled = []
+
+    def delete(self, query_id):
+        CancelHandler.cancelled.append(query_id)
+        self.set_status(202)
+
+
 class TestAsyncPyDruid(AsyncHTTPTestCase):
     def get_app(self):
         return tornado.web.Application(
             [
                 (r"/druid/v2/fail_request", FailureHandler),
                 (r"/druid/v2/return_results", SuccessHandler),
+                (r"/druid/v2/gzip", GzipHandler),
+                (r"/druid/v2/slow", SlowHandler),
+                (r"/druid/v2/slow/(.*)", CancelHandler),
             ]
         )
 
@@ -176,3 +209,93 @@ class TestAsyncPyDruid(AsyncHTTPTestCase):
         self.assertIsNotNone(top)
         self.assertEqual(len(top.result), 1)
         self.assertEqual(len(top.result[0]["result"]), 1)
+
+    @tornado.testing.gen_test
+    def test_compressed_request_and_response(self):
+        # given
+        client = AsyncPyDruid(
+            "http://localhost:%s" % (self.get_http_port(),),
+            "druid/v2/gzip",
+            compress_requests_over=10,
+        )
+
+        # when
+        ts = yield client.timeseries(
+            datasource="testdatasource",
+            granularity="all",
+            intervals="2015-12-29/pt1h",
+            aggregations={"count": doublesum("count")},
+        )
+
+        # then
+        self.assertEqual(ts.result, [ts.query_dict])
+        stats = ts.transfer_stats
+        self.assertEqual(stats["content_encoding"], "gzip")
+        self.assertLess(stats["response_bytes"], stats["decoded_bytes"])
+
+    @tornado.testing.gen_test
+    def test_coalesce(self):
+        # given
+        client = AsyncPyDruid(
+            "http://localhost:%s" % (self.get_http_port(),),
+            "druid/v2/slow",
+            coalesce=True,
+        )
+        SlowHandler.requests = 0
+
+        def timeseries():
+            return client.timeseries(
+                datasource="testdatasource",
+                granularity="all",
+                intervals="2015-12-29/pt1h",
+                aggregations={"count": doublesum("count")},
+            )
+
+        # when
+        queries = yield [timeseries() for _ in range(3)]
+
+        # then
+        self.assertEqual(SlowHandler.requests, 1)
+        self.assertEqual(len(set(map(id, queries))), 3)
+        for query in queries:
+            self.assertIs(query.result, queries[0].result)
+
+        yield timeseries()
+        self.assertEqual(SlowHandler.requests, 2)
+
+    @tornado.testing.gen_test
+    def test_cancel(self):
+        # given
+        client = AsyncPyDruid(
+            "http://localhost:%s" % (self.get_http_port(),), "druid/v2/slow"
+        )
+        CancelHandler.cancelled = []
+
+        # when
+        yield client.cancel("my query")
+
+        # then
+        self.assertEqual(CancelHandler.cancelled, ["my query"])
+
+    @tornado.testing.gen_test
+    def test_execute_many(self):
+        # given
+        client = AsyncPyDruid(
+            "http://localhost:%s" % (self.get_http_port(),), "druid/v2/return_results"
+        )
+        failing = AsyncPyDruid(
+            "http://localhost:%s" % (self.get_http_port(),), "druid/v2/fail_request"
+        )
+        queries = [
+            {"query_type": "time_boundary", "datasource": "first"},
+            {"query_type": "time_boundary", "datasource": "invalid", "bad": 1},
+        ]
+
+        # when
+        results = yield client.execute_many(queries, max_concurrency=1)
+        errors = yield failing.execute_many(queries[:1])
+
+        # then
+        self.assertEqual(len(results[0].result), 1)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertIsInstance(errors[0], IOError)
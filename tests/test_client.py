@@ -1,7 +1,11 @@
 # -*- coding: UTF-8 -*-
+import json
 import textwrap
+import threading
+import time
 import urllib
-from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
 from unittest.mock import Mock, patch
 
 import pytest
@@ -9,7 +13,10 @@ import pytest
 from pydruid.client import PyDruid
 from pydruid.query import Query
 from pydruid.utils.aggregators import doublesum
+from pydruid.utils.balancer import MIN_LATENCIES
+from pydruid.utils.cache import MemoryCache
 from pydruid.utils.filters import Dimension
+from pydruid.utils.having import Aggregation
 
 
 def create_client(http_headers=None):
@@ -20,6 +27,12 @@ def create_blank_query():
     return Query({}, "none")
 
 
+class Response(BytesIO):
+    def __init__(self, body, headers=None):
+        super(Response, self).__init__(body)
+        self.headers = headers or {}
+
+
 def _http_error(code, msg, data=""):
     # Need a file-like object for the response data
     fp = StringIO(data)
@@ -29,7 +42,7 @@ def _http_error(code, msg, data=""):
 
 
 class TestPyDruid:
-    @patch("pydruid.client.urllib.request.urlopen")
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
     def test_druid_returns_error(self, mock_urlopen):
         # given
         mock_urlopen.side_effect = _http_error(500, "Druid error")
@@ -49,7 +62,7 @@ class TestPyDruid:
                 context={"timeout": 1000},
             )
 
-    @patch("pydruid.client.urllib.request.urlopen")
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
     def test_druid_returns_html_error(self, mock_urlopen):
         # given
         message = textwrap.dedent(
@@ -82,7 +95,7 @@ class TestPyDruid:
                 metric="count",
                 filter=Dimension("user_lang") == "en",
                 threshold=1,
-                context={"timeout": 1000},
+                context={"timeout": 1000, "queryId": "topn-1"},
             )
 
         assert (
@@ -100,6 +113,7 @@ class TestPyDruid:
                     }
                 ],
                 "context": {
+                    "queryId": "topn-1",
                     "timeout": 1000
                 },
                 "dataSource": "testdatasource",
@@ -119,10 +133,11 @@ class TestPyDruid:
             ).strip()
         )
 
-    @patch("pydruid.client.urllib.request.urlopen")
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
     def test_druid_returns_results(self, mock_urlopen):
         # given
         response = Mock()
+        response.headers = {}
         response.read.return_value = """
             [ {
   "timestamp" : "2015-12-30T14:14:49.000Z",
@@ -155,10 +170,11 @@ class TestPyDruid:
         assert len(top.result) == 1
         assert len(top.result[0]["result"]) == 1
 
-    @patch("pydruid.client.urllib.request.urlopen")
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
     def test_client_allows_to_export_last_query(self, mock_urlopen):
         # given
         response = Mock()
+        response.headers = {}
         response.read.return_value = """
             [ {
   "timestamp" : "2015-12-30T14:14:49.000Z",
@@ -202,10 +218,11 @@ class TestPyDruid:
         headers, _, _ = client._prepare_url_headers_and_body(query)
         assert headers["custom-header"] == "test"
 
-    @patch("pydruid.client.urllib.request.urlopen")
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
     @patch("pydruid.client.ssl.create_default_context")
     def test_client_with_cafile(self, mock_create_default_context, mock_urlopen):
         response = Mock()
+        response.headers = {}
         response.read.return_value = """
             [ {
                 "timestamp" : "2015-12-30T14:14:49.000Z",
@@ -228,3 +245,555 @@ class TestPyDruid:
 
         client.topn()
         assert mock_urlopen.called_with(context=client.context)
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_scan_iter(self, mock_urlopen):
+        # given
+        blocks = [
+            {
+                "segmentId": "segment_{0}".format(i),
+                "columns": ["__time", "user_name"],
+                "events": [{"__time": i, "user_name": "usér_{0}".format(i)}],
+            }
+            for i in range(3)
+        ]
+        response = Response(json.dumps(blocks, ensure_ascii=False).encode("utf-8"))
+        mock_urlopen.return_value = response
+        client = create_client()
+
+        # when
+        results = client.scan_iter(
+            datasource="testdatasource",
+            granularity="all",
+            intervals="2015-12-29/pt1h",
+            batchSize=1,
+        )
+
+        # then
+        assert next(results) == blocks[0]
+        assert not response.closed
+        assert list(results) == blocks[1:]
+        assert response.closed
+        assert client.query_builder.last_query.query_dict["batchSize"] == 1
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_stream_multibyte_characters_across_chunks(self, mock_urlopen):
+        # given
+        rows = [{"value": "ü" * 10}, {"value": "€" * 10}]
+        mock_urlopen.return_value = Response(
+            json.dumps(rows, ensure_ascii=False).encode("utf-8")
+        )
+        client = create_client()
+
+        # when
+        results = client.stream(create_blank_query(), chunk_size=3)
+
+        # then
+        assert list(results) == rows
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_scan_iter_druid_returns_error(self, mock_urlopen):
+        # given
+        mock_urlopen.side_effect = _http_error(500, "Druid error")
+        client = create_client()
+
+        # when / then
+        with pytest.raises(IOError):
+            list(
+                client.scan_iter(
+                    datasource="testdatasource",
+                    granularity="all",
+                    intervals="2015-12-29/pt1h",
+                )
+            )
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_smile_response_format(self, mock_urlopen):
+        # given
+        response = Mock()
+        response.headers = {}
+        # [{"timestamp": "2015", "result": {"count": 1}}]
+        response.read.return_value = (
+            b":)\n\x01\xf8\xfa\x88timestamp\x432015\x85result\xfa\x84count\xc2\xfb"
+            b"\xfb\xf9"
+        )
+        mock_urlopen.return_value = response
+        client = PyDruid("http://localhost:8083", "druid/v2/", response_format="smile")
+
+        # when
+        ts = client.timeseries(
+            datasource="testdatasource",
+            granularity="all",
+            intervals="2015-12-29/pt1h",
+            aggregations={"count": doublesum("count")},
+        )
+
+        # then
+        (req,) = mock_urlopen.call_args.args
+        assert req.get_header("Accept") == "application/x-jackson-smile"
+        assert ts.result == [{"timestamp": "2015", "result": {"count": 1}}]
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_timeseries_shards(self, mock_urlopen):
+        # given
+        def respond(req):
+            (interval,) = json.loads(req.data)["intervals"]
+            start = interval.split("/")[0]
+            result = [{"timestamp": start, "result": {"count": 1}}]
+            return Response(json.dumps(result).encode("utf-8"))
+
+        mock_urlopen.side_effect = respond
+        client = create_client()
+
+        # when
+        ts = client.timeseries(
+            datasource="testdatasource",
+            granularity="day",
+            intervals="2015-12-29/P4D",
+            aggregations={"count": doublesum("count")},
+            shards=4,
+        )
+
+        # then
+        assert mock_urlopen.call_count == 4
+        assert [item["timestamp"] for item in ts.result] == [
+            "2015-12-29T00:00:00.000Z",
+            "2015-12-30T00:00:00.000Z",
+            "2015-12-31T00:00:00.000Z",
+            "2016-01-01T00:00:00.000Z",
+        ]
+        assert ts.query_dict["intervals"] == "2015-12-29/P4D"
+        assert ts.transfer_stats["decoded_bytes"] == sum(
+            len(json.dumps([item])) for item in ts.result
+        )
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_shards_passthrough(self, mock_urlopen):
+        # given
+        def respond(req):
+            (interval,) = json.loads(req.data)["intervals"]
+            start = interval.split("/")[0]
+            result = [{"timestamp": start, "result": {"count": 1}}]
+            return Response(json.dumps(result).encode("utf-8"))
+
+        mock_urlopen.side_effect = respond
+        client = PyDruid(
+            "http://localhost:8083", "druid/v2/", result_parsing="passthrough"
+        )
+
+        # when
+        ts = client.timeseries(
+            datasource="testdatasource",
+            granularity="day",
+            intervals="2015-12-29/P2D",
+            aggregations={"count": doublesum("count")},
+            shards=2,
+        )
+
+        # then
+        assert isinstance(ts.result_json, bytes)
+        assert json.loads(ts.result_json) == [
+            {"timestamp": "2015-12-29T00:00:00.000Z", "result": {"count": 1}},
+            {"timestamp": "2015-12-30T00:00:00.000Z", "result": {"count": 1}},
+        ]
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_groupby_shards_not_mergeable(self, mock_urlopen):
+        client = create_client()
+
+        with pytest.raises(ValueError):
+            client.groupby(
+                datasource="testdatasource",
+                granularity="all",
+                intervals="2015-12-29/P4D",
+                dimensions=["user_name"],
+                aggregations={"count": doublesum("count")},
+                having=Aggregation("count") > 1,
+                shards=4,
+            )
+        mock_urlopen.assert_not_called()
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_response_closed_when_read_fails(self, mock_urlopen):
+        # given
+        response = Response(b"[]", {"Content-Encoding": "compress"})
+        mock_urlopen.return_value = response
+        client = create_client()
+
+        # when
+        with pytest.raises(IOError):
+            client.timeseries(
+                datasource="testdatasource",
+                granularity="day",
+                intervals="2015-12-29/P1D",
+                aggregations={"count": doublesum("count")},
+            )
+
+        # then
+        assert response.closed
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_cache(self, mock_urlopen):
+        # given
+        result = [{"timestamp": "2015-12-29T00:00:00.000Z", "result": {"count": 1}}]
+        mock_urlopen.side_effect = lambda req: Response(json.dumps(result).encode())
+        client = PyDruid("http://localhost:8083", "druid/v2/", cache=MemoryCache())
+
+        # when
+        results = [
+            client.timeseries(
+                datasource="testdatasource",
+                granularity="day",
+                intervals="2015-12-29/P1D",
+                aggregations={"count": doublesum("count")},
+            ).result
+            for _ in range(2)
+        ]
+
+        # then
+        assert results == [result, result]
+        assert mock_urlopen.call_count == 1
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_cache_passthrough(self, mock_urlopen):
+        # given
+        result = [{"timestamp": "2015-12-29T00:00:00.000Z", "result": {"count": 1}}]
+        mock_urlopen.side_effect = lambda req: Response(json.dumps(result).encode())
+        client = PyDruid(
+            "http://localhost:8083",
+            "druid/v2/",
+            cache=MemoryCache(),
+            result_parsing="passthrough",
+        )
+
+        # when
+        results = [
+            client.timeseries(
+                datasource="testdatasource",
+                granularity="day",
+                intervals="2015-12-29/P1D",
+                aggregations={"count": doublesum("count")},
+            ).result_json
+            for _ in range(2)
+        ]
+
+        # then
+        assert all(isinstance(data, bytes) for data in results)
+        assert [json.loads(data) for data in results] == [result, result]
+        assert mock_urlopen.call_count == 1
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_coalesce(self, mock_urlopen):
+        # given
+        started = threading.Event()
+
+        def respond(req):
+            started.set()
+            time.sleep(0.2)
+            return Response(b'[{"timestamp": "2015", "result": {"count": 1}}]')
+
+        mock_urlopen.side_effect = respond
+        client = PyDruid("http://localhost:8083", "druid/v2/", coalesce=True)
+
+        def timeseries(_):
+            return client.timeseries(
+                datasource="testdatasource",
+                granularity="all",
+                intervals="2015-12-29/pt1h",
+                aggregations={"count": doublesum("count")},
+            )
+
+        # when
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            first = executor.submit(timeseries, None)
+            started.wait()
+            others = [executor.submit(timeseries, i) for i in range(3)]
+            queries = [future.result() for future in [first] + others]
+
+        # then
+        assert mock_urlopen.call_count == 1
+        assert len(set(map(id, queries))) == 4
+        assert all(query.result is queries[0].result for query in queries)
+        assert queries[0].result == [{"timestamp": "2015", "result": {"count": 1}}]
+
+        # the next query is sent again
+        timeseries(None)
+        assert mock_urlopen.call_count == 2
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_coalesce_error(self, mock_urlopen):
+        mock_urlopen.side_effect = _http_error(500, "Druid error")
+        client = PyDruid("http://localhost:8083", "druid/v2/", coalesce=True)
+
+        with pytest.raises(IOError):
+            client.timeseries(
+                datasource="testdatasource",
+                granularity="all",
+                intervals="2015-12-29/pt1h",
+            )
+        assert client._inflight == {}
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_execute_many(self, mock_urlopen):
+        # given
+        def respond(req):
+            query = json.loads(req.data)
+            if query["dataSource"] == "broken":
+                raise _http_error(500, "Druid error")
+            result = [{"timestamp": "2015", "result": query["dataSource"]}]
+            return Response(json.dumps(result).encode("utf-8"))
+
+        mock_urlopen.side_effect = respond
+        client = create_client()
+        queries = [
+            {"query_type": "time_boundary", "datasource": "first"},
+            {"query_type": "time_boundary", "datasource": "broken"},
+            {"query_type": "time_boundary", "datasource": "invalid", "bad": 1},
+            {"query_type": "drop_table", "datasource": "invalid"},
+            client.query_builder.search(
+                {
+                    "datasource": "last",
+                    "granularity": "all",
+                    "intervals": "2015-12-29/pt1h",
+                    "query": {"type": "contains", "value": "a"},
+                }
+            ),
+        ]
+
+        # when
+        results = client.execute_many(queries, max_concurrency=2)
+
+        # then
+        assert mock_urlopen.call_count == 3
+        assert results[0].result == [{"timestamp": "2015", "result": "first"}]
+        assert isinstance(results[1], IOError)
+        assert isinstance(results[2], ValueError)
+        assert isinstance(results[3], ValueError)
+        assert results[4] is queries[4]
+        assert results[4].result == [{"timestamp": "2015", "result": "last"}]
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_execute_many_as_completed(self, mock_urlopen):
+        # given
+        def respond(req):
+            query = json.loads(req.data)
+            time.sleep(0.05 * (3 - int(query["dataSource"])))
+            return Response(b"[]")
+
+        mock_urlopen.side_effect = respond
+        client = create_client()
+        queries = [
+            {"query_type": "time_boundary", "datasource": str(i)} for i in range(3)
+        ]
+
+        # when
+        results = list(client.execute_many(queries, as_completed=True))
+
+        # then
+        assert [index for index, _ in results] == [2, 1, 0]
+        assert all(query.result == [] for _, query in results)
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_query_id(self, mock_urlopen):
+        # given
+        def respond(req):
+            query_ids.append(json.loads(req.data)["context"]["queryId"])
+            return Response(b"[]")
+
+        query_ids = []
+        mock_urlopen.side_effect = respond
+        client = create_client()
+        context = {"timeout": 1000}
+
+        # when
+        ts = client.timeseries(
+            datasource="testdatasource",
+            granularity="day",
+            intervals="2015-12-29/P2D",
+            aggregations={"count": doublesum("count")},
+            context=context,
+            shards=2,
+        )
+
+        # then the shards are cancelled together
+        assert ts.query_id is not None
+        assert query_ids == [ts.query_id, ts.query_id]
+        assert context == {"timeout": 1000}
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_cancel(self, mock_urlopen):
+        # given
+        mock_urlopen.return_value = Response(b"")
+        client = PyDruid(
+            "http://localhost:8083", "druid/v2/", http_headers={"X-Test": "1"}
+        )
+
+        # when
+        client.cancel("my query")
+
+        # then
+        (req,) = mock_urlopen.call_args.args
+        assert req.get_method() == "DELETE"
+        assert req.full_url == "http://localhost:8083/druid/v2/my%20query"
+        assert req.get_header("X-test") == "1"
+
+        # the query may have completed already
+        mock_urlopen.side_effect = _http_error(404, "Not Found")
+        client.cancel("my query")
+        mock_urlopen.side_effect = _http_error(403, "Forbidden")
+        with pytest.raises(IOError):
+            client.cancel("my query")
+        with pytest.raises(ValueError):
+            client.cancel(create_blank_query())
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_stream_closed_cancels_query(self, mock_urlopen):
+        # given
+        rows = [{"value": 1}, {"value": 2}]
+        mock_urlopen.side_effect = lambda req: Response(json.dumps(rows).encode())
+        client = create_client()
+        query = create_blank_query()
+
+        # when
+        results = client.stream(query)
+        assert next(results) == rows[0]
+        results.close()
+
+        # then
+        req = mock_urlopen.call_args.args[0]
+        assert req.get_method() == "DELETE"
+        assert req.full_url.endswith("/druid/v2/" + query.query_id)
+
+        # a query streamed to the end isn't cancelled
+        assert list(client.stream(create_blank_query())) == rows
+        assert mock_urlopen.call_args.args[0].get_method() == "POST"
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_timeout_cancels_query(self, mock_urlopen):
+        # given
+        def respond(req):
+            if req.get_method() == "POST":
+                raise urllib.error.URLError(TimeoutError("timed out"))
+            return Response(b"")
+
+        mock_urlopen.side_effect = respond
+        client = create_client()
+
+        # when
+        with pytest.raises(urllib.error.URLError):
+            client.time_boundary(datasource="testdatasource")
+
+        # then
+        query = client.query_builder.last_query
+        req = mock_urlopen.call_args.args[0]
+        assert req.get_method() == "DELETE"
+        assert req.full_url.endswith("/druid/v2/" + query.query_id)
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_brokers_balanced(self, mock_urlopen):
+        # given
+        def respond(req):
+            hosts.append(req.host)
+            if req.host == "down:8082":
+                raise urllib.error.URLError(ConnectionRefusedError())
+            return Response(b"[]")
+
+        hosts = []
+        mock_urlopen.side_effect = respond
+        client = PyDruid(
+            ["http://up:8082", "http://down:8082", "http://other:8082"], "druid/v2/"
+        )
+
+        # when
+        for _ in range(12):
+            try:
+                client.time_boundary(datasource="testdatasource")
+            except urllib.error.URLError:
+                pass
+
+        # then the broker that's down is ejected after 3 failures
+        assert hosts.count("down:8082") == 3
+        assert hosts.count("up:8082") + hosts.count("other:8082") == 9
+        stats = client.broker_stats()
+        assert stats["http://down:8082"]["ejected"]
+        assert not stats["http://up:8082"]["ejected"]
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_cancel_brokers(self, mock_urlopen):
+        # given
+        mock_urlopen.side_effect = lambda req: Response(b"")
+        client = PyDruid(["http://a:8082", "http://b:8082"], "druid/v2/")
+
+        # when
+        client.cancel("q1")
+        client.cancel("q2", "http://b:8082")
+
+        # then
+        urls = [call.args[0].full_url for call in mock_urlopen.call_args_list]
+        assert urls == [
+            "http://a:8082/druid/v2/q1",
+            "http://b:8082/druid/v2/q1",
+            "http://b:8082/druid/v2/q2",
+        ]
+
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_hedged_request(self, mock_urlopen):
+        # given
+        def respond(req):
+            if req.get_method() == "DELETE":
+                cancelled.append(req.full_url)
+                return Response(b"")
+            if req.host == "slow:8082":
+                time.sleep(0.5)
+                return Response(b'[{"result": "slow"}]')
+            return Response(b'[{"result": "fast"}]')
+
+        cancelled = []
+        mock_urlopen.side_effect = respond
+        client = PyDruid(
+            ["http://slow:8082", "http://fast:8082"], "druid/v2/", hedge=True
+        )
+        for _ in range(MIN_LATENCIES):
+            broker = client.brokers.acquire()
+            client.brokers.release(broker, 0.01)
+
+        # when
+        queries = [client.time_boundary(datasource="testdatasource") for _ in range(2)]
+
+        # then the first query is sent to the fast broker too, and cancelled on
+        # the slow one; the second goes to the fast one, which is idle
+        assert [query.result for query in queries] == [[{"result": "fast"}]] * 2
+        assert cancelled == ["http://slow:8082/druid/v2/" + queries[0].query_id]
+
+    @pytest.mark.parametrize(
+        "result_parsing, result_json",
+        [
+            ("eager", '[{"timestamp": "2015"}]'),
+            ("lazy", '[{"timestamp": "2015"}]'),
+            ("passthrough", b'[{"timestamp": "2015"}]'),
+        ],
+    )
+    @patch("pydruid.client.urllib.request.OpenerDirector.open")
+    def test_result_parsing(self, mock_urlopen, result_parsing, result_json):
+        # given
+        mock_urlopen.return_value = Response(b'[{"timestamp": "2015"}]')
+        client = PyDruid(
+            "http://localhost:8083", "druid/v2/", result_parsing=result_parsing
+        )
+
+        # when
+        query = client.time_boundary(datasource="testdatasource")
+
+        # then
+        if result_parsing != "eager":
+            # the body is held as received until it's needed
+            assert query._loads is not None
+            assert query._result_json == b'[{"timestamp": "2015"}]'
+        assert query.result == [{"timestamp": "2015"}]
+        assert query.result_json == result_json
+
+    def test_unsupported_response_format(self):
+        with pytest.raises(ValueError):
+            PyDruid("http://localhost:8083", "druid/v2/", response_format="xml")
+        with pytest.raises(ValueError):
+            PyDruid("http://localhost:8083", "druid/v2/", result_parsing="never")
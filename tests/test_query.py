@@ -19,11 +19,14 @@ import csv
 import os
 
 import pandas
+import pyarrow
+import pyarrow.parquet
 import pytest
 from pandas.testing import assert_frame_equal
 
 from pydruid.query import Query, QueryBuilder
 from pydruid.utils import aggregators, filters, having, postaggregator
+from pydruid.utils.json_codec import JSONCodec
 
 
 def create_query_with_results():
@@ -297,6 +300,78 @@ class TestQueryBuilder:
         assert nested_subquery_dict == expected_nested_query_dict
 
 class TestQuery:
+    def test_fingerprint(self):
+        first = QueryBuilder().timeseries(
+            {
+                "datasource": "things",
+                "granularity": "day",
+                "intervals": "2013-01-01/P1D",
+                "aggregations": {
+                    "count": aggregators.count("rows"),
+                    "sum": aggregators.doublesum("value"),
+                },
+                "filter": (filters.Dimension("a") == 1)
+                & ((filters.Dimension("b") == 2) & (filters.Dimension("c") == 3)),
+                "context": {"timeout": 1000},
+            }
+        )
+        second = QueryBuilder().timeseries(
+            {
+                "context": {},
+                "filter": (filters.Dimension("c") == 3)
+                & (filters.Dimension("b") == 2)
+                & (filters.Dimension("a") == 1),
+                "aggregations": {
+                    "sum": aggregators.doublesum("value"),
+                    "count": aggregators.count("rows"),
+                },
+                "intervals": ["2013-01-01T00:00:00.000Z/2013-01-02T00:00:00.000Z"],
+                "granularity": "DAY",
+                "datasource": "things",
+            }
+        )
+        assert first.fingerprint == second.fingerprint
+
+        second.query_dict["granularity"] = "hour"
+        assert first.fingerprint != second.fingerprint
+
+    def test_parse(self):
+        data = b'[{"timestamp": "2015", "result": {"count": 1}}]'
+        expected = [{"timestamp": "2015", "result": {"count": 1}}]
+
+        query = Query({}, "timeseries")
+        query.parse(data, "json")
+        assert query.result == expected
+
+        with pytest.raises(IOError):
+            query.parse(b"", "json")
+
+    def test_parse_lazy(self):
+        calls = []
+        codec = JSONCodec("json", None, lambda data: calls.append(data) or [1, 2])
+
+        query = Query({}, "timeseries")
+        query.parse(b"[1, 2]", codec, lazy=True)
+
+        # the bytes are only parsed when the result is needed, once
+        assert calls == []
+        assert len(query) == 2
+        assert query[1] == 2
+        assert calls == [b"[1, 2]"]
+        # and only decoded when `result_json` is needed
+        assert query.result_json == "[1, 2]"
+
+        other = Query({}, "timeseries")
+        query.parse(b"[1, 2]", codec, lazy=True, decode=False)
+        other.copy_result(query)
+        assert other.result_json == b"[1, 2]"
+        assert len(calls) == 1
+
+        # assigning a result replaces the data not parsed yet
+        query.result = [3]
+        assert list(query) == [3]
+        assert len(calls) == 1
+
     def test_export_tsv(self, tmpdir):
         query = create_query_with_results()
         file_path = tmpdir.join("out.tsv")
@@ -307,6 +382,81 @@ class TestQuery:
             actual = [line for line in reader]
             assert actual == expected_results_csv_reader()
 
+    def test_export_tsv_heterogeneous_rows(self, tmpdir):
+        query = QueryBuilder().groupby(
+            {
+                "datasource": "things",
+                "dimensions": ["user"],
+                "aggregations": {
+                    "count": aggregators.count("count"),
+                    "filtered": aggregators.filtered(
+                        filters.Dimension("one") == 1, aggregators.count("count")
+                    ),
+                },
+            }
+        )
+        query.result = [
+            {"version": "v1", "timestamp": "t1", "event": {"user": "a", "count": 1}},
+            {"version": "v1", "timestamp": "t2", "event": {"count": 2, "filtered": 1}},
+        ]
+        file_path = tmpdir.join("out.tsv")
+        query.export_tsv(str(file_path), batch_size=1)
+
+        with open(str(file_path)) as tsv_file:
+            lines = tsv_file.read().splitlines()
+        assert lines == [
+            "user\tcount\tfiltered\ttimestamp\tversion",
+            "a\t1\t\tt1\tv1",
+            "\t2\t1\tt2\tv1",
+        ]
+
+    def test_export_tsv_streamed_scan(self, tmpdir):
+        query = Query({"columns": ["__time", "user"]}, "scan")
+        blocks = (
+            {
+                "segmentId": "segment_{0}".format(i),
+                "columns": ["__time", "user"],
+                "events": [[i, "user_{0}".format(i)], [i, "㬓"]],
+            }
+            for i in range(3)
+        )
+        file_path = tmpdir.join("out.tsv")
+        query.export_tsv(str(file_path), result=blocks, batch_size=4)
+
+        with open(str(file_path)) as tsv_file:
+            reader = csv.reader(tsv_file, delimiter="\t")
+            assert list(reader) == [
+                ["__time", "user"],
+                ["0", "user_0"],
+                ["0", "㬓"],
+                ["1", "user_1"],
+                ["1", "㬓"],
+                ["2", "user_2"],
+                ["2", "㬓"],
+            ]
+        assert query.result is None
+
+    def test_export_tsv_select(self, tmpdir):
+        query = Query({"dimensions": ["user"], "metrics": ["count"]}, "select")
+        query.result = [
+            {
+                "timestamp": "t1",
+                "result": {
+                    "pagingIdentifiers": {},
+                    "events": [
+                        {"offset": 0, "event": {"timestamp": "t1", "user": "a"}},
+                        {"offset": 1, "event": {"timestamp": "t1", "count": 2}},
+                    ],
+                },
+            }
+        ]
+        file_path = tmpdir.join("out.tsv")
+        query.export_tsv(str(file_path))
+
+        with open(str(file_path)) as tsv_file:
+            lines = tsv_file.read().splitlines()
+        assert lines == ["timestamp\tuser\tcount", "t1\ta\t", "t1\t\t2"]
+
     def test_export_pandas(self):
         query = create_query_with_results()
         df = query.export_pandas()
@@ -317,6 +467,128 @@ class TestQuery:
         df = query.export_pandas()
         assert_frame_equal(df, pandas.DataFrame())
 
+    def test_export_pandas_parse_timestamps(self):
+        query = create_query_with_results()
+        df = query.export_pandas(parse_timestamps=True)
+        expected_df = pandas.DataFrame(EXPECTED_RESULTS_PANDAS)
+        expected_df["timestamp"] = pandas.to_datetime(
+            expected_df["timestamp"], utc=True
+        )
+        assert_frame_equal(df, expected_df, check_like=True)
+        assert str(df["timestamp"][0]) == "2015-01-01 05:00:00+00:00"
+
+    def test_export_pandas_topn(self):
+        query = Query({}, "topN")
+        query.result = [
+            {
+                "timestamp": "2015-01-01T00:00:00.000Z",
+                "result": [{"user": "a", "count": 3}, {"user": "b", "count": 2}],
+            },
+            {"timestamp": "2015-01-02T00:00:00.000Z", "result": []},
+            {
+                "timestamp": "2015-01-03T00:00:00.000Z",
+                "result": [{"user": "c", "count": 1}],
+            },
+        ]
+        df = query.export_pandas()
+        expected_df = pandas.DataFrame(
+            {
+                "user": ["a", "b", "c"],
+                "count": [3, 2, 1],
+                "timestamp": [
+                    "2015-01-01T00:00:00.000Z",
+                    "2015-01-01T00:00:00.000Z",
+                    "2015-01-03T00:00:00.000Z",
+                ],
+            }
+        )
+        assert_frame_equal(df, expected_df)
+
+    def test_export_pandas_groupby_missing_values(self):
+        query = Query({}, "groupBy")
+        query.result = [
+            {
+                "version": "v1",
+                "timestamp": "2015-01-01T00:00:00.000Z",
+                "event": {"user": "a", "count": 3},
+            },
+            {
+                "version": "v1",
+                "timestamp": "2015-01-01T00:00:00.000Z",
+                "event": {"count": 2},
+            },
+            {
+                "version": "v1",
+                "timestamp": "2015-01-02T00:00:00.000Z",
+                "event": {"user": "c", "count": 1, "country": "fr"},
+            },
+        ]
+        df = query.export_pandas()
+        expected_df = pandas.DataFrame(
+            [
+                {"user": "a", "count": 3, "timestamp": "2015-01-01T00:00:00.000Z"},
+                {"count": 2, "timestamp": "2015-01-01T00:00:00.000Z"},
+                {
+                    "user": "c",
+                    "count": 1,
+                    "country": "fr",
+                    "timestamp": "2015-01-02T00:00:00.000Z",
+                },
+            ]
+        )
+        assert_frame_equal(df, expected_df, check_like=True)
+
+    def test_export_pandas_scan_compacted_list(self):
+        query = Query({"resultFormat": "compactedList"}, "scan")
+        query.result = [
+            {
+                "segmentId": "segment_1",
+                "columns": ["__time", "value1", "value2"],
+                "events": [[1420088400000, 1, "㬓"], [1420174800000, 2, "㬓"]],
+            }
+        ]
+        df = query.export_pandas()
+        expected_df = pandas.DataFrame(
+            {
+                "__time": [1420088400000, 1420174800000],
+                "value1": [1, 2],
+                "value2": ["㬓", "㬓"],
+            }
+        )
+        assert_frame_equal(df, expected_df)
+
+    def test_export_arrow(self):
+        query = create_query_with_results()
+        table = query.export_arrow()
+        assert table.to_pydict() == {
+            "value1": [1, 2],
+            "value2": ["㬓", "㬓"],
+            "timestamp": [
+                "2015-01-01T00:00:00.000-05:00",
+                "2015-01-02T00:00:00.000-05:00",
+            ],
+        }
+
+        assert Query({}, "timeseries").export_arrow().num_rows == 0
+
+    def test_export_arrow_scan_blocks(self):
+        query = Query({"resultFormat": "compactedList"}, "scan")
+        query.result = [
+            {"segmentId": "s1", "columns": ["a", "b"], "events": [[1, None]]},
+            {"segmentId": "s2", "columns": ["b", "c"], "events": [["x", 2.5]]},
+        ]
+        table = query.export_arrow()
+        assert table.schema == pyarrow.schema(
+            [("a", pyarrow.int64()), ("b", pyarrow.string()), ("c", pyarrow.float64())]
+        )
+        assert table.to_pydict() == {"a": [1, None], "b": [None, "x"], "c": [None, 2.5]}
+
+    def test_export_parquet(self, tmpdir):
+        query = create_query_with_results()
+        file_path = str(tmpdir.join("out.parquet"))
+        query.export_parquet(file_path, compression="zstd")
+        assert pyarrow.parquet.read_table(file_path).equals(query.export_arrow())
+
     def test_query_acts_as_a_wrapper_for_raw_result(self):
         # given
         query = create_query_with_results()
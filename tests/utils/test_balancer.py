@@ -0,0 +1,123 @@
+# -*- coding: UTF-8 -*-
+import time
+
+import pytest
+
+from pydruid.utils.balancer import BrokerPool, MIN_LATENCIES
+
+
+class TestBrokerPool:
+    def test_requires_brokers(self):
+        with pytest.raises(ValueError):
+            BrokerPool([])
+
+    def test_least_outstanding(self):
+        pool = BrokerPool(["a", "b", "c"])
+
+        first = pool.acquire()
+        second = pool.acquire()
+        third = pool.acquire()
+        assert {first.url, second.url, third.url} == {"a", "b", "c"}
+
+        # the next request goes to the broker whose request completed
+        pool.release(second, 0.1)
+        assert pool.acquire() is second
+        assert pool.stats()[second.url]["outstanding"] == 1
+
+    def test_idle_brokers_are_rotated(self):
+        pool = BrokerPool(["a", "b"])
+
+        urls = []
+        for _ in range(4):
+            broker = pool.acquire()
+            urls.append(broker.url)
+            pool.release(broker, 0.1)
+
+        assert urls == ["a", "b", "a", "b"]
+
+    def test_exclude(self):
+        pool = BrokerPool(["a", "b"])
+
+        first = pool.acquire()
+        assert pool.acquire(exclude=first).url != first.url
+
+        single = BrokerPool(["a"])
+        assert single.acquire(exclude=single.brokers[0]) is None
+
+    def test_failing_broker_is_ejected(self):
+        pool = BrokerPool(["a", "b"], max_failures=2, eject_for=60)
+        a, b = pool.brokers
+
+        for _ in range(2):
+            pool.release(pool.acquire(exclude=b), failed=True)
+
+        assert pool.stats()["a"] == {"outstanding": 0, "failures": 2, "ejected": True}
+        assert [pool.acquire().url for _ in range(3)] == ["b", "b", "b"]
+
+    def test_ejected_brokers_used_when_all_are(self):
+        pool = BrokerPool(["a"], max_failures=1, eject_for=60)
+
+        pool.release(pool.acquire(), failed=True)
+
+        assert pool.stats()["a"]["ejected"]
+        assert pool.acquire().url == "a"
+
+    def test_ejection_expires(self):
+        pool = BrokerPool(["a", "b"], max_failures=1, eject_for=0.05)
+
+        pool.release(pool.acquire(), failed=True)
+        time.sleep(0.1)
+
+        assert not any(stats["ejected"] for stats in pool.stats().values())
+
+    def test_success_resets_failures(self):
+        pool = BrokerPool(["a"], max_failures=2)
+        broker = pool.brokers[0]
+
+        pool.release(pool.acquire(), failed=True)
+        pool.release(pool.acquire(), 0.1)
+        pool.release(pool.acquire(), failed=True)
+
+        assert broker.failures == 1
+        assert not pool.stats()["a"]["ejected"]
+
+    def test_hedge_delay(self):
+        pool = BrokerPool(["a"])
+        assert pool.hedge_delay() is None
+
+        for i in range(MIN_LATENCIES * 5):
+            pool.release(pool.acquire(), i / 100.0)
+
+        assert pool.hedge_delay() == 0.95
+        assert pool.hedge_delay(0.5) == 0.5
+
+    def test_check_health(self):
+        healthy = {"a": True, "b": True}
+
+        def check(url):
+            if url == "c":
+                raise IOError("Connection refused")
+            return healthy[url]
+
+        pool = BrokerPool(["a", "b", "c"], health_check=check)
+        healthy["a"] = False
+        pool.check_health()
+        assert [pool.acquire().url for _ in range(2)] == ["b", "b"]
+
+        healthy["a"] = True
+        pool.check_health()
+        assert pool.acquire().url == "a"
+
+    def test_background_health_checks(self):
+        checked = []
+        pool = BrokerPool(
+            ["a"], health_check=checked.append, health_check_interval=0.01
+        )
+
+        time.sleep(0.1)
+        pool.close()
+        count = len(checked)
+        time.sleep(0.05)
+
+        assert count > 1
+        assert len(checked) <= count + 1
@@ -0,0 +1,234 @@
+# -*- coding: UTF-8 -*-
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from pydruid.query import QueryBuilder
+from pydruid.utils.aggregators import count
+from pydruid.utils.cache import (
+    cache_key,
+    cacheable,
+    DiskCache,
+    execute_cached,
+    MemoryCache,
+)
+from pydruid.utils.intervals import format_datetime, parse_intervals
+
+
+@pytest.fixture(params=["memory", "disk"])
+def cache(request, tmpdir):
+    if request.param == "memory":
+        yield MemoryCache(maxsize=3)
+    else:
+        cache = DiskCache(str(tmpdir.join("cache.db")), maxsize=3)
+        yield cache
+        cache.close()
+
+
+def timeseries(**kwargs):
+    args = {
+        "datasource": "things",
+        "granularity": "day",
+        "intervals": "2015-01-01/2015-01-04",
+        "aggregations": {"count": count("rows")},
+    }
+    args.update(kwargs)
+    return QueryBuilder().timeseries(args)
+
+
+class Broker(object):
+    """Answer queries with one row per day, recording the intervals queried."""
+
+    def __init__(self):
+        self.intervals = []
+
+    def __call__(self, query):
+        self.intervals.append(query.query_dict["intervals"])
+        result = []
+        for start, end in parse_intervals(query.query_dict["intervals"]):
+            day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+            while day < end:
+                result.append(
+                    {"timestamp": format_datetime(day), "result": {"count": 1}}
+                )
+                day += timedelta(days=1)
+        query.result = result
+        return query
+
+
+class TestBackends:
+    def test_get_set(self, cache):
+        assert cache.get("a") is None
+        cache.set("a", [{"count": 1}])
+        assert cache.get("a") == [{"count": 1}]
+        assert len(cache) == 1
+
+    def test_lru_eviction(self, cache):
+        for key in "abc":
+            cache.set(key, [key])
+            time.sleep(0.01)
+        cache.get("a")
+        time.sleep(0.01)
+        cache.set("d", ["d"])
+
+        assert cache.get("b") is None
+        assert [cache.get(key) for key in "acd"] == [["a"], ["c"], ["d"]]
+
+    def test_ttl(self, cache):
+        cache.ttl = 0.05
+        cache.set("a", [1])
+        assert cache.get("a") == [1]
+        time.sleep(0.06)
+        assert cache.get("a") is None
+
+    def test_clear(self, cache):
+        cache.set("a", [1])
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_disk_cache_persists(self, tmpdir):
+        path = str(tmpdir.join("cache.db"))
+        DiskCache(path).set("a", [{"count": 1}])
+        assert DiskCache(path).get("a") == [{"count": 1}]
+
+
+class TestCacheKey:
+    def test_intervals_are_ignored(self):
+        assert cache_key(timeseries()) == cache_key(
+            timeseries(intervals="2015-02-01/P1D")
+        )
+
+    def test_query_changes_key(self):
+        assert cache_key(timeseries()) != cache_key(timeseries(granularity="hour"))
+
+    def test_context(self):
+        query = timeseries(context={"timeout": 10, "queryId": "a"})
+        assert cache_key(query) == cache_key(timeseries(context={}))
+        assert cache_key(query) != cache_key(timeseries(context={"useCache": False}))
+
+    @pytest.mark.parametrize(
+        "query, expected",
+        [
+            (timeseries(), True),
+            (timeseries(granularity="all"), False),
+            (timeseries(granularity={"type": "period", "period": "P1D"}), False),
+            (
+                QueryBuilder().groupby(
+                    {"datasource": "things", "limit_spec": {"limit": 1}}
+                ),
+                False,
+            ),
+            (QueryBuilder().time_boundary({"datasource": "things"}), False),
+        ],
+    )
+    def test_cacheable(self, query, expected):
+        assert cacheable(query) == expected
+
+
+class TestExecuteCached:
+    def test_only_missing_buckets_are_fetched(self):
+        cache = MemoryCache()
+        broker = Broker()
+
+        first = execute_cached(cache, timeseries(), broker)
+        second = execute_cached(
+            cache, timeseries(intervals="2015-01-02/2015-01-06"), broker
+        )
+
+        assert len(first.result) == 3
+        assert [item["timestamp"] for item in second.result] == [
+            "2015-01-02T00:00:00.000Z",
+            "2015-01-03T00:00:00.000Z",
+            "2015-01-04T00:00:00.000Z",
+            "2015-01-05T00:00:00.000Z",
+        ]
+        assert broker.intervals == [
+            ["2015-01-01T00:00:00.000Z/2015-01-04T00:00:00.000Z"],
+            ["2015-01-04T00:00:00.000Z/2015-01-06T00:00:00.000Z"],
+        ]
+
+        execute_cached(cache, timeseries(), broker)
+        assert len(broker.intervals) == 2
+
+    def test_result_json(self):
+        cache = MemoryCache()
+        broker = Broker()
+
+        execute_cached(cache, timeseries(), broker)
+        query = execute_cached(cache, timeseries(), broker, json_codec="json")
+        raw = execute_cached(cache, timeseries(), broker, decode=False)
+
+        assert json.loads(query.result_json) == query.result
+        assert isinstance(query.result_json, str)
+        assert isinstance(raw.result_json, bytes)
+        assert json.loads(raw.result_json) == raw.result
+
+    def test_partial_buckets_are_not_cached(self):
+        cache = MemoryCache()
+        broker = Broker()
+
+        for _ in range(2):
+            query = execute_cached(
+                cache, timeseries(intervals="2015-01-01T12:00/2015-01-03"), broker
+            )
+
+        assert len(query.result) == 2
+        assert broker.intervals[1] == [
+            "2015-01-01T12:00:00.000Z/2015-01-02T00:00:00.000Z"
+        ]
+
+    def test_recent_buckets_are_fetched_again(self):
+        cache = MemoryCache(mutable_window=1)
+        broker = Broker()
+        today = datetime.now(timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        intervals = "{0}/P5D".format(format_datetime(today - timedelta(days=4)))
+
+        for _ in range(2):
+            query = execute_cached(cache, timeseries(intervals=intervals), broker)
+
+        assert len(query.result) == 5
+        assert broker.intervals[1] == [
+            "{0}/{1}".format(
+                format_datetime(today), format_datetime(today + timedelta(days=1))
+            )
+        ]
+
+    def test_descending(self):
+        cache = MemoryCache()
+        broker = Broker()
+        execute_cached(cache, timeseries(intervals="2015-01-02/P1D"), broker)
+
+        query = execute_cached(cache, timeseries(descending=True), broker)
+
+        assert [item["timestamp"][:10] for item in query.result] == [
+            "2015-01-03",
+            "2015-01-02",
+            "2015-01-01",
+        ]
+
+    def test_empty_buckets_are_cached(self):
+        cache = MemoryCache()
+        calls = []
+
+        def broker(query):
+            calls.append(query)
+            query.result = []
+            return query
+
+        for _ in range(2):
+            assert execute_cached(cache, timeseries(), broker).result == []
+        assert len(calls) == 1
+
+    def test_not_cacheable(self):
+        cache = MemoryCache()
+        broker = Broker()
+
+        for _ in range(2):
+            execute_cached(cache, timeseries(granularity="all"), broker)
+
+        assert len(broker.intervals) == 2
+        assert len(cache) == 0
@@ -0,0 +1,108 @@
+# -*- coding: UTF-8 -*-
+from datetime import datetime, timezone
+
+import pytest
+
+from pydruid.utils import intervals
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class TestParseInterval:
+    def test_datetimes(self):
+        assert intervals.parse_interval(
+            "2013-06-14T00:00:00.000Z/2013-06-15T12:30:00+02:00"
+        ) == (utc(2013, 6, 14), utc(2013, 6, 15, 10, 30))
+
+    def test_period_end(self):
+        assert intervals.parse_interval("2013-06-14/pt1h") == (
+            utc(2013, 6, 14),
+            utc(2013, 6, 14, 1),
+        )
+        assert intervals.parse_interval("2013-01-31/P1M") == (
+            utc(2013, 1, 31),
+            utc(2013, 2, 28),
+        )
+
+    def test_period_start(self):
+        assert intervals.parse_interval("P1W2DT1.5S/2013-06-15") == (
+            utc(2013, 6, 5, 23, 59, 58, 500000),
+            utc(2013, 6, 15),
+        )
+
+    @pytest.mark.parametrize("interval", ["2013-06-14", "2013-06-14/P", "x/y"])
+    def test_invalid(self, interval):
+        with pytest.raises(ValueError):
+            intervals.parse_interval(interval)
+
+    def test_format(self):
+        assert (
+            intervals.format_interval(utc(2013, 6, 14), utc(2013, 6, 14, 1, 0, 0, 5000))
+            == "2013-06-14T00:00:00.000Z/2013-06-14T01:00:00.005Z"
+        )
+
+
+class TestGranularity:
+    @pytest.mark.parametrize(
+        "granularity, expected",
+        [
+            ("DAY", "day"),
+            ({"type": "hour"}, "hour"),
+            ("all", "all"),
+            ({"type": "period", "period": "P1D", "timeZone": "Europe/Paris"}, None),
+            ("P1D", None),
+        ],
+    )
+    def test_simple_granularity(self, granularity, expected):
+        assert intervals.simple_granularity(granularity) == expected
+
+    @pytest.mark.parametrize(
+        "granularity, expected",
+        [
+            ("none", utc(2013, 6, 14, 13, 47, 12, 345000)),
+            ("fifteen_minute", utc(2013, 6, 14, 13, 45)),
+            ("six_hour", utc(2013, 6, 14, 12)),
+            ("day", utc(2013, 6, 14)),
+            ("week", utc(2013, 6, 10)),
+            ("month", utc(2013, 6, 1)),
+            ("quarter", utc(2013, 4, 1)),
+            ("year", utc(2013, 1, 1)),
+        ],
+    )
+    def test_floor(self, granularity, expected):
+        dt = utc(2013, 6, 14, 13, 47, 12, 345678)
+        assert intervals.floor(dt, granularity) == expected
+
+
+class TestSplitIntervals:
+    def test_aligned_to_granularity(self):
+        groups = intervals.split_intervals(
+            [(utc(2013, 1, 1, 12), utc(2013, 1, 5))], "day", 3
+        )
+        assert groups == [
+            [(utc(2013, 1, 1, 12), utc(2013, 1, 2))],
+            [(utc(2013, 1, 2), utc(2013, 1, 3))],
+            [(utc(2013, 1, 3), utc(2013, 1, 5))],
+        ]
+
+    def test_fewer_buckets_than_shards(self):
+        groups = intervals.split_intervals(
+            [(utc(2013, 1, 1), utc(2013, 1, 2, 12))], "day", 8
+        )
+        assert groups == [
+            [(utc(2013, 1, 1), utc(2013, 1, 2))],
+            [(utc(2013, 1, 2), utc(2013, 1, 2, 12))],
+        ]
+
+    def test_multiple_intervals(self):
+        groups = intervals.split_intervals(
+            [(utc(2013, 1, 3), utc(2013, 1, 4)), (utc(2013, 1, 1), utc(2013, 1, 2))],
+            "hour",
+            2,
+        )
+        assert groups == [
+            [(utc(2013, 1, 1), utc(2013, 1, 2))],
+            [(utc(2013, 1, 3), utc(2013, 1, 4))],
+        ]
@@ -0,0 +1,48 @@
+# -*- coding: UTF-8 -*-
+
+import pytest
+
+from pydruid.async_client import AsyncPyDruid
+from pydruid.client import PyDruid
+from pydruid.db.api import connect
+from pydruid.utils import json_codec
+from pydruid.utils.json_codec import get_codec, JSONCodec
+
+
+class TestJSONCodec:
+    def test_default_codec(self):
+        orjson = pytest.importorskip("orjson")
+        codec = get_codec()
+        assert codec.name == "orjson"
+        assert codec.loads is orjson.loads
+
+    @pytest.mark.parametrize("name", list(json_codec.BACKENDS))
+    def test_backends(self, name):
+        try:
+            codec = get_codec(name)
+        except ImportError:
+            pytest.skip("{0} is not installed".format(name))
+
+        obj = {"dimension": "user/name", "value": "㬓", "count": [1, 2.5, None]}
+        data = codec.dumps(obj)
+        assert isinstance(data, bytes)
+        assert codec.loads(data) == obj
+        assert codec.loads(data.decode("utf-8")) == obj
+
+    def test_unknown_codec(self):
+        with pytest.raises(ValueError):
+            get_codec("yaml")
+
+    def test_custom_codec(self):
+        codec = JSONCodec("custom", lambda obj: b"{}", lambda data: {})
+        assert get_codec(codec) is codec
+
+    def test_client_override(self):
+        client = PyDruid("http://localhost:8083", "druid/v2/", json_codec="json")
+        assert client.json_codec.name == "json"
+
+        client = AsyncPyDruid("http://localhost:8083", "druid/v2/", json_codec="json")
+        assert client.json_codec.name == "json"
+
+        conn = connect(json_codec="json")
+        assert conn.cursor().json_codec.name == "json"
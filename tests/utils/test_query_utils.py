@@ -3,6 +3,7 @@
 import os
 
 from pydruid.utils import query_utils
+from pydruid.utils.filters import Dimension, Filter
 
 
 def open_file(file_path):
@@ -32,3 +33,123 @@ class TestUnicodeWriter:
             file_path.read()
             == "header1\theader2" + line_ending() + "value1\t㬓" + line_ending()
         )
+
+
+class TestScanColumns:
+    def test_compacted_list(self):
+        blocks = [
+            {
+                "segmentId": "segment_1",
+                "columns": ["__time", "user_name", "count"],
+                "events": [[1, "user_1", 3], [2, "user_2", 5]],
+            },
+            {
+                "segmentId": "segment_2",
+                "columns": ["__time", "user_name", "count"],
+                "events": [[3, "㬓", 7]],
+            },
+        ]
+        assert query_utils.scan_columns(blocks) == {
+            "__time": [1, 2, 3],
+            "user_name": ["user_1", "user_2", "㬓"],
+            "count": [3, 5, 7],
+        }
+
+    def test_list(self):
+        blocks = [
+            {
+                "segmentId": "segment_1",
+                "columns": ["__time", "user_name"],
+                "events": [{"__time": 1, "user_name": "user_1"}, {"__time": 2}],
+            }
+        ]
+        assert query_utils.scan_columns(blocks) == {
+            "__time": [1, 2],
+            "user_name": ["user_1", None],
+        }
+
+    def test_columns_differ_between_blocks(self):
+        blocks = [
+            {"segmentId": "segment_1", "columns": ["a"], "events": [[1], [2]]},
+            {"segmentId": "segment_2", "columns": [], "events": []},
+            {"segmentId": "segment_3", "columns": ["b", "a"], "events": [[3, 4]]},
+        ]
+        columns = query_utils.scan_columns(blocks)
+        assert list(columns) == ["a", "b"]
+        assert columns == {"a": [1, 2, 4], "b": [None, None, 3]}
+
+
+class TestNormalizeQuery:
+    def test_logical_filters_are_flattened_and_sorted(self):
+        a, b, c = (Dimension(name) == "x" for name in "abc")
+        first = {"filter": Filter.build_filter((a & b) & c)}
+        second = {"filter": Filter.build_filter(c & (b & a))}
+
+        normalized = query_utils.normalize_query(first)
+
+        assert normalized == query_utils.normalize_query(second)
+        assert [f["dimension"] for f in normalized["filter"]["fields"]] == [
+            "a",
+            "b",
+            "c",
+        ]
+
+    def test_mixed_logical_filters_are_not_flattened(self):
+        a, b, c = (Dimension(name) == "x" for name in "abc")
+        first = {"filter": Filter.build_filter((a | b) & c)}
+        second = {"filter": Filter.build_filter(a | (b & c))}
+
+        assert query_utils.normalize_query(first) != query_utils.normalize_query(second)
+
+    def test_having_specs(self):
+        first = {"having": {"type": "and", "havingSpecs": [{"a": 1}, {"b": 2}]}}
+        second = {"having": {"type": "and", "havingSpecs": [{"b": 2}, {"a": 1}]}}
+        assert query_utils.normalize_query(first) == query_utils.normalize_query(second)
+
+    def test_in_filter_values(self):
+        query = {"filter": {"type": "in", "dimension": "a", "values": ["y", "x", "y"]}}
+        assert query_utils.normalize_query(query)["filter"]["values"] == ["x", "y"]
+
+    def test_intervals_and_granularity(self):
+        query = {
+            "intervals": "2013-01-01/P1D",
+            "granularity": {"type": "DAY"},
+            "dataSource": {"type": "table", "name": "things"},
+        }
+        assert query_utils.normalize_query(query) == {
+            "intervals": ["2013-01-01T00:00:00.000Z/2013-01-02T00:00:00.000Z"],
+            "granularity": "day",
+            "dataSource": "things",
+        }
+        assert "intervals" not in query_utils.normalize_query(query, intervals=False)
+
+    def test_context(self):
+        query = {"context": {"queryId": "abc", "timeout": 1000}}
+        assert query_utils.normalize_query(query) == {}
+
+        query = {"context": {"queryId": "abc", "useCache": False}}
+        assert query_utils.normalize_query(query) == {"context": {"useCache": False}}
+
+    def test_query_is_not_modified(self):
+        query = {"filter": {"type": "and", "fields": [{"b": 1}, {"a": 1}]}}
+        query_utils.normalize_query(query)
+        assert query["filter"]["fields"] == [{"b": 1}, {"a": 1}]
+
+
+class TestFingerprint:
+    def test_fingerprint(self):
+        first = {"queryType": "timeseries", "intervals": "2013-01-01/P1D"}
+        second = {
+            "intervals": ["2013-01-01T00:00:00Z/2013-01-02T00:00:00Z"],
+            "queryType": "timeseries",
+        }
+        assert query_utils.fingerprint(first) == query_utils.fingerprint(second)
+        assert len(query_utils.fingerprint(first)) == 64
+
+    def test_intervals(self):
+        first = {"queryType": "timeseries", "intervals": "2013-01-01/P1D"}
+        second = {"queryType": "timeseries", "intervals": "2013-01-02/P1D"}
+        assert query_utils.fingerprint(first) != query_utils.fingerprint(second)
+        assert query_utils.fingerprint(
+            first, intervals=False
+        ) == query_utils.fingerprint(second, intervals=False)
@@ -0,0 +1,182 @@
+# -*- coding: UTF-8 -*-
+import json
+
+import pytest
+
+from pydruid.query import QueryBuilder
+from pydruid.utils import sharding
+from pydruid.utils.aggregators import count, doublesum, filtered, hyperunique, longmax
+from pydruid.utils.filters import Dimension
+from pydruid.utils.postaggregator import Const, Field
+
+
+def build(query_type="timeseries", **kwargs):
+    args = {
+        "datasource": "things",
+        "granularity": "day",
+        "intervals": "2013-01-01/2013-01-05",
+        "aggregations": {"count": count("rows")},
+    }
+    args.update(kwargs)
+    builder = QueryBuilder()
+    if query_type == "timeseries":
+        return builder.timeseries(args)
+    return builder.groupby(args)
+
+
+def with_result(query, result):
+    query.result = result
+    return query
+
+
+class TestSplitQuery:
+    def test_split(self):
+        query = build(context={"timeout": 1000})
+
+        shards = sharding.split_query(query, 2)
+
+        assert [shard.query_dict["intervals"] for shard in shards] == [
+            ["2013-01-01T00:00:00.000Z/2013-01-03T00:00:00.000Z"],
+            ["2013-01-03T00:00:00.000Z/2013-01-05T00:00:00.000Z"],
+        ]
+        for shard in shards:
+            assert shard.query_type == "timeseries"
+            assert shard.query_dict["context"] == {"timeout": 1000}
+        # the original query is left untouched
+        assert query.query_dict["intervals"] == "2013-01-01/2013-01-05"
+
+    def test_any_aggregation_with_granularity(self):
+        query = build(
+            "groupBy",
+            dimensions=["kind"],
+            aggregations={"users": hyperunique("users")},
+            post_aggregations={"twice": Field("users") * Const(2)},
+        )
+        assert len(sharding.split_query(query, 4)) == 4
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            {"aggregations": {"users": hyperunique("users")}},
+            {"post_aggregations": {"twice": Field("count") * Const(2)}},
+        ],
+    )
+    def test_not_mergeable_with_all_granularity(self, kwargs):
+        query = build(granularity="all", **kwargs)
+        with pytest.raises(ValueError):
+            sharding.split_query(query, 2)
+
+    @pytest.mark.parametrize(
+        "query_type, kwargs",
+        [
+            ("timeseries", {"granularity": {"type": "period", "period": "P1D"}}),
+            ("timeseries", {"context": {"grandTotal": True}}),
+            ("groupBy", {"limit_spec": {"type": "default", "limit": 10}}),
+            ("groupBy", {"subtotalsSpec": [["kind"], []]}),
+        ],
+    )
+    def test_not_supported(self, query_type, kwargs):
+        with pytest.raises(ValueError):
+            sharding.split_query(build(query_type, **kwargs), 2)
+
+    def test_not_supported_query_type(self):
+        query = QueryBuilder().time_boundary({"datasource": "things"})
+        with pytest.raises(ValueError):
+            sharding.split_query(query, 2)
+
+
+class TestMergeResults:
+    def test_concatenate_buckets(self):
+        query = build(descending=True)
+        shards = [
+            with_result(shard, [{"timestamp": str(i), "result": {"count": i}}])
+            for i, shard in enumerate(sharding.split_query(query, 2))
+        ]
+
+        sharding.merge_results(query, shards)
+
+        assert query.result == [
+            {"timestamp": "1", "result": {"count": 1}},
+            {"timestamp": "0", "result": {"count": 0}},
+        ]
+        assert json.loads(query.result_json) == query.result
+
+    def test_merge_timeseries_all_granularity(self):
+        query = build(
+            granularity="all",
+            aggregations={
+                "count": count("rows"),
+                "sum": doublesum("value"),
+                "max": longmax("value"),
+                "en": filtered(Dimension("lang") == "en", count("rows")),
+            },
+        )
+        shards = sharding.split_query(query, 3)
+        results = [
+            [
+                {
+                    "timestamp": "2013-01-02",
+                    "result": {"count": 2, "sum": 1.5, "max": 4, "en": 1},
+                }
+            ],
+            [],
+            [
+                {
+                    "timestamp": "2013-01-01",
+                    "result": {"count": 3, "sum": None, "max": 7, "en": 0},
+                }
+            ],
+        ]
+        shards = [with_result(shard, result) for shard, result in zip(shards, results)]
+
+        sharding.merge_results(query, shards)
+
+        assert query.result == [
+            {
+                "timestamp": "2013-01-01",
+                "result": {"count": 5, "sum": 1.5, "max": 7, "en": 1},
+            }
+        ]
+        assert json.loads(query.result_json) == query.result
+
+    def test_merge_groupby_all_granularity(self):
+        query = build("groupBy", granularity="all", dimensions=["kind", "tags"])
+
+        def row(timestamp, kind, tags, count):
+            event = {"kind": kind, "tags": tags, "count": count}
+            return {"version": "v1", "timestamp": timestamp, "event": event}
+
+        shards = sharding.split_query(query, 2)
+        results = [
+            [row("2013-01-01", "a", ["x"], 1), row("2013-01-01", "b", None, 2)],
+            [row("2013-01-03", "c", None, 3), row("2013-01-03", "a", ["x"], 4)],
+        ]
+        shards = [with_result(shard, result) for shard, result in zip(shards, results)]
+
+        sharding.merge_results(query, shards)
+
+        assert query.result == [
+            row("2013-01-01", "a", ["x"], 5),
+            row("2013-01-01", "b", None, 2),
+            row("2013-01-01", "c", None, 3),
+        ]
+        assert json.loads(query.result_json) == query.result
+
+    def test_empty_results(self):
+        query = build(granularity="all")
+        shards = [with_result(shard, []) for shard in sharding.split_query(query, 2)]
+
+        assert sharding.merge_results(query, shards).result == []
+        assert query.result_json == "[]"
+
+    def test_result_json(self):
+        query = build()
+        shards = [
+            with_result(shard, [{"timestamp": str(i), "result": {"count": i}}])
+            for i, shard in enumerate(sharding.split_query(query, 2))
+        ]
+
+        sharding.merge_results(query, shards, json_codec="json", decode=False)
+
+        assert isinstance(query.result_json, bytes)
+        assert json.loads(query.result_json) == query.result
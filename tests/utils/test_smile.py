@@ -0,0 +1,249 @@
+# -*- coding: UTF-8 -*-
+
+import struct
+from decimal import Decimal
+
+import pytest
+
+from pydruid.utils import smile
+
+# header with shared names enabled, as written by Jackson by default
+HEADER = b":)\n\x01"
+
+# a result written by Jackson's SmileGenerator 2.15, with shared names and
+# values, and a name longer than 64 bytes
+JACKSON_RESULT = bytes.fromhex(
+    "3a290a03f8fa8874696d657374616d7057323031352d31322d32395430303a30303a30302e30"
+    "30305a85726573756c74f8fa88757365725f6e616d6544616c696365346c6f6e675f6e616d65"
+    "6c6f6e675f6e616d656c6f6e675f6e616d656c6f6e675f6e616d656c6f6e675f6e616d656c6f"
+    "6e675f6e616d656c6f6e675f6e616d656c6f6e675f6e616d656c6f6e675f6e616d656c6f6e67"
+    "5f6e616d65fcc084636f756e7429003f7c00000000000000836c616e6741656efbfa4242626f"
+    "6243c244290040040000000000000045416672fbfa420243c444290040090000000000000045"
+    "03fbf9fbfa4057323031352d31322d33305430303a30303a30302e3030305a41f8fa420243d4"
+    "4429003f7c000000000000004503fbfa420443d64429004004000000000000004505fbfa4202"
+    "43d84429004009000000000000004503fbf9fbf9"
+)
+
+
+def vint(value):
+    """Encode an unsigned variable length int; the last byte has 6 bits."""
+    data = [0x80 | (value & 0x3F)]
+    value >>= 6
+    while value:
+        data.insert(0, value & 0x7F)
+        value >>= 7
+    return bytes(data)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def seven_bit(value, length):
+    return bytes((value >> (7 * i)) & 0x7F for i in reversed(range(length)))
+
+
+def seven_bit_binary(raw):
+    """Encode bytes in groups of 7 bits, as used by binary and big numbers."""
+    data = b""
+    for i in range(0, len(raw) - len(raw) % 7, 7):
+        data += seven_bit(int.from_bytes(raw[i : i + 7], "big"), 8)
+    left = len(raw) % 7
+    if left:
+        value = int.from_bytes(raw[-left:], "big")
+        data += seven_bit(value >> left, left) + bytes([value & ((1 << left) - 1)])
+    return data
+
+
+def ascii_name(name):
+    return bytes([0x7F + len(name)]) + name.encode("ascii")
+
+
+def ascii_value(value):
+    return bytes([0x3F + len(value)]) + value.encode("ascii")
+
+
+class TestSmile:
+    def test_object(self):
+        assert smile.loads(HEADER + b"\xfa\x80a\xc2\xfb") == {"a": 1}
+
+    def test_literals(self):
+        data = HEADER + b"\xf8\x20\x21\x22\x23\xc0\xc1\xdf\xf9\xff"
+        assert smile.loads(data) == ["", None, False, True, 0, -1, -16]
+
+    def test_ints(self):
+        data = (
+            HEADER
+            + b"\xf8"
+            + b"\x24"
+            + vint(zigzag(123456))
+            + b"\x24"
+            + vint(zigzag(-7000))
+            + b"\x25"
+            + vint(zigzag(2 ** 40))
+            + b"\xf9"
+        )
+        assert smile.loads(data) == [123456, -7000, 2 ** 40]
+
+    def test_floats(self):
+        double = struct.unpack(">Q", struct.pack(">d", -1.5e300))[0]
+        single = struct.unpack(">I", struct.pack(">f", 0.25))[0]
+        data = (
+            HEADER
+            + b"\xf8\x29"
+            + seven_bit(double, 10)
+            + b"\x28"
+            + seven_bit(single, 5)
+            + b"\xf9"
+        )
+        assert smile.loads(data) == [-1.5e300, 0.25]
+
+    def test_big_numbers(self):
+        big = (2 ** 64).to_bytes(9, "big")
+        unscaled = (-12345).to_bytes(2, "big", signed=True)
+        data = (
+            HEADER
+            + b"\xf8"
+            + b"\x26"
+            + vint(len(big))
+            + seven_bit_binary(big)
+            + b"\x2a"
+            + vint(zigzag(3))
+            + vint(len(unscaled))
+            + seven_bit_binary(unscaled)
+            + b"\xf9"
+        )
+        assert smile.loads(data) == [2 ** 64, Decimal("-12.345")]
+
+    def test_strings(self):
+        unicode = "㬓 über".encode("utf-8")
+        long_ascii = b"x" * 100
+        long_unicode = "ü".encode("utf-8") * 50
+        data = (
+            HEADER
+            + b"\xf8"
+            + ascii_value("a" * 64)
+            + bytes([0x7E + len(unicode)])
+            + unicode
+            + b"\xe0"
+            + long_ascii
+            + b"\xfc"
+            + b"\xe4"
+            + long_unicode
+            + b"\xfc"
+            + b"\xf9"
+        )
+        assert smile.loads(data) == ["a" * 64, "㬓 über", "x" * 100, "ü" * 50]
+
+    def test_binary(self):
+        for raw in [b"", b"\xff", bytes(range(7)), bytes(range(200, 256))]:
+            data = HEADER + b"\xe8" + vint(len(raw)) + seven_bit_binary(raw)
+            assert smile.loads(data) == raw
+
+        raw = bytes(range(256))
+        data = b":)\n\x05\xfd" + vint(len(raw)) + raw
+        assert smile.loads(data) == raw
+
+    def test_shared_names(self):
+        rows = b"\xf8" + (b"\xfa" + ascii_name("user") + b"\xc2" + b"\xfb")
+        rows += b"\xfa\x40\xc4\xfb" * 2 + b"\xf9"
+        assert smile.loads(HEADER + rows) == [{"user": 1}, {"user": 2}, {"user": 2}]
+
+    def test_shared_values(self):
+        data = (
+            b":)\n\x03\xf8"
+            + ascii_value("en")
+            + ascii_value("fr")
+            + b"\x02\x01"
+            + b"\xec\x01"
+            + b"\xf9"
+        )
+        assert smile.loads(data) == ["en", "fr", "fr", "en", "fr"]
+
+    def test_long_shared_name_reference(self):
+        data = HEADER + b"\xfa"
+        for i in range(400):
+            data += ascii_name("n{0}".format(i)) + b"\xc0"
+        # index 300 refers to "n300"
+        data += b"\x31\x2c\xc2\xfb"
+        obj = smile.loads(data)
+        assert len(obj) == 400
+        assert obj["n300"] == 1
+
+    def test_shared_long_names(self):
+        long_name = "n" * 100
+        data = (
+            HEADER
+            + b"\xf8\xfa"
+            + b"\x34"
+            + long_name.encode("ascii")
+            + b"\xfc"
+            + b"\xc2"
+            + ascii_name("user")
+            + b"\xc4"
+            + b"\xfb"
+            # references to the long name and to the name after it
+            + b"\xfa\x40\xc6\x41\xc8\xfb"
+            + b"\xfa\x30\x01\xca\xfb"
+            + b"\xf9"
+        )
+        assert smile.loads(data) == [
+            {long_name: 1, "user": 2},
+            {long_name: 3, "user": 4},
+            {"user": 5},
+        ]
+
+    def test_shared_names_reset(self):
+        data = HEADER + b"\xfa"
+        for i in range(smile.MAX_SHARED + 1):
+            data += ascii_name("n{0}".format(i)) + b"\xc0"
+        # the table was reset when "n1024" was added, so it's now at index 0
+        data += b"\x40\xc2\xfb"
+        assert smile.loads(data)["n1024"] == 1
+
+    def test_jackson_result(self):
+        long_name = "long_name" * 10
+
+        def row(user_name, value, count, lang):
+            return {
+                "user_name": user_name,
+                long_name: value,
+                "count": count,
+                "lang": lang,
+            }
+
+        assert smile.loads(JACKSON_RESULT) == [
+            {
+                "timestamp": "2015-12-29T00:00:00.000Z",
+                "result": [
+                    row("alice", 0, 1.5, "en"),
+                    row("bob", 1, 3.0, "fr"),
+                    row("alice", 2, 4.5, "en"),
+                ],
+            },
+            {
+                "timestamp": "2015-12-30T00:00:00.000Z",
+                "result": [
+                    row("alice", 10, 1.5, "en"),
+                    row("bob", 11, 3.0, "fr"),
+                    row("alice", 12, 4.5, "en"),
+                ],
+            },
+        ]
+
+    @pytest.mark.parametrize(
+        "data",
+        [
+            b"",
+            b"{}",
+            b":)\n\x10\xfa\xfb",
+            HEADER + b"\xfa\x80",
+            HEADER + b"\xfa\x40",
+            HEADER + b"\xf8\x00\xf9",
+            b":)\n\x00\xfa\x80a\x40",
+            HEADER + b"\xfa\x80a\xc2\xfb\xfa",
+        ],
+    )
+    def test_invalid(self, data):
+        with pytest.raises(smile.SmileError):
+            smile.loads(data)
@@ -0,0 +1,251 @@
+# -*- coding: UTF-8 -*-
+
+import gzip
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import zstandard
+
+from pydruid.client import PyDruid
+from pydruid.utils.aggregators import doublesum
+from pydruid.utils.transport import (
+    ACCEPT_ENCODING,
+    ConnectionPool,
+    decompress,
+    decompressor,
+    KeepAliveHandler,
+)
+
+RESULT = b'[{"timestamp": "2015-12-30T14:14:49.000Z", "result": {"count": 1}}]'
+
+
+class BrokerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.last_request = (self.headers, body)
+        if self.path == "/druid/v2/slow":
+            time.sleep(0.5)
+
+        result = RESULT
+        encoding = None
+        if self.path == "/druid/v2/gzip":
+            result, encoding = gzip.compress(RESULT), "gzip"
+        elif self.path == "/druid/v2/zstd":
+            result, encoding = zstandard.ZstdCompressor().compress(RESULT), "zstd"
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(result)))
+        self.end_headers()
+        self.wfile.write(result)
+        if self.path == "/druid/v2/close":
+            # close the connection without telling the client
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def broker():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BrokerHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def create_client(server, endpoint="druid/v2/", **kwargs):
+    url = "http://{0}:{1}".format(*server.server_address)
+    return PyDruid(url, endpoint, **kwargs)
+
+
+def timeseries(client):
+    return client.timeseries(
+        datasource="testdatasource",
+        granularity="all",
+        intervals="2015-12-29/pt1h",
+        aggregations={"count": doublesum("count")},
+    )
+
+
+class TestConnectionPool:
+    def test_connection_reused(self, broker):
+        client = create_client(broker)
+        for _ in range(3):
+            assert timeseries(client).result == [
+                {"timestamp": "2015-12-30T14:14:49.000Z", "result": {"count": 1}}
+            ]
+
+        host = "http://{0}:{1}".format(*broker.server_address)
+        assert client.pool_stats() == {
+            host: {"connections": 1, "requests": 3, "idle": 1}
+        }
+
+    def test_concurrent_queries(self, broker):
+        client = create_client(broker, pool_size=2)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: timeseries(client), range(20)))
+
+        assert all(len(result) == 1 for result in results)
+        (stats,) = client.pool_stats().values()
+        assert stats["requests"] == 20
+        assert stats["idle"] <= 2
+
+    def test_stale_connection_is_replaced(self, broker):
+        client = create_client(broker, endpoint="druid/v2/close")
+        for _ in range(3):
+            assert len(timeseries(client)) == 1
+
+        (stats,) = client.pool_stats().values()
+        assert stats["connections"] == 3
+
+    def test_read_timeout(self, broker):
+        client = create_client(broker, endpoint="druid/v2/slow", read_timeout=0.1)
+        with pytest.raises(OSError):
+            timeseries(client)
+
+    def test_proxies_are_per_client(self, broker):
+        client = create_client(broker)
+        client.set_proxies({"http": "http://proxy.invalid:3128"})
+
+        assert urllib.request._opener is None
+        assert len(timeseries(create_client(broker))) == 1
+        with pytest.raises(urllib.error.URLError):
+            timeseries(client)
+
+    def test_streamed_response_releases_connection(self, broker):
+        client = create_client(broker)
+        for _ in range(3):
+            assert len(list(client.stream(timeseries(client)))) == 1
+
+        (stats,) = client.pool_stats().values()
+        assert stats["connections"] == 1
+
+    def test_close(self, broker):
+        client = create_client(broker)
+        timeseries(client)
+        client.close()
+
+        (stats,) = client.pool_stats().values()
+        assert stats["idle"] == 0
+
+    def test_unread_response_is_discarded(self, broker):
+        pool = ConnectionPool()
+        opener = urllib.request.build_opener(KeepAliveHandler(pool))
+        url = "http://{0}:{1}/druid/v2/".format(*broker.server_address)
+
+        response = opener.open(urllib.request.Request(url, b"{}"))
+        response.read(5)
+        response.close()
+
+        (stats,) = pool.stats().values()
+        assert stats["idle"] == 0
+
+
+class TestCompression:
+    def test_accept_encoding(self, broker):
+        timeseries(create_client(broker))
+
+        headers, _ = broker.last_request
+        assert headers["Accept-Encoding"] == ACCEPT_ENCODING
+        assert headers["Accept-Encoding"].split(", ") == ["zstd", "gzip", "deflate"]
+
+    @pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+    def test_compressed_response(self, broker, encoding):
+        client = create_client(broker, endpoint="druid/v2/" + encoding)
+        query = timeseries(client)
+
+        assert query.result == [
+            {"timestamp": "2015-12-30T14:14:49.000Z", "result": {"count": 1}}
+        ]
+        stats = query.transfer_stats
+        assert stats["content_encoding"] == encoding
+        assert stats["decoded_bytes"] == len(RESULT)
+        assert 0 < stats["response_bytes"] != len(RESULT)
+
+        # the connection is still reused
+        timeseries(client)
+        (stats,) = client.pool_stats().values()
+        assert stats["connections"] == 1
+
+    @pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+    def test_compressed_response_streamed(self, broker, encoding):
+        client = create_client(broker, endpoint="druid/v2/" + encoding)
+        query = client.query_builder.timeseries(
+            {"datasource": "testdatasource", "intervals": "2015-12-29/pt1h"}
+        )
+
+        rows = list(client.stream(query, chunk_size=3))
+
+        assert rows == [
+            {"timestamp": "2015-12-30T14:14:49.000Z", "result": {"count": 1}}
+        ]
+        assert query.transfer_stats["decoded_bytes"] == len(RESULT)
+
+    def test_uncompressed_response(self, broker):
+        query = timeseries(create_client(broker))
+
+        assert query.transfer_stats == {
+            "request_bytes": len(broker.last_request[1]),
+            "response_bytes": len(RESULT),
+            "decoded_bytes": len(RESULT),
+            "content_encoding": "identity",
+        }
+
+    def test_compressed_request(self, broker):
+        client = create_client(broker, compress_requests_over=10)
+        query = timeseries(client)
+
+        headers, body = broker.last_request
+        assert headers["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(body)) == query.query_dict
+        assert query.transfer_stats["request_bytes"] == len(body)
+
+    def test_small_request_is_not_compressed(self, broker):
+        client = create_client(broker, compress_requests_over=10000)
+        query = timeseries(client)
+
+        headers, body = broker.last_request
+        assert "Content-Encoding" not in headers
+        assert json.loads(body) == query.query_dict
+
+
+class TestDecompressor:
+    def test_identity(self):
+        assert decompressor(None) is None
+        assert decompressor("identity") is None
+        assert decompress(RESULT, None) == RESULT
+
+    @pytest.mark.parametrize(
+        "encoding, compress",
+        [
+            ("gzip", gzip.compress),
+            ("deflate", zlib.compress),
+            ("zstd", zstandard.ZstdCompressor().compress),
+        ],
+    )
+    def test_incremental(self, encoding, compress):
+        data = compress(RESULT)
+        obj = decompressor(encoding)
+
+        chunks = [obj.decompress(data[i : i + 4]) for i in range(0, len(data), 4)]
+
+        assert b"".join(chunks) + obj.flush() == RESULT
+        assert decompress(data, encoding.upper()) == RESULT
+
+    def test_unsupported_encoding(self):
+        with pytest.raises(IOError):
+            decompressor("br")